@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк раскладки промпта под prefix caching.
+
+Сравнивает раскладки сообщений на локальном OpenAI-совместимом стабе
+(scripts/llm_stub.py) с включённым и выключенным prefix caching:
+  - context-first: найденные чанки перед системным промптом (префикс всегда разный);
+  - legacy:        системный промпт + по system-сообщению на чанк (как было);
+  - stable-prefix: системный промпт + справка по программам, затем контекст и вопрос
+                   (как сейчас собирает RAGService._build_messages).
+
+    python -m scripts.bench_prefix_cache --requests 200 --concurrency 8 --out bench.json
+"""
+import argparse
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from openai import OpenAI
+
+from scripts.llm_stub import StubLLM, start_stub_server
+from src.rag.context import TokenCounter, pack_context, render_context
+from src.rag.openai_pipeline import (
+    DEFAULT_SYSTEM_PROMPT,
+    build_program_overview,
+    chunk_text_with_offsets,
+    load_json_docs,
+)
+
+QUESTIONS = [
+    "Сколько бюджетных мест на программе?",
+    "Чем отличается AI Product от Искусственного интеллекта?",
+    "Какие вступительные испытания?",
+    "Какие элективы есть во втором семестре?",
+    "Кто менеджер программы и как с ним связаться?",
+    "Сколько стоит обучение на контракте?",
+    "Есть ли военный учебный центр?",
+    "Какие карьерные перспективы после выпуска?",
+]
+
+
+def build_layout(layout: str, system_prompt: str, overview: str, question: str, docs):
+    if layout == "legacy":
+        return (
+            [{"role": "system", "content": system_prompt}]
+            + [{"role": "system", "content": d["page_content"]} for d in docs]
+            + [{"role": "user", "content": question}]
+        )
+    blocks, _ = pack_context(docs, TokenCounter(), budget=1500)
+    context = render_context(blocks)
+    if layout == "context-first":
+        return [
+            {"role": "system", "content": context + "\n\n" + system_prompt + "\n\n" + overview},
+            {"role": "user", "content": question},
+        ]
+    return [
+        {"role": "system", "content": system_prompt + "\n\n" + overview},
+        {"role": "system", "content": context},
+        {"role": "user", "content": question},
+    ]
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+def run_case(layout, prefix_cache, args, chunks, system_prompt, overview):
+    llm = StubLLM(prefill_ms=args.prefill_ms, decode_ms=args.decode_ms,
+                  output_tokens=args.output_tokens, prefix_cache=prefix_cache)
+    server, llm, base_url = start_stub_server(llm=llm)
+    client = OpenAI(api_key="stub", base_url=base_url)
+    rnd = random.Random(args.seed)
+    jobs = [
+        (rnd.choice(QUESTIONS), rnd.sample(chunks, min(args.top_k, len(chunks))))
+        for _ in range(args.requests)
+    ]
+
+    def one(job):
+        question, docs = job
+        messages = build_layout(layout, system_prompt, overview, question, docs)
+        t0 = time.perf_counter()
+        resp = client.chat.completions.create(model="stub", messages=messages, max_tokens=args.output_tokens)
+        return time.perf_counter() - t0, resp.usage
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(one, jobs))
+    wall = time.perf_counter() - t0
+    server.shutdown()
+
+    lat = [r[0] * 1000 for r in results]
+    prompt = sum(r[1].prompt_tokens for r in results)
+    cached = sum(r[1].prompt_tokens_details.cached_tokens for r in results)
+    return {
+        "layout": layout,
+        "prefix_cache": prefix_cache,
+        "requests": len(results),
+        "throughput_rps": round(len(results) / wall, 2),
+        "latency_ms_p50": round(percentile(lat, 50), 1),
+        "latency_ms_p95": round(percentile(lat, 95), 1),
+        "prompt_tokens_mean": round(prompt / len(results), 1),
+        "cached_token_ratio": round(cached / prompt, 3) if prompt else 0.0,
+        "prefill_ms_mean": round((prompt - cached) * args.prefill_ms / len(results), 2),
+    }
+
+
+def main():
+    p = argparse.ArgumentParser(description="Бенчмарк раскладки промпта под prefix caching")
+    p.add_argument("--json", default="data/programs.json")
+    p.add_argument("--requests", type=int, default=100)
+    p.add_argument("--concurrency", type=int, default=8)
+    p.add_argument("--top-k", type=int, default=5)
+    p.add_argument("--chunk-size", type=int, default=500)
+    p.add_argument("--prefill-ms", type=float, default=0.2, help="мс на непокешированный токен промпта")
+    p.add_argument("--decode-ms", type=float, default=2.0)
+    p.add_argument("--output-tokens", type=int, default=16)
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--out", default=None, help="куда записать результаты (JSON)")
+    args = p.parse_args()
+
+    docs = load_json_docs(Path(args.json))
+    chunks = [
+        {"page_content": c, "source": d["source"], "start": s}
+        for d in docs for s, c in chunk_text_with_offsets(d["page_content"], args.chunk_size, 100)
+    ]
+    system_prompt = DEFAULT_SYSTEM_PROMPT
+    overview = build_program_overview(Path(args.json))
+
+    results = [
+        run_case(layout, prefix_cache, args, chunks, system_prompt, overview)
+        for layout in ("context-first", "legacy", "stable-prefix")
+        for prefix_cache in (False, True)
+    ]
+    for r in results:
+        print(
+            f"{r['layout']:>14} prefix_cache={str(r['prefix_cache']):5} "
+            f"rps={r['throughput_rps']:7.2f} p50={r['latency_ms_p50']:7.1f}ms "
+            f"p95={r['latency_ms_p95']:7.1f}ms cached={r['cached_token_ratio']:.0%} "
+            f"prefill={r['prefill_ms_mean']:.1f}ms"
+        )
+    if args.out:
+        Path(args.out).write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк RAG-пайплайна по этапам:
+  - cold_start: время импорта пайплайна (в отдельном процессе) и построение
+                RAGService по этапам (загрузка PDF/JSON, эмбеддер, чанкинг,
+                эмбеддинг, индекс) — с пустым кешем и повторно с тёплым;
+  - retrieve:   перцентили латентности _retrieve для нескольких размеров корпуса
+                (корпус размножается синтетическими копиями) и top_k;
+  - e2e:        пропускная способность и латентность aask при N одновременных
+                пользователях; генерация — локальный стаб (scripts/llm_stub.py)
+                с настраиваемой задержкой на токен.
+Результаты пишутся в JSON (--out); --compare old.json печатает изменения
+относительно прошлого прогона.
+
+    python -m scripts.bench_rag --embed hash --out bench.json
+    python -m scripts.bench_rag --embed intfloat/multilingual-e5-large-instruct --sizes 1,10 --compare bench.json
+    python -m scripts.bench_rag --embed intfloat/multilingual-e5-large-instruct --embed-backend onnx-int8 --compare bench.json
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import platform
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from scripts.bench_prefix_cache import QUESTIONS, percentile
+from scripts.llm_stub import StubLLM, start_stub_server
+from src.rag.embedders import load_embedder
+from src.rag.openai_pipeline import RAGService
+
+
+class HashEmbedder:
+    """Эмбеддер без модели (хеши слов): измеряет всё, кроме самой нейросети."""
+
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+
+    def encode(self, texts, **kwargs):
+        out = np.zeros((len(texts), self.dim), dtype="float32")
+        for i, t in enumerate(texts):
+            for w in re.findall(r"\w+", t.lower()):
+                h = int.from_bytes(hashlib.md5(w.encode("utf-8")).digest()[:8], "little")
+                out[i, h % self.dim] += 1.0 if (h >> 32) & 1 else -1.0
+            out[i, 0] += 1e-3
+        return out
+
+
+def latency_stats(values_sec):
+    ms = [v * 1000 for v in values_sec]
+    return {
+        "p50_ms": round(percentile(ms, 50), 3),
+        "p95_ms": round(percentile(ms, 95), 3),
+        "p99_ms": round(percentile(ms, 99), 3),
+        "mean_ms": round(sum(ms) / len(ms), 3),
+    }
+
+
+def make_rag(args, cache_dir=None, **overrides) -> RAGService:
+    params = dict(
+        model_name="stub",
+        json_path=Path(args.json),
+        pdf_dir=Path(args.pdf_dir),
+        hf_embed_model=args.embed,
+        embedder=HashEmbedder() if args.embed == "hash" else args.embedder,
+        embed_backend=args.embed_backend,
+        cache_dir=cache_dir,
+        min_score=0.0,
+        hybrid=args.hybrid,
+        index_type=args.index_type,
+        quantization=args.quantization,
+        max_tokens=args.output_tokens,
+    )
+    params.update(overrides)
+    return RAGService(**params)
+
+
+# ─── ЭТАПЫ ──────────────────────────────────────────────────────────────────────
+def import_seconds(module: str = "src.rag.openai_pipeline") -> float:
+    """Время импорта модуля в чистом интерпретаторе."""
+    code = f"import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+    return float(subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout)
+
+
+def bench_cold_start(args):
+    out = {"import_s": round(import_seconds(), 4)}
+    with tempfile.TemporaryDirectory() as tmp:
+        for run in ("cold", "warm"):
+            t0 = time.perf_counter()
+            rag = make_rag(args, cache_dir=Path(tmp))
+            total = time.perf_counter() - t0
+            out[run] = {k: round(v, 4) for k, v in rag.startup_timings.items()}
+            out[run]["total"] = round(total, 4)
+            out[run]["chunks"] = len(rag.chunks)
+            rag.close()
+    return out
+
+
+def bench_retrieve(args):
+    results = []
+    for size in args.sizes:
+        rag = make_rag(args, batch_max_size=1, answer_cache_size=0)
+        base = [c["page_content"] for c in rag.chunks]
+        if size > 1:
+            rag.update_documents([
+                {"source": f"synthetic-{copy}-{i}", "page_content": f"{text} (копия {copy})"}
+                for copy in range(1, size) for i, text in enumerate(base)
+            ])
+        for top_k in args.top_ks:
+            rag.top_k_retrieval = top_k
+            rag.set_search_params()                  # ширина поиска под новый top_k
+            for q in QUESTIONS:                      # прогрев
+                rag._retrieve(q)
+            lat = []
+            for i in range(args.queries):
+                t0 = time.perf_counter()
+                rag._retrieve(QUESTIONS[i % len(QUESTIONS)])
+                lat.append(time.perf_counter() - t0)
+            results.append({"size": size, "chunks": len(rag.chunks), "top_k": top_k, **latency_stats(lat)})
+            print(f"retrieve size={size}x chunks={len(rag.chunks)} top_k={top_k}: {results[-1]}")
+        rag.close()
+    return results
+
+
+async def _simulate_users(rag: RAGService, users: int, per_user: int):
+    latencies = []
+
+    async def user(uid: int):
+        for j in range(per_user):
+            t0 = time.perf_counter()
+            await rag.aask(QUESTIONS[(uid + j) % len(QUESTIONS)])
+            latencies.append(time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(user(u) for u in range(users)))
+    return time.perf_counter() - t0, latencies
+
+
+def bench_e2e(args):
+    results = []
+    rag = make_rag(args, answer_cache_size=0, max_concurrent_generations=args.max_concurrent)
+    for users in args.users:
+        llm = StubLLM(prefill_ms=args.prefill_ms, decode_ms=args.decode_ms, output_tokens=args.output_tokens)
+        server, llm, base_url = start_stub_server(llm=llm)
+        rag.api_base = base_url                      # клиент под новый цикл создаётся лениво
+        wall, lat = asyncio.run(_simulate_users(rag, users, args.requests_per_user))
+        server.shutdown()
+        results.append({
+            "users": users,
+            "requests": len(lat),
+            "throughput_rps": round(len(lat) / wall, 2),
+            **latency_stats(lat),
+            "llm": llm.stats(),
+        })
+        print(f"e2e users={users}: {results[-1]}")
+    rag.close()
+    return results
+
+
+# ─── СРАВНЕНИЕ ──────────────────────────────────────────────────────────────────
+def _flatten(results, prefix=""):
+    flat = {}
+    if isinstance(results, dict):
+        for k, v in results.items():
+            flat.update(_flatten(v, f"{prefix}.{k}" if prefix else k))
+    elif isinstance(results, list):
+        for item in results:
+            if not isinstance(item, dict):
+                continue
+            # строки таблиц идентифицируем параметрами прогона, а не позицией
+            key = ",".join(f"{k}={item[k]}" for k in ("size", "top_k", "users") if k in item)
+            flat.update(_flatten(item, f"{prefix}[{key}]"))
+    elif isinstance(results, (int, float)) and not isinstance(results, bool):
+        flat[prefix] = results
+    return flat
+
+
+def compare(old, new):
+    old_f, new_f = _flatten(old), _flatten(new)
+    for key in sorted(old_f.keys() & new_f.keys()):
+        if key.startswith("meta.") or key.rsplit(".", 1)[-1] in ("size", "top_k", "users"):
+            continue
+        a, b = old_f[key], new_f[key]
+        change = f"{(b - a) / a:+.1%}" if a else "n/a"
+        print(f"{key:60} {a:>12} -> {b:<12} {change}")
+
+
+def main():
+    p = argparse.ArgumentParser(description="Бенчмарк RAG-пайплайна")
+    p.add_argument("--json", default="data/programs.json")
+    p.add_argument("--pdf-dir", default="data/pdfs")
+    p.add_argument("--embed", default="hash", help="hash (без модели) или HF id эмбеддера")
+    p.add_argument("--embed-backend", choices=["torch", "onnx", "onnx-int8"], default="torch")
+    p.add_argument("--stages", default="cold_start,retrieve,e2e")
+    p.add_argument("--sizes", default="1,10,50", help="во сколько раз размножить корпус")
+    p.add_argument("--top-ks", default="5,20")
+    p.add_argument("--queries", type=int, default=200)
+    p.add_argument("--users", default="1,8,32", help="число одновременных пользователей")
+    p.add_argument("--requests-per-user", type=int, default=5)
+    p.add_argument("--max-concurrent", type=int, default=8, help="max_concurrent_generations")
+    p.add_argument("--prefill-ms", type=float, default=0.05)
+    p.add_argument("--decode-ms", type=float, default=5.0)
+    p.add_argument("--output-tokens", type=int, default=32)
+    p.add_argument("--hybrid", action="store_true")
+    p.add_argument("--index-type", default="auto")
+    p.add_argument("--quantization", default="none")
+    p.add_argument("--out", default=None, help="куда записать результаты (JSON)")
+    p.add_argument("--compare", default=None, help="JSON прошлого прогона для сравнения")
+    args = p.parse_args()
+    args.sizes = [int(x) for x in args.sizes.split(",")]
+    args.top_ks = [int(x) for x in args.top_ks.split(",")]
+    args.users = [int(x) for x in args.users.split(",")]
+    stages = args.stages.split(",")
+
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger().setLevel(logging.WARNING)    # пайплайн логирует каждый запрос на INFO
+    os.environ.setdefault("OPENAI_API_KEY", "stub")
+    # настоящий эмбеддер грузим один раз (кроме замера холодного старта)
+    args.embedder = None
+    if args.embed != "hash" and stages != ["cold_start"]:
+        args.embedder = load_embedder(args.embed, args.embed_backend)
+
+    results = {
+        "meta": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+            "args": {k: v for k, v in vars(args).items() if k != "embedder"},
+        }
+    }
+    if "cold_start" in stages:
+        embedder, args.embedder = args.embedder, None
+        results["cold_start"] = bench_cold_start(args)
+        args.embedder = embedder
+        print("cold_start:", results["cold_start"])
+    if "retrieve" in stages:
+        results["retrieve"] = bench_retrieve(args)
+    if "e2e" in stages:
+        results["e2e"] = bench_e2e(args)
+
+    if args.out:
+        Path(args.out).write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+    if args.compare:
+        compare(json.loads(Path(args.compare).read_text(encoding="utf-8")), results)
+
+
+if __name__ == "__main__":
+    main()
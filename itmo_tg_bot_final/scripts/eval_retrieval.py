@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Оценка качества ретрива на размеченном наборе запросов.
+
+Каждая строка data/eval/retrieval_queries.jsonl — {"query": ..., "relevant": [подстроки]};
+чанк считается релевантным, если содержит все подстроки (без учёта регистра и
+пробелов). Сравнивает dense-поиск и гибридный BM25 + dense (RRF) по recall@k и MRR,
+а с --backends — ещё и бэкенды эмбеддера (качество и латентность эмбеддинга запроса).
+
+    python -m scripts.eval_retrieval --k 1 3 5 --out eval.json
+    python -m scripts.eval_retrieval --backends torch onnx-int8
+"""
+import argparse
+import json
+import re
+import time
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+from src.rag.openai_pipeline import RAGService
+
+
+def _norm(text: str) -> str:
+    return re.sub(r"\s+", " ", text).lower()
+
+
+def is_relevant(chunk: dict, relevant) -> bool:
+    text = _norm(chunk["page_content"])
+    return all(_norm(r) in text for r in relevant)
+
+
+def evaluate(rag: RAGService, queries, ks):
+    max_k = max(ks)
+    rag.top_k_retrieval = max_k
+    hits_at = {k: 0 for k in ks}
+    mrr = 0.0
+    for q in queries:
+        docs = rag._retrieve(q["query"])
+        ranks = [i for i, d in enumerate(docs, start=1) if is_relevant(d, q["relevant"])]
+        if ranks:
+            mrr += 1.0 / ranks[0]
+        for k in ks:
+            hits_at[k] += bool(ranks and ranks[0] <= k)
+    n = len(queries)
+    return {**{f"recall@{k}": round(hits_at[k] / n, 3) for k in ks}, "mrr": round(mrr / n, 3)}
+
+
+def embed_latency_ms(rag: RAGService, queries) -> float:
+    """Средняя латентность эмбеддинга одного запроса (по одному, как в боте без батчинга)."""
+    rag.embedder.encode([queries[0]["query"]])          # прогрев
+    t0 = time.perf_counter()
+    for q in queries:
+        rag.embedder.encode([q["query"]])
+    return round((time.perf_counter() - t0) * 1000 / len(queries), 2)
+
+
+def main():
+    load_dotenv()
+    p = argparse.ArgumentParser(description="Recall@k: dense vs гибридный поиск")
+    p.add_argument("--queries", default="data/eval/retrieval_queries.jsonl")
+    p.add_argument("--json", default="data/programs.json")
+    p.add_argument("--pdf-dir", default="data/pdfs")
+    p.add_argument("--cache-dir", default="data/cache")
+    p.add_argument("--embed", default="intfloat/multilingual-e5-large-instruct")
+    p.add_argument("--backends", nargs="+", default=["torch"], choices=["torch", "onnx", "onnx-int8"],
+                   help="бэкенды эмбеддера для сравнения")
+    p.add_argument("--chunk-size", type=int, default=500)
+    p.add_argument("--chunk-overlap", type=int, default=100)
+    p.add_argument("--k", type=int, nargs="+", default=[1, 3, 5])
+    p.add_argument("--out", default=None)
+    args = p.parse_args()
+
+    queries = [json.loads(l) for l in Path(args.queries).read_text(encoding="utf-8").splitlines() if l.strip()]
+    results = {}
+    for backend in args.backends:
+        rag = RAGService(
+            model_name="eval",
+            json_path=Path(args.json),
+            pdf_dir=Path(args.pdf_dir),
+            hf_embed_model=args.embed,
+            embed_backend=backend,
+            chunk_size=args.chunk_size,
+            chunk_overlap=args.chunk_overlap,
+            min_score=0.0,
+            cache_dir=Path(args.cache_dir) if args.cache_dir else None,
+            hybrid=True,
+            batch_max_size=1,
+            answer_cache_size=0,
+        )
+        # без --backends ключи как раньше: hybrid / dense
+        prefix = f"{backend}/" if len(args.backends) > 1 else ""
+        results[prefix + "hybrid"] = evaluate(rag, queries, args.k)
+        rag._state = rag._state._replace(lexical=None)
+        results[prefix + "dense"] = {**evaluate(rag, queries, args.k), "embed_ms": embed_latency_ms(rag, queries)}
+        rag.close()
+
+    for name, r in results.items():
+        print(f"{name:>17}: " + "  ".join(f"{k}={v}" for k, v in r.items()))
+    if args.out:
+        Path(args.out).write_text(json.dumps(results, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Локальный OpenAI-совместимый стаб LLM-сервера для тестов и бенчмарков.
+
+Эмулирует стоимость генерации: prefill (мс на токен промпта) и decode
+(мс на выходной токен), а также автоматический prefix caching как в vLLM —
+промпт режется на блоки по block_size токенов, и уже виденные префиксные
+блоки не «пересчитываются». Поддерживает /v1/chat/completions (обычный и
+stream=True), /v1/models и /health.
+
+    python -m scripts.llm_stub --port 8001 --prefill-ms 0.2 --decode-ms 20
+"""
+import argparse
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+
+def tokenize(text: str) -> List[str]:
+    # Грубая токенизация: по 3 символа — близко к реальной для русского текста
+    return [text[i : i + 3] for i in range(0, len(text), 3)]
+
+
+def render_prompt(messages: List[Dict]) -> str:
+    """Рендер в стиле chat template (ChatML), как его видит сервер."""
+    return "".join(
+        f"<|im_start|>{m['role']}\n{m['content']}<|im_end|>\n" for m in messages
+    )
+
+
+class StubLLM:
+    def __init__(
+        self,
+        prefill_ms: float = 0.1,
+        decode_ms: float = 5.0,
+        output_tokens: int = 16,
+        prefix_cache: bool = True,
+        block_size: int = 32,
+        reply: str = "Ответ стаба.",
+        fail_every: int = 0,
+        name: str = "stub",
+    ):
+        self.prefill_ms = prefill_ms
+        self.decode_ms = decode_ms
+        self.output_tokens = output_tokens
+        self.prefix_cache = prefix_cache
+        self.block_size = block_size
+        self.reply = reply
+        self.fail_every = fail_every      # каждый N-й запрос — 503
+        self.down = False                 # True — все запросы 503
+        self.name = name
+        self._blocks = set()
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+
+    def _prefill(self, tokens: List[str]) -> int:
+        """Возвращает число токенов, взятых из префиксного кеша."""
+        if not self.prefix_cache:
+            return 0
+        cached, h = 0, hashlib.sha1()
+        full = len(tokens) // self.block_size
+        with self._lock:
+            hit = True
+            for b in range(full):
+                h.update("".join(tokens[b * self.block_size : (b + 1) * self.block_size]).encode())
+                key = h.hexdigest()
+                if hit and key in self._blocks:
+                    cached += self.block_size
+                else:
+                    hit = False
+                    self._blocks.add(key)
+        return cached
+
+    def _should_fail(self) -> bool:
+        with self._lock:
+            self.requests += 1
+            n = self.requests
+        return self.down or (self.fail_every > 0 and n % self.fail_every == 0)
+
+    def run(self, body: Dict) -> Tuple[str, Dict, float]:
+        """Считает usage и суммарную задержку prefill; decode задаётся на токен."""
+        tokens = tokenize(render_prompt(body.get("messages", [])))
+        cached = self._prefill(tokens)
+        with self._lock:
+            self.prompt_tokens += len(tokens)
+            self.cached_tokens += cached
+        n_out = min(self.output_tokens, int(body.get("max_tokens") or self.output_tokens))
+        usage = {
+            "prompt_tokens": len(tokens),
+            "completion_tokens": n_out,
+            "total_tokens": len(tokens) + n_out,
+            "prompt_tokens_details": {"cached_tokens": cached},
+        }
+        prefill_sec = (len(tokens) - cached) * self.prefill_ms / 1000.0
+        return self.reply, usage, prefill_sec
+
+    def stats(self) -> Dict:
+        return {
+            "requests": self.requests,
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens,
+        }
+
+
+def _pieces(text: str, n: int) -> List[str]:
+    n = max(1, n)
+    step = max(1, -(-len(text) // n))
+    return [text[i : i + step] for i in range(0, len(text), step)]
+
+
+def make_handler(llm: StubLLM):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _json(self, code: int, payload: Dict):
+            data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path.rstrip("/").endswith("/models"):
+                self._json(200, {"object": "list", "data": [{"id": llm.name, "object": "model"}]})
+            elif self.path == "/health":
+                self._json(200, {"status": "ok"})
+            else:
+                self._json(404, {"error": "not found"})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length) or b"{}")
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._json(404, {"error": "not found"})
+                return
+            if llm._should_fail():
+                self._json(503, {"error": {"message": "stub overloaded"}})
+                return
+
+            reply, usage, prefill_sec = llm.run(body)
+            time.sleep(prefill_sec)
+            n_out = usage["completion_tokens"]
+            base = {"id": "stub-1", "created": int(time.time()), "model": body.get("model", llm.name)}
+
+            if not body.get("stream"):
+                time.sleep(n_out * llm.decode_ms / 1000.0)
+                self._json(200, {
+                    **base,
+                    "object": "chat.completion",
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": reply},
+                        "finish_reason": "stop",
+                    }],
+                    "usage": usage,
+                })
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            pieces = _pieces(reply, n_out)
+            per_piece = n_out * llm.decode_ms / 1000.0 / len(pieces)
+            for piece in pieces:
+                time.sleep(per_piece)
+                event = {**base, "object": "chat.completion.chunk", "choices": [
+                    {"index": 0, "delta": {"content": piece}, "finish_reason": None}
+                ]}
+                self.wfile.write(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode())
+                self.wfile.flush()
+            final = {**base, "object": "chat.completion.chunk",
+                     "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                     "usage": usage}
+            self.wfile.write(f"data: {json.dumps(final)}\n\ndata: [DONE]\n\n".encode())
+            self.wfile.flush()
+            self.close_connection = True
+
+    return Handler
+
+
+def start_stub_server(host: str = "127.0.0.1", port: int = 0, llm: Optional[StubLLM] = None):
+    """
+    Запускает стаб в фоновом потоке. Возвращает (server, llm, base_url);
+    остановка — server.shutdown().
+    """
+    llm = llm or StubLLM()
+    server = ThreadingHTTPServer((host, port), make_handler(llm))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://{host}:{server.server_address[1]}/v1"
+    return server, llm, base_url
+
+
+def main():
+    p = argparse.ArgumentParser(description="OpenAI-совместимый стаб LLM")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8001)
+    p.add_argument("--prefill-ms", type=float, default=0.1, help="мс на токен промпта")
+    p.add_argument("--decode-ms", type=float, default=5.0, help="мс на выходной токен")
+    p.add_argument("--output-tokens", type=int, default=64)
+    p.add_argument("--no-prefix-cache", action="store_true")
+    args = p.parse_args()
+
+    llm = StubLLM(args.prefill_ms, args.decode_ms, args.output_tokens,
+                  prefix_cache=not args.no_prefix_cache)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(llm))
+    print(f"Stub LLM on http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,152 @@
 #!/usr/bin/env python3
+"""
+RAG-демо: один вопрос (-q) или пакетный прогон набора вопросов (--questions).
+
+    python -m scripts.run_rag_demo -q "Какие экзамены на AI Product?"
+    python -m scripts.run_rag_demo --questions faq.jsonl --out answers.jsonl --concurrency 8
+
+Пакетный режим: строки входного JSONL — {"question": ..., ...остальные поля
+копируются в ответ}; один прогретый пайплайн, без повторного скрейпинга (если
+programs.json уже есть), до --concurrency вопросов одновременно. В выходной
+JSONL на каждый вопрос — ответ, источники, оценки поиска, токены и этапы;
+в конце печатаются пропускная способность и перцентили латентности.
+"""
 import argparse
+import asyncio
+import json
 import os
+import time
 from pathlib import Path
+from typing import Dict, List
 from dotenv import load_dotenv
 
-# подтягиваем HTMLParser и RAGService
-from src.parsers.html_parser import HTMLParser
+# подтягиваем скрейпер и RAGService
+from scripts.bench_prefix_cache import percentile
+from src.parsers.scraper import AsyncScraper
 from src.rag.openai_pipeline import RAGService
+from src.rag.rerank import DEFAULT_RERANK_MODEL
+
+USAGE_KEYS = ("prompt_tokens", "completion_tokens", "cached_tokens")
+
+PROGRAM_URLS = [
+    "https://abit.itmo.ru/program/master/ai_product",
+    "https://abit.itmo.ru/program/master/ai",
+]
+CATALOG_URL = "https://abit.itmo.ru/programs/master"
+
+
+async def scrape(pdf_dir: Path, out_json: Path, urls=None, catalog: bool = False):
+    async with AsyncScraper(
+        base_url="https://abit.itmo.ru",
+        pdf_dir=pdf_dir,
+        state_path=out_json.parent / "cache" / "http_state.json",
+    ) as scraper:
+        if catalog:
+            urls = await scraper.discover(CATALOG_URL)
+        programs = await scraper.scrape(urls or PROGRAM_URLS)
+        scraper.save_programs_json(programs, out_json)
+
+
+# ─── ПАКЕТНЫЙ РЕЖИМ ─────────────────────────────────────────────────────────────
+def read_questions(path: Path) -> List[Dict]:
+    items = []
+    for n, line in enumerate(Path(path).read_text(encoding="utf-8").splitlines(), start=1):
+        if not line.strip():
+            continue
+        item = json.loads(line)
+        if not item.get("question"):
+            raise ValueError(f"{path}:{n}: нет поля question")
+        items.append(item)
+    return items
+
+
+async def answer_one(rag: RAGService, item: Dict) -> Dict:
+    """Ответ на вопрос + всё, что записала трасса (оценки, токены, этапы)."""
+    trace = rag.metrics.trace("batch", item["question"])
+    record = dict(item)
+    try:
+        result = await rag.aask(item["question"], trace=trace)
+        record.update(answer=result["answer"], sources=result["sources"])
+    except Exception as e:
+        trace.set(outcome="error")
+        record.update(answer=None, sources=[], error=f"{type(e).__name__}: {e}")
+    rag.metrics.finish(trace)
+    info = trace.as_dict()
+    record.update(
+        outcome=info["outcome"],
+        scores=info.get("scores", []),
+        usage={k: info[k] for k in USAGE_KEYS if k in info},
+        total=info["total"],
+        stages=info["stages"],
+    )
+    for key in ("cache", "route", "rerank"):
+        if key in info:
+            record[key] = info[key]
+    return record
+
+
+async def run_batch(rag: RAGService, items: List[Dict], out_path: Path, concurrency: int) -> List[Dict]:
+    """
+    concurrency воркеров разбирают вопросы по очереди; строка пишется
+    в out_path сразу по готовности (поле n — номер вопроса во входном файле).
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    for n, item in enumerate(items):
+        queue.put_nowait((n, item))
+    records = []
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(out_path, "w", encoding="utf-8") as out:
+
+        async def worker():
+            while not queue.empty():
+                n, item = queue.get_nowait()
+                record = {"n": n, **await answer_one(rag, item)}
+                records.append(record)
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                out.flush()
+                print(f"[{len(records)}/{len(items)}] {record['outcome']} {record['total']:.2f}s  {item['question'][:60]}")
+
+        await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+    return sorted(records, key=lambda r: r["n"])
+
+
+def summarize(records: List[Dict], wall: float) -> Dict:
+    ok = [r for r in records if r["outcome"] == "ok"]
+    totals = [r["total"] for r in ok]
+    summary = {
+        "questions": len(records),
+        "errors": len(records) - len(ok),
+        "wall_s": round(wall, 2),
+        "throughput_qps": round(len(records) / wall, 3) if wall else 0.0,
+        "tokens": {k: sum(r["usage"].get(k, 0) for r in records) for k in USAGE_KEYS},
+        "cache_hits": sum(1 for r in records if r.get("cache")),
+        "fact_answers": sum(1 for r in records if r.get("route") == "facts"),
+    }
+    if totals:
+        summary["latency_s"] = {f"p{q}": round(percentile(totals, q), 3) for q in (50, 95, 99)}
+        stages: Dict[str, List[float]] = {}
+        for r in ok:
+            for stage, sec in r["stages"].items():
+                stages.setdefault(stage, []).append(sec)
+        summary["stages_s"] = {
+            stage: {"p50": round(percentile(v, 50), 4), "p95": round(percentile(v, 95), 4)}
+            for stage, v in sorted(stages.items())
+        }
+    return summary
+
+
+def print_summary(summary: Dict):
+    print("\n=== Итог ===")
+    print(
+        f"вопросов: {summary['questions']}, ошибок: {summary['errors']}, "
+        f"{summary['wall_s']} с, {summary['throughput_qps']} вопр/с"
+    )
+    if "latency_s" in summary:
+        print("латентность, с: " + "  ".join(f"{k}={v}" for k, v in summary["latency_s"].items()))
+        for stage, v in summary["stages_s"].items():
+            print(f"  {stage:>14}: p50={v['p50']}  p95={v['p95']}")
+    print("токены: " + "  ".join(f"{k}={v}" for k, v in summary["tokens"].items()))
+
 
 def main():
     load_dotenv()
@@ -14,7 +154,14 @@ def main():
     p = argparse.ArgumentParser(
         description="RAG-демо: ITMO Master’s programs"
     )
-    p.add_argument("-q", "--question", required=True, help="Ваш вопрос")
+    mode = p.add_mutually_exclusive_group(required=True)
+    mode.add_argument("-q", "--question", help="Ваш вопрос")
+    mode.add_argument("--questions", help="JSONL с вопросами (пакетный режим)")
+    p.add_argument("--out", default="answers.jsonl", help="куда писать ответы (пакетный режим)")
+    p.add_argument("--concurrency", type=int, default=4, help="вопросов одновременно (пакетный режим)")
+    p.add_argument("--scrape", choices=["auto", "always", "never"], default="auto",
+                   help="auto — скрейпить, если это одиночный вопрос или programs.json ещё нет")
+    p.add_argument("--cache-dir", default="data/cache", help="кеш страниц PDF, эмбеддингов и снапшот индекса")
     p.add_argument(
         "--json",
         default="data/programs.json",
@@ -25,13 +172,28 @@ def main():
         default="data/pdfs",
         help="Папка для PDF-файлов учебных планов"
     )
+    p.add_argument("--url", action="append", default=None, help="страница программы (можно несколько)")
+    p.add_argument("--catalog", action="store_true", help="обойти весь каталог магистратуры")
     # остальные опции RAG...
     p.add_argument("--model",      default=None, help="Модель: gpt-3.5-turbo или Qwen3-8B-AWQ")
     p.add_argument("--embed",      default="intfloat/multilingual-e5-large-instruct")
-    p.add_argument("--chunk-size",    type=int, default=1000)
+    p.add_argument("--embed-backend", choices=["torch", "onnx", "onnx-int8"], default="torch",
+                   help="onnx-int8 — квантованный ONNX Runtime, быстрее на CPU")
+    p.add_argument("--embed-threads", type=int, default=None, help="потоков эмбеддера (по умолчанию — ядра контейнера)")
+    p.add_argument("--chunker",       choices=["structured", "window"], default="structured")
+    p.add_argument("--chunk-tokens",  type=int, default=256, help="размер чанка в токенах (structured)")
+    p.add_argument("--chunk-size",    type=int, default=1000, help="размер окна в символах (window)")
     p.add_argument("--chunk-overlap", type=int, default=100)
     p.add_argument("--top-k-ret",     type=int, default=5)
     p.add_argument("--min-score",     type=float, default=0.0)
+    p.add_argument("--index-type",    choices=["auto", "flat", "hnsw", "ivf"], default="auto")
+    p.add_argument("--ef-search",     type=int, default=64, help="HNSW: ширина поиска")
+    p.add_argument("--nprobe",        type=int, default=16, help="IVF: число просматриваемых кластеров")
+    p.add_argument("--quantization",  choices=["none", "fp16", "sq8", "pq"], default="none")
+    p.add_argument("--rerank-model",  default=None,
+                   help="кросс-энкодер для переранжирования, напр. " + DEFAULT_RERANK_MODEL)
+    p.add_argument("--rerank-candidates", type=int, default=20, help="сколько кандидатов переранжировать")
+    p.add_argument("--rerank-threshold",  type=float, default=0.1)
     p.add_argument("--gen-top-k",     type=int, default=20)
     p.add_argument("--max-tokens",    type=int, default=4000)
     p.add_argument("--temp",          type=float, default=0.7)
@@ -41,24 +203,12 @@ def main():
     p.add_argument("--system-prompt", type=str, default=None)
     args = p.parse_args()
 
-    # 1) Парсим страницы и сохраняем programs.json + скачиваем PDF
-    parser = HTMLParser(
-        base_url="https://abit.itmo.ru",
-        pdf_dir=Path(args.pdf_dir)
-    )
-    programs = []
-    for url in [
-        "https://abit.itmo.ru/program/master/ai_product",
-        "https://abit.itmo.ru/program/master/ai",
-    ]:
-        try:
-            prog = parser.parse_program_page(url)
-            programs.append(prog)
-        except Exception as e:
-            print(f"⚠️ Ошибка парсинга {url}: {e}")
-
+    # 1) Парсим страницы и сохраняем programs.json + скачиваем изменившиеся PDF
+    #    (пакетный прогон берёт уже сохранённые данные)
     out_json = Path(args.json)
-    parser.save_programs_json(programs, out_json)
+    batch = args.questions is not None
+    if args.scrape == "always" or (args.scrape == "auto" and not (batch and out_json.exists())):
+        asyncio.run(scrape(Path(args.pdf_dir), out_json, args.url, args.catalog))
 
     # 2) Выбираем модель
     api_key = os.getenv("OPENAI_API_KEY", "")
@@ -72,10 +222,21 @@ def main():
         json_path         = out_json,
         pdf_dir           = Path(args.pdf_dir),
         hf_embed_model    = args.embed,
+        embed_backend     = args.embed_backend,
+        embed_threads     = args.embed_threads,
         chunk_size        = args.chunk_size,
         chunk_overlap     = args.chunk_overlap,
+        chunker           = args.chunker,
+        chunk_tokens      = args.chunk_tokens,
         top_k_retrieval   = args.top_k_ret,
         min_score         = args.min_score,
+        index_type        = args.index_type,
+        hnsw_ef_search    = args.ef_search,
+        ivf_nprobe        = args.nprobe,
+        quantization      = args.quantization,
+        rerank_model      = args.rerank_model,
+        rerank_candidates = args.rerank_candidates,
+        rerank_threshold  = args.rerank_threshold,
         max_tokens        = args.max_tokens,
         temperature       = args.temp,
         top_p             = args.top_p,
@@ -83,9 +244,23 @@ def main():
         presence_penalty  = args.penalty,
         enable_thinking   = args.enable_thinking,
         system_prompt     = args.system_prompt,
+        cache_dir         = Path(args.cache_dir) if args.cache_dir else None,
+        max_concurrent_generations = args.concurrency,
+        # в регрессионном прогоне каждый вопрос проходит весь путь, без кеша ответов
+        answer_cache_size = 0 if batch else 512,
     )
 
-    # 4) Отвечаем на вопрос
+    # 4) Отвечаем на вопрос(ы)
+    if batch:
+        items = read_questions(Path(args.questions))
+        t0 = time.perf_counter()
+        records = asyncio.run(run_batch(rag, items, Path(args.out), args.concurrency))
+        summary = summarize(records, time.perf_counter() - t0)
+        rag.close()
+        print_summary(summary)
+        print(f"\nОтветы: {args.out}")
+        return
+
     out = rag.ask(args.question)
     print("\n=== Ответ ===\n", out["answer"])
     print("\n=== Источники ===")
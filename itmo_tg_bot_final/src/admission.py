@@ -0,0 +1,177 @@
+# src/admission.py
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class Rejected(Exception):
+    """Запрос не принят: rate_limited | overloaded | timeout."""
+
+    def __init__(self, reason: str, retry_after: float = 0.0):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate                  # токенов в секунду
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self, now: float = None) -> float:
+        """Берёт токен: 0.0 — получилось, иначе сколько секунд ждать следующего."""
+        now = time.monotonic() if now is None else now
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class _Waiter:
+    __slots__ = ("key", "future", "cancelled")
+
+    def __init__(self, key, future):
+        self.key = key                    # (priority, виртуальное время старта, seq)
+        self.future = future
+        self.cancelled = False
+
+    def __lt__(self, other):
+        return self.key < other.key
+
+
+class AdmissionController:
+    """
+    Допуск запросов к RAGService:
+      - не больше max_concurrent запросов в обработке (по числу генераций vLLM);
+      - остальные ждут в ограниченной очереди (max_queue) с приоритетом
+        (меньше — раньше) и справедливым порядком между чатами: start-time
+        fair queueing — у каждого чата своё виртуальное время, поэтому
+        десять вопросов из одного чата не отодвигают вопрос из другого;
+      - token bucket на пользователя: rate_per_min вопросов в минуту, burst подряд;
+      - сброс нагрузки: полная очередь или ожидаемое ожидание дольше max_wait
+        (по скользящему среднему времени обработки) — сразу Rejected,
+        а не минуты в очереди; дождавшийся max_wait тоже получает Rejected.
+    Рассчитан на один event loop (бот).
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = 4,
+        max_queue: int = 32,
+        rate_per_min: float = 6.0,
+        burst: float = 3.0,
+        max_wait: float = 30.0,
+        max_users: int = 10000,
+    ):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.rate = rate_per_min / 60.0
+        self.burst = burst
+        self.max_wait = max_wait
+        self.max_users = max_users
+        self.active = 0
+        self.queued = 0
+        self.service_time: Optional[float] = None      # EWMA, секунды
+        self._heap: List[_Waiter] = []
+        self._seq = itertools.count()
+        self._vtime = 0.0
+        self._chat_vtime: Dict[object, float] = {}
+        self._buckets: "OrderedDict[object, TokenBucket]" = OrderedDict()
+
+    # ─── лимит на пользователя ───────────────────────────────────────────────
+    def check_rate(self, user_id):
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = self._buckets[user_id] = TokenBucket(self.rate, self.burst)
+            # вытесненный давно молчавший пользователь всё равно вернулся бы с полным ведром
+            if len(self._buckets) > self.max_users:
+                self._buckets.popitem(last=False)
+        self._buckets.move_to_end(user_id)
+        wait = bucket.take()
+        if wait > 0:
+            raise Rejected("rate_limited", wait)
+
+    # ─── очередь ─────────────────────────────────────────────────────────────
+    def _key(self, chat_id, priority: int):
+        start = max(self._vtime, self._chat_vtime.get(chat_id, 0.0))
+        self._chat_vtime[chat_id] = start + 1
+        if len(self._chat_vtime) > 4 * (self.max_queue + self.max_concurrent):
+            # чаты без запросов впереди текущего времени ничего не помнят
+            self._chat_vtime = {c: v for c, v in self._chat_vtime.items() if v > self._vtime}
+        return priority, start, next(self._seq)
+
+    def expected_wait(self) -> float:
+        if not self.service_time:
+            return 0.0
+        return (self.queued + 1) * self.service_time / self.max_concurrent
+
+    def position(self, waiter: _Waiter) -> int:
+        return 1 + sum(1 for w in self._heap if not w.cancelled and w.key < waiter.key)
+
+    async def acquire(
+        self,
+        chat_id,
+        user_id,
+        priority: int = 0,
+        on_queued: Callable[[int], Awaitable] = None,
+    ):
+        """Ждёт свободный слот; on_queued(позиция) вызывается, если пришлось встать в очередь."""
+        self.check_rate(user_id)
+        if self.active < self.max_concurrent and not self.queued:
+            self.active += 1
+            self._vtime = self._key(chat_id, priority)[1]
+            return
+        if self.queued >= self.max_queue or self.expected_wait() > self.max_wait:
+            raise Rejected("overloaded", self.expected_wait())
+
+        waiter = _Waiter(self._key(chat_id, priority), asyncio.get_running_loop().create_future())
+        heapq.heappush(self._heap, waiter)
+        self.queued += 1
+        try:
+            if on_queued is not None:
+                try:
+                    await on_queued(self.position(waiter))
+                except Exception as e:
+                    logger.warning("on_queued failed: %s", e)
+            done, _ = await asyncio.wait({waiter.future}, timeout=self.max_wait)
+        except BaseException:
+            self._abandon(waiter)
+            raise
+        if not done:
+            self._abandon(waiter)
+            raise Rejected("timeout", self.expected_wait())
+
+    def _abandon(self, waiter: _Waiter):
+        if waiter.future.done():
+            self.release()                # слот уже передан нам — отдаём дальше
+        else:
+            waiter.cancelled = True
+            waiter.future.cancel()
+            self.queued -= 1
+
+    def release(self, service_time: float = None):
+        if service_time is not None:
+            self.service_time = (
+                service_time if self.service_time is None
+                else 0.8 * self.service_time + 0.2 * service_time
+            )
+        while self._heap:
+            waiter = heapq.heappop(self._heap)
+            if waiter.cancelled:
+                continue
+            # слот переходит следующему без освобождения
+            self.queued -= 1
+            self._vtime = waiter.key[1]
+            waiter.future.set_result(None)
+            return
+        self.active -= 1
@@ -1,16 +1,25 @@
 # src/bot.py
 
 import os
+import html
 import logging
 import asyncio
+import math
 import re
+import time
 from pathlib import Path
 
 from dotenv import load_dotenv
 from telegram import Update
-from telegram.ext import ApplicationBuilder, ContextTypes, MessageHandler, filters
+from telegram.constants import ChatAction, ChatType, ParseMode
+from telegram.error import BadRequest
+from telegram.ext import ApplicationBuilder, CommandHandler, ContextTypes, MessageHandler, filters
 
-from src.parsers.html_parser import HTMLParser
+from src.admission import AdmissionController, Rejected
+from src.parsers.scraper import AsyncScraper
+from src.rag.conversation import ConversationStore
+from src.rag.llm_router import Endpoint, LLMRouter
+from src.rag.metrics import Metrics, Trace, start_metrics_server
 from src.rag.openai_pipeline import RAGService
 
 # ─── КОНФИГ ───────────────────────────────────────────────────────────────────────
@@ -19,10 +28,86 @@ load_dotenv(BASE_DIR / ".env")
 
 TELEGRAM_TOKEN     = os.getenv("TELEGRAM_TOKEN")
 OPENAI_MODEL_NAME  = os.getenv("OPENAI_MODEL_NAME", "gpt-3.5-turbo")
-PROGRAM_URLS = [
+REFRESH_INTERVAL_SEC = float(os.getenv("REFRESH_INTERVAL_SEC", "0"))  # 0 — только при старте
+# токенизатор обслуживаемой модели (HF id) и её контекст — для упаковки промпта.
+# OPENAI_MODEL_NAME — часто имя для API («gpt-3.5-turbo», алиас vLLM), а не HF id:
+# тогда берём модель из config.yaml vLLM
+VLLM_MODEL     = "Qwen/Qwen3-8B-AWQ"
+TOKENIZER_NAME = os.getenv("TOKENIZER_NAME") or (OPENAI_MODEL_NAME if "/" in OPENAI_MODEL_NAME else VLLM_MODEL)
+MAX_MODEL_LEN  = int(os.getenv("MAX_MODEL_LEN", "6192"))
+# добавлять справку по программам в стабильный (кешируемый vLLM) префикс промпта
+INCLUDE_OVERVIEW = os.getenv("INCLUDE_OVERVIEW", "1") == "1"
+# гибридный поиск: BM25 + dense, слияние через reciprocal rank fusion
+HYBRID_RETRIEVAL = os.getenv("HYBRID_RETRIEVAL", "1") == "1"
+# сколько генераций одновременно отправляем в vLLM
+MAX_CONCURRENT_GENERATIONS = int(os.getenv("MAX_CONCURRENT_GENERATIONS", "4"))
+# реплики vLLM через запятую (пусто — один OPENAI_API_BASE без роутера);
+# запасная модель (напр. внешний API) — только когда все реплики недоступны
+LLM_ENDPOINTS        = [u.strip() for u in os.getenv("LLM_ENDPOINTS", "").split(",") if u.strip()]
+LLM_FALLBACK_URL     = os.getenv("LLM_FALLBACK_URL", "")
+LLM_FALLBACK_MODEL   = os.getenv("LLM_FALLBACK_MODEL", "") or None
+LLM_FALLBACK_API_KEY = os.getenv("LLM_FALLBACK_API_KEY", "")
+# дубль запроса в другую реплику, если ответа нет дольше: p95 (квантиль времени ответа) | секунды | off
+LLM_HEDGE            = os.getenv("LLM_HEDGE", "p95")
+# стримить ответ правкой сообщения и как часто его редактировать
+STREAM_ANSWERS       = os.getenv("STREAM_ANSWERS", "1") == "1"
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.0"))
+TG_CHUNK_LEN         = 3500   # запас до лимита Telegram в 4096 символов
+PDF_DIR       = BASE_DIR / "data" / "pdfs"
+PROGRAMS_JSON = BASE_DIR / "data" / "programs.json"
+CACHE_DIR     = BASE_DIR / "data" / "cache"
+# одновременных запросов к одному хосту при скрейпинге
+SCRAPE_PER_HOST = int(os.getenv("SCRAPE_PER_HOST", "4"))
+# страницы программ: явный список через запятую или обход каталога магистратуры
+PROGRAM_URLS = [u.strip() for u in os.getenv("PROGRAM_URLS", "").split(",") if u.strip()]
+CATALOG_URL  = os.getenv("CATALOG_URL", "https://abit.itmo.ru/programs/master")
+DEFAULT_PROGRAM_URLS = [
     "https://abit.itmo.ru/program/master/ai_product",
     "https://abit.itmo.ru/program/master/ai",
 ]
+# векторный индекс: auto (flat до 5000 чанков, дальше hnsw) | flat | hnsw | ivf
+INDEX_TYPE     = os.getenv("INDEX_TYPE", "auto")
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "64"))
+IVF_NPROBE     = int(os.getenv("IVF_NPROBE", "16"))
+# сжатие векторов в индексе: none | fp16 | sq8 | pq (с точным пересчётом топа)
+QUANTIZATION   = os.getenv("QUANTIZATION", "none")
+# бэкенд эмбеддера: torch | onnx | onnx-int8 (квантованный ONNX Runtime, быстрее на CPU);
+# потоков — по умолчанию столько, сколько ядер выделено контейнеру
+EMBED_BACKEND  = os.getenv("EMBED_BACKEND", "torch")
+EMBED_THREADS  = int(os.getenv("EMBED_THREADS", "0")) or None
+# переранжирование кросс-энкодером (пусто — выключено), напр. cross-encoder/mmarco-mMiniLMv2-L12-H384-v1
+RERANK_MODEL      = os.getenv("RERANK_MODEL", "")
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "20"))
+RERANK_THRESHOLD  = float(os.getenv("RERANK_THRESHOLD", "0.1"))
+# история диалогов: реплик на чат, чатов в памяти (LRU), токенов истории в промпте
+HISTORY_TURNS        = int(os.getenv("HISTORY_TURNS", "6"))
+HISTORY_MAX_CHATS    = int(os.getenv("HISTORY_MAX_CHATS", "10000"))
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "600"))
+PERSIST_HISTORY      = os.getenv("PERSIST_HISTORY", "1") == "1"
+# допуск запросов: очередь ожидания, лимит вопросов на пользователя, предел ожидания
+QUEUE_MAX_SIZE    = int(os.getenv("QUEUE_MAX_SIZE", "32"))
+QUEUE_MAX_WAIT    = float(os.getenv("QUEUE_MAX_WAIT", "30"))
+USER_RATE_PER_MIN = float(os.getenv("USER_RATE_PER_MIN", "6"))
+USER_BURST        = float(os.getenv("USER_BURST", "3"))
+TYPING_INTERVAL   = 4.5       # индикатор «печатает» гаснет через 5 с
+# метрики в формате Prometheus на http://METRICS_HOST:METRICS_PORT/metrics (0 — выключены)
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+# запросы дольше порога пишутся в лог rag.slow с разбивкой по этапам
+SLOW_REQUEST_SEC = float(os.getenv("SLOW_REQUEST_SEC", "10"))
+# режим вебхука (задан WEBHOOK_URL): фронт на WEBHOOK_HOST:WEBHOOK_PORT за TLS-прокси
+# и WEB_WORKERS процессов с общим снапшотом индекса; иначе — polling в одном процессе
+WEBHOOK_URL        = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_SECRET     = os.getenv("WEBHOOK_SECRET", "") or None
+WEBHOOK_HOST       = os.getenv("WEBHOOK_HOST", "127.0.0.1")
+WEBHOOK_PORT       = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEB_WORKERS        = int(os.getenv("WEB_WORKERS", "2"))
+WORKER_QUEUE_SIZE  = int(os.getenv("WORKER_QUEUE_SIZE", "256"))
+# номер процесса-воркера (выставляет src.webhook; пусто — обычный запуск)
+WEB_WORKER_ID = os.getenv("WEB_WORKER_ID")
+if WEB_WORKER_ID is not None:
+    # лимит vLLM общий — каждому воркеру своя доля
+    MAX_CONCURRENT_GENERATIONS = math.ceil(MAX_CONCURRENT_GENERATIONS / max(1, WEB_WORKERS))
 
 if not TELEGRAM_TOKEN:
     raise RuntimeError("В .env не задан TELEGRAM_TOKEN")
@@ -45,64 +130,330 @@ def dedupe_preserve_order(seq):
     return out
 
 def md_to_html(text: str) -> str:
+    # Экранируем всё, что пришло от модели: на частичном тексте незакрытые
+    # ** или * просто остаются как есть, а «<» не ломает parse_mode=HTML.
+    text = html.escape(text, quote=False)
     text = re.sub(r"\*\*(.+?)\*\*", r"<b>\1</b>", text)
     text = re.sub(r"\*(.+?)\*",   r"<i>\1</i>", text)
     return text
 
+def split_text(text: str, limit: int = TG_CHUNK_LEN) -> list[str]:
+    """Режет длинный ответ на части не длиннее limit, по возможности по строкам."""
+    parts = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit)
+        if cut <= 0:
+            cut = limit
+        parts.append(text[:cut])
+        text = text[cut:].lstrip("\n")
+    parts.append(text)
+    return parts
+
+def format_sources(sources) -> str:
+    unique_src = dedupe_preserve_order(sources)
+    sources_list = "\n".join(f"• {html.escape(Path(s).name)}" for s in unique_src)
+    return f"\n\n📚 <b>Источники:</b>\n{sources_list}"
+
 # ─── ПАРСИНГ ПРОГРАММ ────────────────────────────────────────────────────────────
-# Тут при старте бота обновляем programs.json и скачиваем PDF-ы
-parser = HTMLParser(
-    base_url="https://abit.itmo.ru",
-    pdf_dir=BASE_DIR / "data" / "pdfs"
-)
-programs = []
-for url in PROGRAM_URLS:
+# Скрейпинг идёт в фоне после старта бота: до его окончания отвечаем
+# по последнему сохранённому programs.json и снапшоту индекса.
+def make_scraper() -> AsyncScraper:
+    return AsyncScraper(
+        base_url   = "https://abit.itmo.ru",
+        pdf_dir    = PDF_DIR,
+        state_path = CACHE_DIR / "http_state.json",
+        per_host   = SCRAPE_PER_HOST,
+    )
+
+async def program_urls(scraper: AsyncScraper) -> list:
+    if PROGRAM_URLS:
+        return PROGRAM_URLS
     try:
-        prog = parser.parse_program_page(url)
-        programs.append(prog)
-        logger.info("Parsed %s → %s", url, prog.get("pdf_url"))
+        urls = await scraper.discover(CATALOG_URL)
     except Exception as e:
-        logger.error("Ошибка парсинга %s: %s", url, e)
-# Сохраняем
-parser.save_programs_json(programs, BASE_DIR / "data" / "programs.json")
+        logger.error("Не удалось обойти каталог %s: %s", CATALOG_URL, e)
+        urls = []
+    return urls or DEFAULT_PROGRAM_URLS
+
+async def refresh_programs(scraper: AsyncScraper) -> list:
+    """Обновляет programs.json и скачивает изменившиеся PDF-ы."""
+    programs = await scraper.scrape(await program_urls(scraper))
+    if programs:
+        await asyncio.to_thread(scraper.save_programs_json, programs, PROGRAMS_JSON)
+    else:
+        logger.warning("Ни одна программа не распарсилась, оставляем старый %s", PROGRAMS_JSON)
+    return programs
 
 # ─── ИНИЦИАЛИЗАЦИЯ RAG ───────────────────────────────────────────────────────────
-pipeline = RAGService(
-    model_name = OPENAI_MODEL_NAME,
-    json_path  = BASE_DIR / "data" / "programs.json",
-    pdf_dir    = BASE_DIR / "data" / "pdfs",
+pipeline: RAGService | None = None
+# общие для всех пересборок пайплайна: счётчики не сбрасываются при обновлении
+METRICS = Metrics(slow_threshold=SLOW_REQUEST_SEC)
+ADMISSION = AdmissionController(
+    max_concurrent = MAX_CONCURRENT_GENERATIONS,
+    max_queue      = QUEUE_MAX_SIZE,
+    rate_per_min   = USER_RATE_PER_MIN,
+    burst          = USER_BURST,
+    max_wait       = QUEUE_MAX_WAIT,
 )
+CONVERSATIONS = ConversationStore(
+    max_chats = HISTORY_MAX_CHATS,
+    max_turns = HISTORY_TURNS,
+    path      = (
+        CACHE_DIR / (f"conversations.{WEB_WORKER_ID}.json" if WEB_WORKER_ID is not None else "conversations.json")
+        if PERSIST_HISTORY else None
+    ),
+)
+
+def make_llm_router():
+    if not LLM_ENDPOINTS and not LLM_FALLBACK_URL:
+        return None
+    api_key = os.getenv("OPENAI_API_KEY", "")
+    endpoints = [Endpoint(url, api_key) for url in LLM_ENDPOINTS or [os.getenv("OPENAI_API_BASE", "http://localhost:8000/v1")]]
+    if LLM_FALLBACK_URL:
+        endpoints.append(Endpoint(
+            LLM_FALLBACK_URL, LLM_FALLBACK_API_KEY, name="fallback",
+            model=LLM_FALLBACK_MODEL, tier=1, vllm_params=False,
+        ))
+    hedge = LLM_HEDGE.strip().lower()
+    return LLMRouter(
+        endpoints,
+        hedge_quantile = float(hedge[1:]) / 100 if hedge.startswith("p") else None,
+        hedge_delay    = float(hedge) if hedge not in ("off", "") and not hedge.startswith("p") else None,
+        metrics        = METRICS,
+    )
+
+# состояние эндпоинтов (нагрузка, задержки, цепи) переживает пересборки пайплайна
+LLM_ROUTER = make_llm_router()
+
+def build_pipeline(embedder=None, reranker=None) -> RAGService:
+    """embedder/reranker — уже загруженные модели, чтобы пересборка их не грузила заново."""
+    return RAGService(
+        model_name = OPENAI_MODEL_NAME,
+        json_path  = PROGRAMS_JSON,
+        pdf_dir    = PDF_DIR,
+        cache_dir  = CACHE_DIR,
+        max_concurrent_generations = MAX_CONCURRENT_GENERATIONS,
+        tokenizer_name = TOKENIZER_NAME,
+        max_model_len  = MAX_MODEL_LEN,
+        include_overview = INCLUDE_OVERVIEW,
+        hybrid     = HYBRID_RETRIEVAL,
+        index_type = INDEX_TYPE,
+        hnsw_ef_search = HNSW_EF_SEARCH,
+        ivf_nprobe     = IVF_NPROBE,
+        quantization   = QUANTIZATION,
+        embed_backend  = EMBED_BACKEND,
+        embed_threads  = EMBED_THREADS,
+        metrics    = METRICS,
+        embedder   = embedder,
+        reranker   = reranker,
+        rerank_model      = RERANK_MODEL or None,
+        rerank_candidates = RERANK_CANDIDATES,
+        rerank_threshold  = RERANK_THRESHOLD,
+        conversations        = CONVERSATIONS,
+        history_token_budget = HISTORY_TOKEN_BUDGET,
+        llm_router = LLM_ROUTER,
+        # воркеры вебхука только читают снапшот, собирает его процесс-сборщик
+        snapshot_readonly = WEB_WORKER_ID is not None,
+    )
+
+async def refresh_in_background():
+    """Фоновое обновление: скрейпинг + инкрементальная подмена индекса."""
+    loop = asyncio.get_running_loop()
+    # клиент и headless-браузер живут между обновлениями
+    scraper = make_scraper()
+    try:
+        await _refresh_loop(loop, scraper)
+    finally:
+        await scraper.aclose()
+
+async def _refresh_loop(loop, scraper: AsyncScraper):
+    global pipeline
+    while True:
+        t0 = time.perf_counter()
+        try:
+            programs = await refresh_programs(scraper)
+            t_scrape = time.perf_counter() - t0
+            if pipeline is None:
+                pipeline = await loop.run_in_executor(None, build_pipeline)
+                logger.info("RAG-пайплайн готов после первичного скрейпинга")
+            elif programs:
+                stats = await loop.run_in_executor(
+                    None, pipeline.reload, PROGRAMS_JSON, PDF_DIR
+                )
+                logger.info("Индекс обновлён: %s", stats)
+            logger.info(
+                "Фоновое обновление завершено: скрейпинг %.1fs, всего %.1fs",
+                t_scrape, time.perf_counter() - t0,
+            )
+        except Exception:
+            logger.exception("Ошибка фонового обновления данных")
+        if REFRESH_INTERVAL_SEC <= 0:
+            return
+        await asyncio.sleep(REFRESH_INTERVAL_SEC)
+
+async def post_init(app):
+    app.create_task(refresh_in_background())
+
+async def post_shutdown(app):
+    await asyncio.to_thread(CONVERSATIONS.save)
+
+# ─── СТРИМИНГ ОТВЕТА ─────────────────────────────────────────────────────────────
+async def safe_edit(message, text_html: str):
+    try:
+        await message.edit_text(text_html, parse_mode=ParseMode.HTML)
+    except BadRequest as e:
+        # Telegram ругается, если текст не изменился — это не ошибка
+        if "not modified" not in str(e).lower():
+            raise
+
+async def reply_streaming(update: Update, rag: RAGService, question: str, trace: Trace):
+    """
+    Отправляет заглушку и редактирует её по мере прихода токенов,
+    не чаще раза в STREAM_EDIT_INTERVAL секунд (лимиты Telegram на edit).
+    Время запросов к Telegram идёт в этап trace «telegram».
+    """
+    with trace.stage("telegram"):
+        message = await update.message.reply_text("⏳")
+    answer, sources = "", []
+    last_edit = time.monotonic()
+    async for event in rag.astream(question, trace=trace, chat_id=update.effective_chat.id):
+        if event["type"] == "done":
+            answer, sources = event["answer"], event["sources"]
+            break
+        answer += event["text"]
+        now = time.monotonic()
+        if now - last_edit >= STREAM_EDIT_INTERVAL and answer.strip():
+            last_edit = now
+            with trace.stage("telegram"):
+                await safe_edit(message, md_to_html(split_text(answer)[0]) + " ▌")
+
+    parts = [md_to_html(p) for p in split_text(answer)]
+    parts[-1] += format_sources(sources)
+    with trace.stage("telegram"):
+        await safe_edit(message, parts[0])
+        for part in parts[1:]:
+            await update.message.reply_html(part)
+
+# ─── ОЧЕРЕДЬ И ИНДИКАЦИЯ ─────────────────────────────────────────────────────────
+async def keep_typing(bot, chat_id):
+    """Держит «печатает…» в чате, пока задача не отменена."""
+    while True:
+        try:
+            await bot.send_chat_action(chat_id, ChatAction.TYPING)
+        except Exception as e:
+            logger.debug("send_chat_action failed: %s", e)
+        await asyncio.sleep(TYPING_INTERVAL)
+
+def rejection_text(e: Rejected) -> str:
+    if e.reason == "rate_limited":
+        return f"Слишком много вопросов подряд — подождите {max(1, round(e.retry_after))} с."
+    return "Сейчас очень много вопросов, бот не успевает. Попробуйте через минуту."
 
 # ─── ХЭНДЛЕР НА СООБЩЕНИЯ ─────────────────────────────────────────────────────────
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_text = update.message.text.strip()
     logger.info("User asked: %s", user_text)
 
-    try:
-        result       = await asyncio.get_running_loop().run_in_executor(
-            None, pipeline.ask, user_text
-        )
-        answer       = result["answer"]
-        sources      = result["sources"]
-        unique_src   = dedupe_preserve_order(sources)
-        answer_html  = md_to_html(answer)
-        sources_list = "\n".join(f"• {Path(s).name}" for s in unique_src)
-
-        await update.message.reply_html(
-            f"{answer_html}\n\n📚 <b>Источники:</b>\n{sources_list}"
+    rag = pipeline
+    if rag is None:
+        await update.message.reply_text(
+            "Бот ещё загружает данные о программах, попробуйте через минуту."
         )
+        return
+
+    # одна трасса на весь путь: очередь, поиск, генерация и доставка в Telegram
+    chat = update.effective_chat
+    trace = METRICS.trace("telegram", user_text)
+    trace.set(chat_id=chat.id)
+
+    async def on_queued(position: int):
+        await update.message.reply_text(f"⏳ Много вопросов, вы в очереди: {position}-й.")
+
+    typing = asyncio.create_task(keep_typing(context.bot, chat.id))
+    admitted_at = None
+    try:
+        with trace.stage("queue"):
+            await ADMISSION.acquire(
+                chat.id,
+                update.effective_user.id if update.effective_user else chat.id,
+                # личные чаты вперёд групповых
+                priority  = 0 if chat.type == ChatType.PRIVATE else 1,
+                on_queued = on_queued,
+            )
+        admitted_at = time.monotonic()
+        if STREAM_ANSWERS:
+            await reply_streaming(update, rag, user_text, trace)
+            return
+        result       = await rag.aask(user_text, trace=trace, chat_id=chat.id)
+        answer_html  = md_to_html(result["answer"])
+
+        with trace.stage("telegram"):
+            await update.message.reply_html(
+                f"{answer_html}{format_sources(result['sources'])}"
+            )
+
+    except Rejected as e:
+        typing.cancel()           # отказ — без «печатает…»
+        trace.set(outcome="rejected", reason=e.reason)
+        METRICS.inc("bot_rejected_total", reason=e.reason)
+        await update.message.reply_text(rejection_text(e))
 
     except Exception:
+        trace.set(outcome="error")
         logger.exception("Ошибка при обработке вопроса")
         await update.message.reply_text(
             "Извините, при обработке вашего запроса что-то пошло не так."
         )
+    finally:
+        typing.cancel()
+        if admitted_at is not None:
+            ADMISSION.release(time.monotonic() - admitted_at)
+        METRICS.finish(trace)
 
-# ─── ТОЧКА ЗАПУСКА ───────────────────────────────────────────────────────────────
-if __name__ == "__main__":
-    app = ApplicationBuilder().token(TELEGRAM_TOKEN).build()
+async def handle_reset(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    CONVERSATIONS.reset(update.effective_chat.id)
+    await update.message.reply_text("История диалога очищена.")
+
+def add_handlers(app):
+    app.add_handler(CommandHandler("reset", handle_reset))
     app.add_handler(
         MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message)
     )
+
+# ─── ТОЧКА ЗАПУСКА ───────────────────────────────────────────────────────────────
+if __name__ == "__main__" and WEBHOOK_URL:
+    from src import webhook
+
+    # пайплайны поднимают воркеры, фронт только принимает апдейты
+    webhook.serve(
+        TELEGRAM_TOKEN, WEBHOOK_URL, WEBHOOK_SECRET,
+        host = WEBHOOK_HOST,
+        port = WEBHOOK_PORT,
+        workers    = WEB_WORKERS,
+        queue_size = WORKER_QUEUE_SIZE,
+        refresh_interval = REFRESH_INTERVAL_SEC,
+        data_ready = PROGRAMS_JSON.exists(),
+    )
+elif __name__ == "__main__":
+    t_start = time.perf_counter()
+    if PROGRAMS_JSON.exists():
+        # Сразу поднимаем пайплайн из сохранённых данных (снапшот индекса — секунды)
+        pipeline = build_pipeline()
+        logger.info("RAG-пайплайн готов за %.1fs", time.perf_counter() - t_start)
+    else:
+        logger.info("Нет %s — пайплайн будет собран после скрейпинга", PROGRAMS_JSON)
+
+    if METRICS_PORT:
+        start_metrics_server(METRICS, METRICS_HOST, METRICS_PORT)
+
+    app = (
+        ApplicationBuilder().token(TELEGRAM_TOKEN)
+        .post_init(post_init).post_shutdown(post_shutdown)
+        # без этого PTB обрабатывает сообщения строго по одному,
+        # очередь и приоритеты — забота ADMISSION
+        .concurrent_updates(True)
+        .build()
+    )
+    add_handlers(app)
     logger.info("Бот запущен, начинаем polling...")
     app.run_polling()
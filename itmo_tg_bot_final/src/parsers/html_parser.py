@@ -1,15 +1,72 @@
 # src/parsers/html_parser.py
 
 import json
-import time
+import threading
 from pathlib import Path
 import requests
 from bs4 import BeautifulSoup
 
-# Selenium-блок
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.common.exceptions import WebDriverException, NoSuchElementException
+# ссылка «скачать учебный план» после заголовка раздела
+STUDY_PLAN_XPATH = "//h2[@id='study-plan']/following::a[contains(text(),'учебный план')][1]"
+
+
+class HeadlessBrowser:
+    """
+    Один долгоживущий headless Chrome на все страницы (запуск — секунды).
+    Вместо фиксированного sleep ждём нужный элемент через WebDriverWait.
+    Потокобезопасен: страницы открываются по очереди.
+    Selenium импортируется при первом использовании — обычно до fallback
+    дело не доходит, а импорт webdriver небесплатен.
+    """
+
+    def __init__(self, wait_timeout: float = 10.0):
+        self.wait_timeout = wait_timeout
+        self._driver = None
+        self._lock = threading.Lock()
+
+    def _ensure_driver(self):
+        if self._driver is None:
+            from selenium import webdriver
+            from selenium.webdriver.chrome.options import Options
+
+            opts = Options()
+            opts.add_argument("--headless=new")
+            opts.add_argument("--no-sandbox")
+            opts.add_argument("--disable-dev-shm-usage")
+            # Если у вас chromedriver не в PATH, укажите executable_path
+            self._driver = webdriver.Chrome(options=opts)
+        return self._driver
+
+    def find_pdf(self, page_url: str) -> str:
+        from selenium.common.exceptions import NoSuchElementException, WebDriverException
+        from selenium.webdriver.support import expected_conditions as EC
+        from selenium.webdriver.support.ui import WebDriverWait
+
+        with self._lock:
+            try:
+                driver = self._ensure_driver()
+                driver.get(page_url)
+                elem = WebDriverWait(driver, self.wait_timeout).until(
+                    EC.presence_of_element_located(("xpath", STUDY_PLAN_XPATH))
+                )
+            except WebDriverException:
+                # упавший браузер не переиспользуем
+                self.close()
+                raise
+            href = elem.get_attribute("href")
+            if not href:
+                raise NoSuchElementException("атрибут href пустой")
+            return href
+
+    def close(self):
+        if self._driver is not None:
+            from selenium.common.exceptions import WebDriverException
+
+            try:
+                self._driver.quit()
+            except WebDriverException:
+                pass
+            self._driver = None
 
 
 class HTMLParser:
@@ -18,23 +75,66 @@ class HTMLParser:
     Инициализируется:
       - base_url: базовый URL (например, "https://abit.itmo.ru")
       - pdf_dir:   (опционально) папка для сохранения PDF-файлов
+      - timeout:   таймаут HTTP-запросов, секунды
     Методы:
       - parse_program_page(url: str) -> dict
+      - parse_html(html: str, url: str) -> dict  (без сети и Selenium)
       - save_programs_json(programs: list[dict], out_json: str)
+    Асинхронный обход многих страниц — src.parsers.scraper.AsyncScraper.
     """
 
-    def __init__(self, base_url: str, pdf_dir: Path | str = None):
+    def __init__(self, base_url: str, pdf_dir: Path | str = None, timeout: float = 20.0):
         self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
         if pdf_dir:
             self.pdf_dir = Path(pdf_dir)
             self.pdf_dir.mkdir(parents=True, exist_ok=True)
         else:
             self.pdf_dir = None
+        self._browser = None
+
+    @property
+    def browser(self) -> HeadlessBrowser:
+        if self._browser is None:
+            self._browser = HeadlessBrowser()
+        return self._browser
+
+    def close(self):
+        if self._browser is not None:
+            self._browser.close()
 
     def parse_program_page(self, url: str) -> dict:
-        resp = requests.get(url)
+        resp = requests.get(url, timeout=self.timeout)
         resp.raise_for_status()
-        soup = BeautifulSoup(resp.text, "html.parser")
+        prog = self.parse_html(resp.text, url)
+        pdf_url = prog["pdf_url"]
+
+        # 4) FALLBACK через Selenium, если статический поиск не дал результата
+        if not pdf_url and self.pdf_dir:
+            try:
+                print(f"[selenium] пытаюсь найти PDF на странице {url}")
+                pdf_url = self._find_pdf_via_selenium(url)
+                print(f"[selenium] нашёл PDF: {pdf_url}")
+            except Exception as e:
+                print(f"[selenium] не удалось найти PDF: {e}")
+                pdf_url = None
+
+        # 5) Скачиваем PDF, если URL известен
+        pdf_path = None
+        if pdf_url and self.pdf_dir:
+            print(f"Загружаем PDF для {prog['slug']}: {pdf_url}")
+            pdf_path = self._download_pdf(pdf_url)
+
+        prog["pdf_url"] = pdf_url
+        prog["pdf_path"] = str(pdf_path) if pdf_path else None
+        return prog
+
+    def absolute_url(self, href: str) -> str:
+        return href if href.startswith("http") else self.base_url + (href if href.startswith("/") else "/" + href)
+
+    def parse_html(self, html: str, url: str) -> dict:
+        """Разбор уже скачанной страницы программы: шаги 1–3 и 6."""
+        soup = BeautifulSoup(html, "html.parser")
 
         slug = url.rstrip("/").split("/")[-1]
 
@@ -71,24 +171,16 @@ class HTMLParser:
                 "a", href=lambda x: x and x.lower().endswith(".pdf")
             )
             if a_pdf:
-                href = a_pdf["href"]
-                pdf_url = href if href.startswith("http") else self.base_url + (href if href.startswith("/") else "/" + href)
-
-        # 4) FALLBACK через Selenium, если статический поиск не дал результата
-        if not pdf_url and self.pdf_dir:
-            try:
-                print(f"[selenium] пытаюсь найти PDF на странице {url}")
-                pdf_url = self._find_pdf_via_selenium(url)
-                print(f"[selenium] нашёл PDF: {pdf_url}")
-            except Exception as e:
-                print(f"[selenium] не удалось найти PDF: {e}")
-                pdf_url = None
-
-        # 5) Скачиваем PDF, если URL известен
-        pdf_path = None
-        if pdf_url and self.pdf_dir:
-            print(f"Загружаем PDF для {slug}: {pdf_url}")
-            pdf_path = self._download_pdf(pdf_url)
+                pdf_url = self.absolute_url(a_pdf["href"])
+        if not pdf_url:
+            # без заголовка раздела — любая PDF-ссылка с текстом «учебный план»
+            a_pdf = soup.find(
+                "a",
+                href=lambda x: x and x.lower().endswith(".pdf"),
+                string=lambda t: t and "учебный план" in t.lower(),
+            )
+            if a_pdf:
+                pdf_url = self.absolute_url(a_pdf["href"])
 
         # 6) Контакты
         manager_email = None
@@ -107,7 +199,7 @@ class HTMLParser:
             "title": title,
             "description": description,
             "pdf_url": pdf_url,
-            "pdf_path": str(pdf_path) if pdf_path else None,
+            "pdf_path": None,
             "manager_email": manager_email,
             "manager_phone": manager_phone,
         }
@@ -116,7 +208,7 @@ class HTMLParser:
         """
         Скачиваем pdf_url → self.pdf_dir/<имя_файла>.pdf
         """
-        r = requests.get(pdf_url, stream=True)
+        r = requests.get(pdf_url, stream=True, timeout=self.timeout)
         r.raise_for_status()
         filename = pdf_url.rstrip("/").split("/")[-1]
         dest = self.pdf_dir / filename
@@ -127,32 +219,10 @@ class HTMLParser:
 
     def _find_pdf_via_selenium(self, page_url: str) -> str:
         """
-        Запускаем headless Chrome, загружаем страницу, ищем ссылку
+        Загружаем страницу в общем headless Chrome, ждём ссылку
         «скачать учебный план» и возвращаем её href.
         """
-        opts = Options()
-        opts.headless = True
-        opts.add_argument("--no-sandbox")
-        opts.add_argument("--disable-dev-shm-usage")
-
-        # Если у вас chromedriver не в PATH, укажите executable_path
-        driver = webdriver.Chrome(options=opts)
-        try:
-            driver.get(page_url)
-            # даём JS подгрузиться
-            time.sleep(2)
-
-            # ищем первую ссылку после <h2 id="study-plan">
-            elem = driver.find_element(
-                "xpath",
-                "//h2[@id='study-plan']/following::a[contains(text(),'учебный план')][1]"
-            )
-            href = elem.get_attribute("href")
-            if not href:
-                raise NoSuchElementException("атрибут href пустой")
-            return href
-        finally:
-            driver.quit()
+        return self.browser.find_pdf(page_url)
 
     def save_programs_json(self, programs: list[dict], out_json: str):
         """
@@ -0,0 +1,77 @@
+# src/parsers/page_store.py
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+from pathlib import Path
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def file_hash(path: Path) -> str:
+    """sha256 содержимого файла (читается блоками, PDF бывают большими)."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def normalize_text(text: str) -> str:
+    """
+    Чистит артефакты PyPDF2: в PDF учебных планов каждое слово часто идёт
+    отдельной строкой через строку из пробела («слово\\n \\nслово»).
+    Две и более пустых строки считаем разрывом абзаца, одну — пробелом.
+    """
+    text = text.replace("\r", "")
+    text = re.sub(r"\n(?:[ \t]*\n){2,}", "\n\n", text)
+    text = re.sub(r"[ \t]*\n[ \t]+\n[ \t]*", " ", text)
+    text = re.sub(r"\s*\n([‑-])\n\s*", r"\1", text)        # перенос через дефис
+    text = re.sub(r"[ \t]+", " ", text)
+    return text.strip()
+
+
+def _atomic_write_text(path: Path, text: str) -> None:
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=path.name, suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+class PageStore:
+    """
+    Постраничный кеш извлечённого из PDF текста:
+      <store_dir>/<sha256 файла>/0001.txt, 0002.txt, ... + meta.json.
+    meta.json пишется последним — по нему запись считается завершённой.
+    Неизменившийся PDF (тот же хеш) повторно не парсится.
+    """
+
+    def __init__(self, store_dir: Path):
+        self.store_dir = Path(store_dir)
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+
+    def _dir(self, digest: str) -> Path:
+        return self.store_dir / digest
+
+    def get(self, digest: str) -> Optional[List[str]]:
+        d = self._dir(digest)
+        try:
+            meta = json.loads((d / "meta.json").read_text(encoding="utf-8"))
+            return [
+                (d / f"{i:04d}.txt").read_text(encoding="utf-8")
+                for i in range(1, meta["pages"] + 1)
+            ]
+        except (OSError, ValueError, KeyError) as e:
+            if d.exists():
+                logger.warning("Page store entry %s unreadable (%s)", digest[:12], e)
+            return None
+
+    def put(self, digest: str, pages: List[str], name: str = "") -> None:
+        d = self._dir(digest)
+        d.mkdir(parents=True, exist_ok=True)
+        for i, text in enumerate(pages, start=1):
+            _atomic_write_text(d / f"{i:04d}.txt", text)
+        _atomic_write_text(d / "meta.json", json.dumps({"pages": len(pages), "name": name}))
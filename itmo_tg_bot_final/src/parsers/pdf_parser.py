@@ -1,10 +1,16 @@
 # src/parsers/pdf_parser.py
 import logging
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import Dict
+from typing import Dict, List, Optional, Tuple
 
 from PyPDF2 import PdfReader, PdfWriter
 
+from src.parsers.page_store import file_hash, normalize_text
+
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
@@ -22,18 +28,82 @@ class PDFParser:
     Извлекает текст и примитивно секционирует PDF.
     """
 
-    def extract_text(self, pdf_path: Path) -> str:
+    def extract_pages(self, pdf_path: Path, start: int = 0, end: Optional[int] = None) -> List[str]:
+        """Текст страниц [start, end) (нумерация с 0), по строке на страницу."""
         if not pdf_path.exists():
             raise FileNotFoundError(f"{pdf_path} not found")
         reader = PdfReader(str(pdf_path))
-        parts = []
-        for page in reader.pages:
-            parts.append(page.extract_text() or "")
-        full = "\n".join(parts)
+        pages = reader.pages[start:end]
+        return [page.extract_text() or "" for page in pages]
+
+    def extract_text(self, pdf_path: Path) -> str:
+        full = "\n".join(self.extract_pages(pdf_path))
         logger.info("Extracted %d chars from %s", len(full), pdf_path)
         return full
 
     def parse_structured(self, text: str) -> Dict:
-        sections = text.split("\n\n")
+        text = normalize_text(text)
+        sections = [s.strip() for s in re.split(r"\n\s*\n", text) if s.strip()]
         logger.info("Structured into %d sections", len(sections))
         return {"raw": text, "sections": sections}
+
+
+# ─── ПАРАЛЛЕЛЬНОЕ ИЗВЛЕЧЕНИЕ ───────────────────────────────────────────────────
+def _extract_range(path: str, start: int, end: int) -> List[str]:
+    """Задача для пула процессов (должна быть на уровне модуля для pickle)."""
+    return PDFParser().extract_pages(Path(path), start, end)
+
+
+def extract_pdfs(
+    paths: List[Path],
+    store=None,
+    max_workers: Optional[int] = None,
+    pages_per_task: int = 8,
+) -> Dict[Path, List[str]]:
+    """
+    Постраничный текст нескольких PDF: {path: [текст страницы 1, 2, ...]}.
+    Файлы, уже лежащие в store (PageStore, ключ — хеш файла), не парсятся;
+    остальные режутся на диапазоны по pages_per_task страниц и извлекаются
+    в пуле процессов (PyPDF2 — чистый Python и упирается в GIL).
+    """
+    result: Dict[Path, List[str]] = {}
+    todo: List[Tuple[Path, str, int]] = []
+    for path in paths:
+        path = Path(path)
+        if not path.exists():
+            raise FileNotFoundError(f"{path} not found")
+        digest = file_hash(path) if store is not None else ""
+        cached = store.get(digest) if store is not None else None
+        if cached is not None:
+            result[path] = cached
+        else:
+            todo.append((path, digest, len(PdfReader(str(path)).pages)))
+
+    tasks = [
+        (path, start, min(start + pages_per_task, n_pages))
+        for path, _, n_pages in todo
+        for start in range(0, n_pages, pages_per_task)
+    ]
+    workers = min(max_workers or os.cpu_count() or 1, len(tasks))
+    if workers > 1:
+        # spawn, а не fork: при перезагрузке индекса в процессе уже работают потоки
+        ctx = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+            futures = [pool.submit(_extract_range, str(p), s, e) for p, s, e in tasks]
+            parts = [f.result() for f in futures]
+    else:
+        parts = [_extract_range(str(p), s, e) for p, s, e in tasks]
+
+    pages_by_path: Dict[Path, List[str]] = {path: [] for path, _, _ in todo}
+    for (path, _, _), pages in zip(tasks, parts):
+        pages_by_path[path].extend(pages)
+    for path, digest, _ in todo:
+        result[path] = pages_by_path[path]
+        if store is not None:
+            store.put(digest, pages_by_path[path], name=path.name)
+
+    logger.info(
+        "PDF pages: %d files from store, %d parsed (%d tasks, %d workers)",
+        len(result) - len(todo), len(todo), len(tasks), max(workers, 1),
+    )
+    return {Path(p): result[Path(p)] for p in paths}
@@ -0,0 +1,236 @@
+# src/parsers/scraper.py
+import asyncio
+import json
+import logging
+import os
+import random
+import re
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+from src.parsers.html_parser import HTMLParser
+
+logger = logging.getLogger(__name__)
+
+_RETRY_STATUSES = {429, 500, 502, 503, 504}
+# ссылки на страницы программ; ищем по всему HTML, включая JSON
+# с данными страницы (каталог рендерится на клиенте)
+_PROGRAM_LINK_RE = re.compile(r"/program/master/([a-z0-9][a-z0-9_\-]*)", re.I)
+
+
+class AsyncScraper:
+    """
+    Асинхронный обход страниц программ:
+      - один httpx.AsyncClient с пулом соединений на весь обход;
+      - не больше per_host одновременных запросов к одному хосту;
+      - таймауты и повторы с экспоненциальной задержкой (сеть, 429, 5xx);
+      - условные запросы (If-None-Match / If-Modified-Since): ETag и
+        Last-Modified хранятся в state_path, на 304 страница не разбирается
+        заново, а PDF не скачивается;
+      - Selenium-фолбэк идёт через один долгоживущий браузер HTMLParser.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        pdf_dir: Path = None,
+        state_path: Path = None,
+        per_host: int = 4,
+        timeout: float = 20.0,
+        retries: int = 3,
+        backoff: float = 0.5,
+        use_browser: bool = True,
+        transport: httpx.AsyncBaseTransport = None,
+    ):
+        self.parser = HTMLParser(base_url, pdf_dir=pdf_dir, timeout=timeout)
+        self.pdf_dir = self.parser.pdf_dir
+        self.state_path = Path(state_path) if state_path else None
+        self.per_host = per_host
+        self.retries = retries
+        self.backoff = backoff
+        self.use_browser = use_browser
+        self.client = httpx.AsyncClient(
+            timeout=timeout,
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=per_host * 4, max_keepalive_connections=per_host * 4),
+            headers={"User-Agent": "itmo-tg-bot/1.0"},
+            transport=transport,
+        )
+        self._host_sems: Dict[str, asyncio.Semaphore] = {}
+        self.state: Dict[str, Dict] = self._load_state()
+        self.stats = {"fetched": 0, "not_modified": 0, "retries": 0}
+
+    # ─── состояние условных запросов ─────────────────────────────────────────
+    def _load_state(self) -> Dict[str, Dict]:
+        if self.state_path and self.state_path.exists():
+            try:
+                return json.loads(self.state_path.read_text(encoding="utf-8"))
+            except ValueError:
+                logger.warning("Битый %s, начинаем без кеша", self.state_path)
+        return {}
+
+    def _save_state(self):
+        if not self.state_path:
+            return
+        self.state_path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.state_path.parent, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.state_path)
+
+    @staticmethod
+    def _validators(resp: httpx.Response) -> Dict:
+        return {
+            k: v for k, v in (
+                ("etag", resp.headers.get("etag")),
+                ("last_modified", resp.headers.get("last-modified")),
+            ) if v
+        }
+
+    # ─── HTTP ────────────────────────────────────────────────────────────────
+    def _sem(self, url: str) -> asyncio.Semaphore:
+        host = urlsplit(url).netloc
+        if host not in self._host_sems:
+            self._host_sems[host] = asyncio.Semaphore(self.per_host)
+        return self._host_sems[host]
+
+    async def _request(self, url: str, cached: Optional[Dict], stream_to: Path = None) -> httpx.Response:
+        headers = {}
+        if cached:
+            if cached.get("etag"):
+                headers["If-None-Match"] = cached["etag"]
+            if cached.get("last_modified"):
+                headers["If-Modified-Since"] = cached["last_modified"]
+
+        for attempt in range(self.retries + 1):
+            try:
+                async with self._sem(url):
+                    if stream_to is None:
+                        resp = await self.client.get(url, headers=headers)
+                    else:
+                        resp = await self._download(url, headers, stream_to)
+                if resp.status_code not in _RETRY_STATUSES or attempt == self.retries:
+                    break
+            except httpx.TransportError:
+                if attempt == self.retries:
+                    raise
+            self.stats["retries"] += 1
+            await asyncio.sleep(self.backoff * 2 ** attempt * (0.5 + random.random()))
+
+        if resp.status_code == 304:
+            self.stats["not_modified"] += 1
+            return resp
+        resp.raise_for_status()
+        self.stats["fetched"] += 1
+        return resp
+
+    async def _download(self, url: str, headers: Dict, dest: Path) -> httpx.Response:
+        """Потоково пишет тело во временный файл и атомарно подменяет dest."""
+        async with self.client.stream("GET", url, headers=headers) as resp:
+            if resp.status_code != 200:
+                await resp.aread()
+                return resp
+            fd, tmp = tempfile.mkstemp(dir=dest.parent, suffix=".part")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    async for block in resp.aiter_bytes(65536):
+                        f.write(block)
+                os.replace(tmp, dest)
+            except BaseException:
+                Path(tmp).unlink(missing_ok=True)
+                raise
+            return resp
+
+    # ─── обход ───────────────────────────────────────────────────────────────
+    async def download_pdf(self, pdf_url: str) -> Path:
+        """Скачивает PDF, если он изменился (или его ещё нет на диске)."""
+        dest = self.pdf_dir / pdf_url.rstrip("/").split("/")[-1]
+        cached = self.state.get(pdf_url) if dest.exists() else None
+        resp = await self._request(pdf_url, cached, stream_to=dest)
+        if resp.status_code != 304:
+            self.state[pdf_url] = self._validators(resp)
+            logger.info("Скачан PDF %s", dest.name)
+        return dest
+
+    async def scrape_program(self, url: str) -> Dict:
+        cached = self.state.get(url)
+        # страницу без найденного PDF перепроверяем целиком (вдруг план появился)
+        if not (cached and cached.get("program") and (cached["program"].get("pdf_url") or not self.pdf_dir)):
+            cached = None
+        resp = await self._request(url, cached)
+        if resp.status_code == 304:
+            prog = dict(cached["program"])
+        else:
+            prog = await asyncio.to_thread(self.parser.parse_html, resp.text, url)
+            if not prog["pdf_url"] and self.pdf_dir and self.use_browser:
+                try:
+                    prog["pdf_url"] = await asyncio.to_thread(self.parser.browser.find_pdf, url)
+                except Exception as e:
+                    logger.warning("Selenium не нашёл PDF на %s: %s", url, e)
+            self.state[url] = {**self._validators(resp), "program": prog}
+
+        if prog["pdf_url"] and self.pdf_dir:
+            prog["pdf_path"] = str(await self.download_pdf(prog["pdf_url"]))
+        return prog
+
+    async def discover(self, catalog_url: str, max_pages: int = 30) -> List[str]:
+        """
+        Находит страницы программ в каталоге. Страницы каталога (?page=N)
+        запрашиваются пачками параллельно, пока очередная пачка не перестанет
+        приносить новые ссылки.
+        """
+        base = self.parser.base_url
+        found: Dict[str, None] = {}
+
+        async def page_links(page: int) -> List[str]:
+            url = catalog_url if page == 1 else f"{catalog_url}?page={page}"
+            resp = await self._request(url, None)
+            return [f"{base}/program/master/{slug}" for slug in _PROGRAM_LINK_RE.findall(resp.text)]
+
+        page = 1
+        while page <= max_pages:
+            batch = range(page, min(page + self.per_host, max_pages + 1))
+            results = await asyncio.gather(*(page_links(p) for p in batch), return_exceptions=True)
+            before = len(found)
+            for res in results:
+                if not isinstance(res, Exception):
+                    found.update(dict.fromkeys(res))
+            if len(found) == before:
+                break
+            page += len(batch)
+        logger.info("Каталог %s: найдено %d программ", catalog_url, len(found))
+        return list(found)
+
+    async def scrape(self, urls: List[str]) -> List[Dict]:
+        """Обходит urls конкурентно; упавшие страницы пропускаются с ошибкой в логе."""
+        self.stats = {"fetched": 0, "not_modified": 0, "retries": 0}
+        results = await asyncio.gather(*(self.scrape_program(u) for u in urls), return_exceptions=True)
+        programs = []
+        for url, res in zip(urls, results):
+            if isinstance(res, Exception):
+                logger.error("Ошибка парсинга %s: %s", url, res)
+            else:
+                programs.append(res)
+        self._save_state()
+        logger.info(
+            "Скрейпинг: %d/%d страниц, %d запросов, %d не изменились (304), %d повторов",
+            len(programs), len(urls), self.stats["fetched"], self.stats["not_modified"], self.stats["retries"],
+        )
+        return programs
+
+    def save_programs_json(self, programs: List[Dict], out_json: Path):
+        self.parser.save_programs_json(programs, out_json)
+
+    async def aclose(self):
+        await self.client.aclose()
+        await asyncio.to_thread(self.parser.close)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
@@ -0,0 +1,178 @@
+# src/rag/ann.py
+import logging
+import math
+from typing import NamedTuple, Optional
+
+import faiss
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+INDEX_TYPES = ("auto", "flat", "hnsw", "ivf")
+QUANTIZATIONS = ("none", "fp16", "sq8", "pq")
+
+
+class IndexParams(NamedTuple):
+    """
+    Параметры векторного индекса (векторы нормированы, метрика — inner product).
+      kind:            flat | hnsw | ivf | auto (flat до flat_threshold векторов, дальше hnsw)
+      hnsw_m:          число связей в графе HNSW (память ~ 2*M int32 на вектор)
+      ef_construction: ширина поиска при построении HNSW
+      ef_search:       ширина поиска HNSW — главный рычаг recall/латентность
+      nlist:           число кластеров IVF (None — ~4*sqrt(N))
+      nprobe:          сколько кластеров IVF просматривать на запрос
+      quantization:    хранение векторов в индексе: none (float32) | fp16 | sq8 | pq;
+                       со сжатием первый проход приближённый, кандидаты
+                       (rescore_factor * k) пересчитываются по точным векторам
+      pq_m:            число подквантователей PQ (байт на вектор при 8 битах)
+    ef_search и nprobe можно менять на лету, индекс не перестраивается.
+    """
+    kind: str = "auto"
+    hnsw_m: int = 32
+    ef_construction: int = 200
+    ef_search: int = 64
+    nlist: Optional[int] = None
+    nprobe: int = 8
+    flat_threshold: int = 5000
+    quantization: str = "none"
+    pq_m: int = 64
+    rescore_factor: int = 4
+
+    @property
+    def exact(self) -> bool:
+        """Оценки индекса совпадают с точным косинусом (пересчёт не нужен)."""
+        return self.quantization == "none"
+
+    def resolve(self, n: int) -> str:
+        if self.kind not in INDEX_TYPES:
+            raise ValueError(f"Unknown index type: {self.kind}")
+        if self.kind == "auto":
+            return "flat" if n < self.flat_threshold else "hnsw"
+        return self.kind
+
+    def build_key(self, n: int) -> str:
+        """Часть отпечатка снапшота: только то, что влияет на построение индекса."""
+        kind = self.resolve(n)
+        key = f"{kind}/{self.quantization}"
+        if kind == "hnsw":
+            key += f"/m{self.hnsw_m}/efc{self.ef_construction}"
+        if kind == "ivf":
+            key += f"/nlist{self._nlist(n)}"
+        if self.quantization == "pq":
+            key += f"/pq{self.pq_m}"
+        return key
+
+    def factory_string(self, n: int, dim: int) -> str:
+        """Описание индекса в формате faiss.index_factory."""
+        if self.quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization: {self.quantization}")
+        kind = self.resolve(n)
+        codec = {
+            "none": "Flat",
+            "fp16": "SQfp16",
+            "sq8": "SQ8",
+            "pq": f"PQ{self._pq_m(dim)}x{self._pq_nbits(n)}",
+        }[self.quantization]
+        if kind == "hnsw":
+            return f"HNSW{self.hnsw_m}" + ("" if codec == "Flat" else "_" + codec)
+        if kind == "ivf":
+            return f"IVF{self._nlist(n)},{codec}"
+        return codec
+
+    def _pq_m(self, dim: int) -> int:
+        # число подквантователей должно делить размерность
+        return max(m for m in range(1, min(self.pq_m, dim) + 1) if dim % m == 0)
+
+    @staticmethod
+    def _pq_nbits(n: int) -> int:
+        # на обучение кодовой книги нужно не меньше 2^nbits векторов
+        return max(1, min(8, int(math.log2(max(n, 2)))))
+
+    def _nlist(self, n: int) -> int:
+        # faiss хочет от ~39 обучающих векторов на кластер
+        nlist = self.nlist or int(4 * math.sqrt(n))
+        return max(1, min(nlist, n // 39))
+
+
+def build_index(embs: np.ndarray, params: IndexParams):
+    """Строит индекс по уже нормированным float32-векторам."""
+    n, dim = embs.shape
+    spec = params.factory_string(n, dim)
+    index = faiss.index_factory(dim, spec, faiss.METRIC_INNER_PRODUCT)
+    if hasattr(index, "hnsw"):
+        index.hnsw.efConstruction = params.ef_construction
+    if not index.is_trained:
+        index.train(embs)
+    index.add(embs)
+    prepare_index(index)
+    logger.info("Built %s index with %d vectors (dim=%d)", spec, n, dim)
+    return index
+
+
+class MmapFlatIndex:
+    """
+    Точный поиск (inner product) прямо по отображённой в память матрице
+    нормированных векторов — vectors.npy снапшота. faiss.read_index копирует
+    IndexFlat в кучу процесса даже с IO_FLAG_MMAP, а страницы файла общие
+    для всех процессов, открывших снапшот (воркеры вебхука).
+    Интерфейс — подмножество faiss.Index, которое нужно пайплайну.
+    """
+
+    def __init__(self, vectors: np.ndarray, block_rows: int = 65536):
+        self.vectors = vectors
+        self.d = vectors.shape[1]
+        self.block_rows = block_rows
+
+    @property
+    def ntotal(self) -> int:
+        return len(self.vectors)
+
+    def search(self, q: np.ndarray, k: int):
+        nq, n = len(q), self.ntotal
+        scores = np.full((nq, k), -np.inf, dtype="float32")
+        ids = np.full((nq, k), -1, dtype="int64")
+        kk = min(k, n)
+        if not kk:
+            return scores, ids
+        # по блокам строк: матрица оценок nq x n не растёт с корпусом
+        best_s = np.empty((nq, 0), dtype="float32")
+        best_i = np.empty((nq, 0), dtype="int64")
+        for start in range(0, n, self.block_rows):
+            block = np.asarray(self.vectors[start:start + self.block_rows], dtype="float32")
+            s = np.concatenate([best_s, q @ block.T], axis=1)
+            i = np.concatenate([best_i, np.broadcast_to(np.arange(start, start + len(block)), (nq, len(block)))], axis=1)
+            if s.shape[1] > kk:
+                top = np.argpartition(-s, kk - 1, axis=1)[:, :kk]
+                s, i = np.take_along_axis(s, top, 1), np.take_along_axis(i, top, 1)
+            best_s, best_i = s, i
+        order = np.argsort(-best_s, axis=1, kind="stable")
+        scores[:, :kk] = np.take_along_axis(best_s, order, 1)
+        ids[:, :kk] = np.take_along_axis(best_i, order, 1)
+        return scores, ids
+
+    def reconstruct(self, i: int) -> np.ndarray:
+        return np.asarray(self.vectors[i], dtype="float32")
+
+    def reconstruct_n(self, i0: int, n: int) -> np.ndarray:
+        return np.asarray(self.vectors[i0:i0 + n], dtype="float32")
+
+
+def prepare_index(index):
+    """IVF нужна прямая карта id -> вектор для reconstruct (инкрементальные обновления)."""
+    try:
+        ivf = faiss.extract_index_ivf(index)
+    except (RuntimeError, TypeError):       # не IVF (в т.ч. MmapFlatIndex)
+        return
+    if ivf.direct_map.type == faiss.DirectMap.NoMap:
+        ivf.make_direct_map()
+
+
+def configure_search(index, params: IndexParams, k: int):
+    """Выставляет параметры поиска; ширина поиска не меньше числа запрашиваемых соседей."""
+    if hasattr(index, "hnsw"):
+        index.hnsw.efSearch = max(params.ef_search, k)
+    else:
+        try:
+            faiss.extract_index_ivf(index).nprobe = params.nprobe
+        except (RuntimeError, TypeError):
+            pass
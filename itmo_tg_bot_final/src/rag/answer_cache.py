@@ -0,0 +1,118 @@
+# src/rag/answer_cache.py
+import hashlib
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_question(text: str) -> str:
+    text = text.lower().replace("ё", "е")
+    text = re.sub(r"[^\w\s]", " ", text)
+    return " ".join(text.split())
+
+
+def chunk_set_key(docs: List[Dict]) -> str:
+    """Ключ набора найденных чанков: ответ валиден только для того же контекста."""
+    h = hashlib.sha1()
+    for d in docs:
+        h.update(d["source"].encode("utf-8"))
+        h.update(b"\0")
+        h.update(d["page_content"].encode("utf-8"))
+        h.update(b"\1")
+    return h.hexdigest()
+
+
+class AnswerCache:
+    """
+    LRU/TTL-кеш готовых ответов перед генерацией.
+      - get_exact(question): совпадение нормализованного вопроса, без ретрива;
+      - get_similar(q_vec, chunk_key): близкий по косинусу вопрос (>= similarity)
+        с тем же набором найденных чанков.
+    Переиндексация должна вызывать clear().
+    """
+
+    def __init__(self, max_entries: int = 512, ttl_sec: float = 3600.0,
+                 similarity: float = 0.97):
+        self.max_entries = max_entries
+        self.ttl_sec = ttl_sec
+        self.similarity = similarity
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self._matrix: Optional[np.ndarray] = None     # векторы в порядке self._keys
+        self._keys: List[str] = []
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _expired(self, entry: Dict) -> bool:
+        return self.ttl_sec > 0 and time.monotonic() - entry["ts"] > self.ttl_sec
+
+    def _hit(self, key: str) -> Dict:
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return self._entries[key]["result"]
+
+    def get_exact(self, question: str) -> Optional[Dict]:
+        key = normalize_question(question)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if self._expired(entry):
+                self._drop(key)
+                return None
+            return self._hit(key)
+
+    def get_similar(self, q_vec: np.ndarray, chunk_key: str) -> Optional[Dict]:
+        with self._lock:
+            if not self._entries:
+                self.misses += 1
+                return None
+            if self._matrix is None:
+                self._keys = list(self._entries)
+                self._matrix = np.vstack([self._entries[k]["vec"] for k in self._keys])
+            sims = self._matrix @ q_vec
+            for j in np.argsort(-sims):
+                if sims[j] < self.similarity:
+                    break
+                key = self._keys[j]
+                entry = self._entries[key]
+                if entry["chunk_key"] == chunk_key and not self._expired(entry):
+                    return self._hit(key)
+            self.misses += 1
+            return None
+
+    def put(self, question: str, q_vec: np.ndarray, chunk_key: str, result: Dict):
+        key = normalize_question(question)
+        vec = np.asarray(q_vec, dtype="float32").ravel()
+        vec = vec / (np.linalg.norm(vec) or 1.0)
+        with self._lock:
+            self._entries[key] = {
+                "vec": vec, "chunk_key": chunk_key, "result": result, "ts": time.monotonic(),
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._matrix = None
+
+    def _drop(self, key: str):
+        self._entries.pop(key, None)
+        self._matrix = None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+        logger.info("Answer cache cleared")
+
+    def stats(self) -> Dict:
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
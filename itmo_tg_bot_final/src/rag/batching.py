@@ -0,0 +1,83 @@
+# src/rag/batching.py
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, List
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBatcher:
+    """
+    Микробатчинг запросов к эмбеддеру.
+    Конкурентные вызовы submit() складываются в очередь; фоновый поток
+    забирает до max_batch запросов и обрабатывает их одним вызовом
+    batch_fn(queries) -> list[result] (один encode + один index.search).
+
+    Окно ожидания max_wait_ms включается только под нагрузкой (когда
+    предыдущий батч был больше одного запроса), поэтому одиночный
+    запрос при низкой нагрузке не ждёт.
+    """
+
+    def __init__(self, batch_fn: Callable[[List[str]], list], max_batch: int = 16,
+                 max_wait_ms: float = 2.0):
+        if max_batch < 1:
+            raise ValueError("max_batch must be >= 1")
+        self.batch_fn = batch_fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue: "queue.Queue" = queue.Queue()
+        self._last_batch = 1
+        self._closed = False
+        self._worker = threading.Thread(target=self._run, name="rag-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, query: str) -> Future:
+        if self._closed:
+            raise RuntimeError("QueryBatcher is closed")
+        fut: Future = Future()
+        self._queue.put((query, fut))
+        return fut
+
+    def search(self, query: str):
+        return self.submit(query).result()
+
+    def close(self):
+        self._closed = True
+        self._queue.put(None)
+
+    def _collect(self, first) -> list:
+        batch = [first]
+        deadline = time.monotonic() + (self.max_wait if self._last_batch > 1 else 0.0)
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = self._collect(first)
+            self._last_batch = len(batch)
+            queries = [q for q, _ in batch]
+            try:
+                results = self.batch_fn(queries)
+            except BaseException as e:
+                for _, fut in batch:
+                    fut.set_exception(e)
+                continue
+            for (_, fut), res in zip(batch, results):
+                fut.set_result(res)
+            if len(batch) > 1:
+                logger.debug("Batched %d queries", len(batch))
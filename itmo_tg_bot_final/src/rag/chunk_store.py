@@ -0,0 +1,88 @@
+# src/rag/chunk_store.py
+import json
+import os
+from pathlib import Path
+from typing import Dict, Iterator, List, Sequence
+
+import numpy as np
+
+
+class ChunkStore(Sequence):
+    """
+    Колоночное хранилище чанков на диске, отображаемое в память (mmap):
+      text.bin + text_offsets.npy   — тексты подряд в UTF-8 и смещения (N+1);
+      meta_<key>.npy + columns.json — метаданные, словарное кодирование
+                                      (int32-код на чанк, -1 — ключа нет).
+    Ведёт себя как список словарей {"page_content": ..., <метаданные>}:
+    словарь собирается при обращении, в куче процесса живут только словари
+    значений метаданных (источники, семестры — их мало). Страницы файлов
+    делятся через page cache между всеми процессами бота на хосте.
+    """
+
+    def __init__(self, store_dir: Path):
+        self.store_dir = Path(store_dir)
+        self.columns: Dict[str, List] = json.loads(
+            (self.store_dir / "columns.json").read_text(encoding="utf-8")
+        )
+        self._offsets = np.load(self.store_dir / "text_offsets.npy", mmap_mode="r")
+        size = int(self._offsets[-1])
+        # np.memmap не умеет пустые файлы
+        self._text = np.memmap(self.store_dir / "text.bin", dtype=np.uint8, mode="r") if size else b""
+        self._codes = {
+            key: np.load(self.store_dir / f"meta_{i}.npy", mmap_mode="r")
+            for i, key in enumerate(self.columns)
+        }
+
+    @staticmethod
+    def write(store_dir: Path, chunks: Sequence[Dict]) -> "ChunkStore":
+        store_dir = Path(store_dir)
+        store_dir.mkdir(parents=True, exist_ok=True)
+        keys = sorted({k for c in chunks for k in c if k != "page_content"})
+        values: Dict[str, Dict] = {k: {} for k in keys}
+        codes = {k: np.full(len(chunks), -1, dtype=np.int32) for k in keys}
+        offsets = np.zeros(len(chunks) + 1, dtype=np.int64)
+        with open(store_dir / "text.bin", "wb") as f:
+            for i, c in enumerate(chunks):
+                data = c["page_content"].encode("utf-8")
+                f.write(data)
+                offsets[i + 1] = offsets[i] + len(data)
+                for k in keys:
+                    if k in c:
+                        codes[k][i] = values[k].setdefault(c[k], len(values[k]))
+        np.save(store_dir / "text_offsets.npy", offsets)
+        for i, k in enumerate(keys):
+            np.save(store_dir / f"meta_{i}.npy", codes[k])
+        # columns.json пишется последним: порядок ключей = номера файлов meta_<i>
+        tmp = store_dir / "columns.json.tmp"
+        tmp.write_text(json.dumps({k: list(values[k]) for k in keys}, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, store_dir / "columns.json")
+        return ChunkStore(store_dir)
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def text(self, i: int) -> str:
+        start, end = int(self._offsets[i]), int(self._offsets[i + 1])
+        return bytes(self._text[start:end]).decode("utf-8")
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        chunk = {"page_content": self.text(i)}
+        for key, vals in self.columns.items():
+            code = int(self._codes[key][i])
+            if code >= 0:
+                chunk[key] = vals[code]
+        return chunk
+
+    def __iter__(self) -> Iterator[Dict]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def texts(self) -> Iterator[str]:
+        for i in range(len(self)):
+            yield self.text(i)
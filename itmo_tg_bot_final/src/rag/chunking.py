@@ -0,0 +1,153 @@
+# src/rag/chunking.py
+import logging
+import re
+from typing import Dict, List, Optional
+
+from src.rag.context import TokenCounter
+
+logger = logging.getLogger(__name__)
+
+# Заголовки, на которых чанк обязательно заканчивается и меняются метаданные
+# (общие с разбором таблиц учебных планов в facts.py)
+SEMESTER_RE = re.compile(r"^\s*(?:(\d{1,2})\s*(?:-?й\s*)?семестр|семестр\s*(\d{1,2}))", re.I)
+BLOCK_RE = re.compile(
+    r"^\s*(блок\s*\d*\.?[^●\n]{0,60}|модуль\s*\d*\.?[^●\n]{0,60}"
+    r"|обязательн\w*\s+дисциплин\w*|пул\s+выборн\w*[^●\n]{0,40}|выборн\w*\s+дисциплин\w*"
+    r"|электив\w*[^●\n]{0,40}|универсальн\w*\s+подготовк\w*|практик\w*"
+    r"|государственн\w*\s+итогов\w*\s+аттестац\w*)",
+    re.I,
+)
+# Тематические разделы программ вступительных (например «2. Алгоритмы и структуры данных Подтемы»)
+_SECTION_RE = re.compile(r"^\s*\d{1,2}\.\s+([А-ЯЁA-Z][^●\n]{2,80}?)\s+Подтемы\b")
+
+# Где внутри длинной строки можно резать, не ломая смысловые единицы
+_UNIT_SPLIT_RE = re.compile(
+    r"(?=●)|(?=\b\d{1,2}\.\s+[А-ЯЁA-Z][^●\n]{2,80}?\s+Подтемы\b)"
+    r"|(?=\b\d{1,2}\s*(?:-?й\s*)?семестр)|(?=\bСеместр\s*\d)"
+)
+_SENTENCE_SPLIT_RE = re.compile(r"(?<=[.!?;])\s+")
+
+
+class StructuredChunker:
+    """
+    Чанкер по структуре учебных планов вместо окна в N символов.
+      - режет по границам семестров, блоков/элективов и тематических разделов;
+      - строки таблиц (одна строка = одна дисциплина) не разрываются;
+      - размер чанка меряется токенами эмбеддера (max_tokens), без перекрытия;
+      - каждый чанк несёт метаданные program / semester / block / section,
+        а продолжение раздела начинается со строки-«хлебной крошки».
+    """
+
+    def __init__(self, counter: TokenCounter, max_tokens: int = 256):
+        self.counter = counter
+        self.max_tokens = max_tokens
+
+    # ─── разбиение на единицы ───────────────────────────────────────────────
+    def _units(self, paragraphs: List[str]) -> List[str]:
+        units = []
+        for para in paragraphs:
+            for line in para.split("\n"):
+                line = line.strip()
+                if not line:
+                    continue
+                if self.counter.count(line) <= self.max_tokens and not _UNIT_SPLIT_RE.search(line[1:]):
+                    units.append(line)
+                    continue
+                units.extend(p.strip() for p in _UNIT_SPLIT_RE.split(line) if p.strip())
+        return units
+
+    def _split_long(self, unit: str) -> List[str]:
+        """Слишком длинная единица режется по предложениям, затем по словам."""
+        if self.counter.count(unit) <= self.max_tokens:
+            return [unit]
+        pieces, cur = [], ""
+        for part in _SENTENCE_SPLIT_RE.split(unit):
+            words = [part] if self.counter.count(part) <= self.max_tokens else part.split(" ")
+            for w in words:
+                cand = f"{cur} {w}".strip()
+                if cur and self.counter.count(cand) > self.max_tokens:
+                    pieces.append(cur)
+                    cur = w
+                else:
+                    cur = cand
+        if cur:
+            pieces.append(cur)
+        return pieces
+
+    # ─── сборка чанков ──────────────────────────────────────────────────────
+    @staticmethod
+    def _breadcrumb(meta: Dict) -> str:
+        parts = []
+        if meta.get("semester"):
+            parts.append(f"Семестр {meta['semester']}")
+        for key in ("block", "section"):
+            if meta.get(key):
+                parts.append(meta[key])
+        return " / ".join(parts)
+
+    def chunk(self, doc: Dict) -> List[Dict]:
+        base = {"source": doc["source"]}
+        if doc.get("program"):
+            base["program"] = doc["program"]
+
+        meta: Dict[str, Optional[str]] = {}
+        chunks: List[Dict] = []
+        buf: List[str] = []
+        buf_tokens = 0
+        buf_pages: List[int] = []
+        has_body = False            # в буфере есть что-то кроме заголовков
+
+        def flush():
+            nonlocal buf, buf_tokens, buf_pages, has_body
+            if has_body:
+                chunk = {"page_content": "\n".join(buf), **base}
+                chunk.update({k: v for k, v in meta.items() if v})
+                if buf_pages:
+                    chunk["page"] = buf_pages[0]
+                    if buf_pages[-1] != buf_pages[0]:
+                        chunk["page_end"] = buf_pages[-1]
+                chunks.append(chunk)
+            buf, buf_tokens, buf_pages, has_body = [], 0, [], False
+
+        # постраничный текст PDF (номера страниц идут в метаданные чанков),
+        # иначе абзацы всего текста; семестр/блок переносятся через границу страниц
+        if doc.get("pages"):
+            pages = [(no, re.split(r"\n\s*\n", text)) for no, text in enumerate(doc["pages"], start=1)]
+        else:
+            pages = [(doc.get("page"), re.split(r"\n\s*\n", doc["page_content"]))]
+        units = [(no, unit) for no, paragraphs in pages for unit in self._units(paragraphs)]
+        for page_no, unit in units:
+            m_sem, m_block, m_sec = SEMESTER_RE.match(unit), BLOCK_RE.match(unit), _SECTION_RE.match(unit)
+            is_heading = bool(m_sem or m_block or m_sec)
+            parent = dict(meta)
+            if is_heading:
+                if has_body:
+                    flush()
+                if m_sem:
+                    meta = {"semester": m_sem.group(1) or m_sem.group(2)}
+                    parent = {}
+                elif m_block:
+                    meta = {"semester": meta.get("semester"), "block": m_block.group(1).strip(" .:")}
+                    parent = {"semester": meta["semester"]}
+                else:
+                    meta = {**meta, "section": m_sec.group(1).strip(" .:")}
+                    parent = {k: v for k, v in meta.items() if k != "section"}
+
+            for piece in self._split_long(unit):
+                n = self.counter.count(piece)
+                if has_body and buf_tokens + n > self.max_tokens:
+                    flush()
+                if not buf:
+                    # продолжение раздела начинаем с «хлебной крошки»; заголовок
+                    # сам себя не повторяет, но получает контекст родителя
+                    crumb = self._breadcrumb(parent if is_heading else meta)
+                    if crumb:
+                        buf.append(f"[{crumb}]")
+                        buf_tokens += self.counter.count(crumb)
+                buf.append(piece)
+                buf_tokens += n
+                if page_no is not None:
+                    buf_pages.append(page_no)
+                has_body = has_body or not is_heading
+        flush()
+        return chunks
@@ -0,0 +1,98 @@
+# src/rag/context.py
+import logging
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class TokenCounter:
+    """
+    Считает токены токенизатором обслуживаемой модели (transformers.AutoTokenizer)
+    или уже загруженным токенизатором (например, эмбеддера).
+    Если токенизатора нет или он не загрузился — грубая оценка по символам
+    (для русского текста ~3 символа на токен, с запасом).
+    """
+
+    CHARS_PER_TOKEN = 3.0
+
+    def __init__(self, tokenizer_name: Optional[str] = None, tokenizer=None):
+        self.tokenizer = tokenizer
+        if tokenizer is None and tokenizer_name:
+            try:
+                from transformers import AutoTokenizer
+
+                self.tokenizer = AutoTokenizer.from_pretrained(tokenizer_name)
+                logger.info("Token counting with %s tokenizer", tokenizer_name)
+            except Exception as e:
+                logger.warning("Tokenizer %s unavailable (%s), using estimate", tokenizer_name, e)
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self.tokenizer is not None:
+            return len(self.tokenizer.encode(text, add_special_tokens=False))
+        return int(len(text) / self.CHARS_PER_TOKEN) + 1
+
+
+def _merge_group(chunks: List[Dict]) -> List[str]:
+    """
+    Склеивает чанки одного источника, идущие подряд или перекрывающиеся
+    (скользящее окно chunk_text), убирая повтор перекрытия.
+    Чанки без смещения start выводятся как есть.
+    """
+    with_start = sorted((c for c in chunks if "start" in c), key=lambda c: c["start"])
+    texts = [c["page_content"] for c in chunks if "start" not in c]
+    cur_text, cur_end = None, None
+    for c in with_start:
+        start, text = c["start"], c["page_content"]
+        if cur_text is not None and start <= cur_end:
+            cur_text += text[cur_end - start:]
+            cur_end = max(cur_end, start + len(text))
+        else:
+            if cur_text is not None:
+                texts.append(cur_text)
+            cur_text, cur_end = text, start + len(text)
+    if cur_text is not None:
+        texts.append(cur_text)
+    return texts
+
+
+def pack_context(
+    docs: List[Dict], counter: TokenCounter, budget: int
+) -> Tuple[List[Dict], List[Dict]]:
+    """
+    Отбирает чанки в порядке релевантности (docs уже отсортированы по score),
+    пока они помещаются в budget токенов; дубликаты текста пропускаются.
+    Отобранные чанки группируются по источнику, соседние склеиваются.
+    Возвращает (блоки [{"source", "text"}] в порядке лучшего чанка, отобранные чанки).
+    """
+    used, seen, total = [], set(), 0
+    for d in docs:
+        text = d["page_content"]
+        if not text.strip() or text in seen:
+            continue
+        n = counter.count(text)
+        if total + n > budget:
+            continue
+        seen.add(text)
+        used.append(d)
+        total += n
+
+    groups: Dict[str, List[Dict]] = {}
+    for d in used:
+        groups.setdefault(d["source"], []).append(d)
+    blocks = [
+        {"source": src, "text": text}
+        for src, chunks in groups.items()
+        for text in _merge_group(chunks)
+    ]
+    logger.info(
+        "Packed %d/%d chunks into %d blocks (~%d tokens, budget %d)",
+        len(used), len(docs), len(blocks), total, budget,
+    )
+    return blocks, used
+
+
+def render_context(blocks: List[Dict]) -> str:
+    parts = [f"[Источник: {b['source']}]\n{b['text'].strip()}" for b in blocks]
+    return "Фрагменты документов о программах:\n\n" + "\n\n".join(parts)
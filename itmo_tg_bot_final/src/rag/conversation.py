@@ -0,0 +1,188 @@
+# src/rag/conversation.py
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict, deque
+from pathlib import Path
+from typing import Deque, Dict, List, NamedTuple, Optional, Tuple
+
+from src.rag.context import TokenCounter
+
+logger = logging.getLogger(__name__)
+
+# уточняющий вопрос: начинается с союза или ссылается местоимением на прошлую тему
+_FOLLOWUP_START_RE = re.compile(r"^(а|и|но|ещё|еще|также|тогда|то есть|а если|а что|а как)\b", re.I)
+_FOLLOWUP_REF_RE = re.compile(
+    r"\b(там|тут|туда|это|этом|этой|этого|эти|этих|такое|такие|такой|"
+    r"он|она|оно|они|него|неё|нее|них|ним|ней|нём|нем|его|её|ее|их)\b",
+    re.I,
+)
+FOLLOWUP_MAX_WORDS = 10
+
+
+def is_followup(question: str) -> bool:
+    """Короткий вопрос, который без предыдущего не понять («а какие там элективы?»)."""
+    words = question.split()
+    if not words or len(words) > FOLLOWUP_MAX_WORDS:
+        return False
+    return bool(_FOLLOWUP_START_RE.search(question) or _FOLLOWUP_REF_RE.search(question))
+
+
+class Turn(NamedTuple):
+    question: str
+    answer: str
+    topic: str          # самостоятельный вопрос, с которого начался текущий «тред»
+
+
+class Conversation:
+    """
+    История одного чата: последние max_turns реплик и сжатая сводка
+    вытесненных — список прошлых вопросов длиной не больше summary_chars.
+    """
+
+    def __init__(self, max_turns: int, summary_chars: int):
+        self.turns: Deque[Turn] = deque(maxlen=max_turns)
+        self.summary = ""
+        self.summary_chars = summary_chars
+
+    def _fold(self, questions: List[str]) -> str:
+        """Сводка + вопросы -> новая сводка; старейшее отрезается первым."""
+        text = "; ".join([s for s in [self.summary] + questions if s])
+        return text[-self.summary_chars:].lstrip("; ")
+
+    def add(self, turn: Turn):
+        if len(self.turns) == self.turns.maxlen:
+            self.summary = self._fold([self.turns[0].question])
+        self.turns.append(turn)
+
+    def rewrite(self, question: str) -> Tuple[str, str]:
+        """
+        -> (запрос для поиска, тема). Уточняющий вопрос дополняется темой
+        треда, чтобы ретрив искал по ней, а не по «там» и «они».
+        """
+        if self.turns and is_followup(question):
+            topic = self.turns[-1].topic
+            return f"{topic} {question}", topic
+        return question, question
+
+    def messages(self, counter: TokenCounter, budget: int) -> List[Dict]:
+        """
+        Реплики для промпта, не больше budget токенов: новые целиком,
+        не влезшие старые (и вытесненные ранее) — одной строкой сводки.
+        """
+        kept: List[Dict] = []
+        used = 0
+        older: List[str] = []
+        for turn in reversed(self.turns):
+            pair = [
+                {"role": "user", "content": turn.question},
+                {"role": "assistant", "content": turn.answer},
+            ]
+            n = sum(counter.count(m["content"]) + 8 for m in pair)
+            if older or used + n > budget:
+                older.append(turn.question)
+                continue
+            kept[:0] = pair
+            used += n
+        summary = self._fold(list(reversed(older)))
+        if summary:
+            note = {"role": "system", "content": f"Ранее в диалоге пользователь спрашивал: {summary}"}
+            if used + counter.count(note["content"]) + 8 <= budget:
+                kept.insert(0, note)
+        return kept
+
+    def to_dict(self) -> Dict:
+        return {"summary": self.summary, "turns": [list(t) for t in self.turns]}
+
+
+class ConversationStore:
+    """
+    Истории чатов в LRU по chat_id: не больше max_chats разговоров, в каждом
+    не больше max_turns реплик, вопрос и ответ обрезаются до max_question_chars
+    и max_answer_chars — память ограничена при любом числе чатов.
+    path — JSON для сохранения между перезапусками (save() / загрузка в конструкторе).
+    """
+
+    def __init__(
+        self,
+        max_chats: int = 10000,
+        max_turns: int = 6,
+        max_question_chars: int = 500,
+        max_answer_chars: int = 1500,
+        summary_chars: int = 600,
+        path: Path = None,
+    ):
+        self.max_chats = max_chats
+        self.max_turns = max_turns
+        self.max_question_chars = max_question_chars
+        self.max_answer_chars = max_answer_chars
+        self.summary_chars = summary_chars
+        self.path = Path(path) if path else None
+        self._chats: "OrderedDict[str, Conversation]" = OrderedDict()
+        self._lock = threading.Lock()
+        if self.path and self.path.exists():
+            self._load()
+
+    def __len__(self) -> int:
+        return len(self._chats)
+
+    def _new(self) -> Conversation:
+        return Conversation(self.max_turns, self.summary_chars)
+
+    def get(self, chat_id) -> Conversation:
+        """История чата (пустая, если её нет); обращение освежает запись в LRU."""
+        key = str(chat_id)
+        with self._lock:
+            conv = self._chats.get(key)
+            if conv is None:
+                return self._new()
+            self._chats.move_to_end(key)
+            return conv
+
+    def append(self, chat_id, question: str, answer: str, topic: str = None):
+        key = str(chat_id)
+        question = question[: self.max_question_chars]
+        turn = Turn(question, answer[: self.max_answer_chars], (topic or question)[: self.max_question_chars])
+        with self._lock:
+            conv = self._chats.get(key)
+            if conv is None:
+                conv = self._chats[key] = self._new()
+            self._chats.move_to_end(key)
+            conv.add(turn)
+            while len(self._chats) > self.max_chats:
+                self._chats.popitem(last=False)
+
+    def reset(self, chat_id):
+        with self._lock:
+            self._chats.pop(str(chat_id), None)
+
+    # ─── сохранение ──────────────────────────────────────────────────────────
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            data = {key: conv.to_dict() for key, conv in self._chats.items()}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.path.parent, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+        logger.info("Saved %d conversations to %s", len(data), self.path)
+
+    def _load(self):
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+        except ValueError:
+            logger.warning("Битый %s, начинаем без истории", self.path)
+            return
+        # порядок в файле — порядок LRU, последние записи самые свежие
+        for key, item in list(data.items())[-self.max_chats:]:
+            conv = self._new()
+            conv.summary = item.get("summary", "")
+            for t in item.get("turns", []):
+                conv.turns.append(Turn(*t))
+            self._chats[key] = conv
+        logger.info("Loaded %d conversations from %s", len(self._chats), self.path)
@@ -0,0 +1,192 @@
+# src/rag/embedders.py
+import logging
+import math
+import os
+import re
+from pathlib import Path
+from typing import List
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# torch — SentenceTransformer как раньше; onnx — тот же граф в ONNX Runtime;
+# onnx-int8 — с динамически квантованными в int8 весами MatMul (~в 2–3 раза быстрее на CPU)
+EMBED_BACKENDS = ("torch", "onnx", "onnx-int8")
+DEFAULT_EXPORT_DIR = Path.home() / ".cache" / "itmo_rag" / "onnx"
+# зависимости бэкендов onnx/onnx-int8 (onnxruntime, onnx для квантования, tokenizers)
+# в requirements.txt не входят: образу с torch они не нужны
+ONNX_REQUIREMENTS = "requirements_onnx.txt"
+
+
+def available_cores() -> int:
+    """
+    Сколько ядер реально есть у процесса: affinity и квота cgroup v2
+    (cpu.max в контейнере). os.cpu_count() видит все ядра хоста, и пул
+    потоков на 64 ядра при квоте в 4 только толкается на троттлинге.
+    """
+    try:
+        n = len(os.sched_getaffinity(0))
+    except AttributeError:
+        n = os.cpu_count() or 1
+    try:
+        quota, period = Path("/sys/fs/cgroup/cpu.max").read_text().split()[:2]
+        if quota != "max":
+            n = min(n, max(1, math.ceil(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return n
+
+
+def _slug(name: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]+", "__", name)
+
+
+def _onnx_missing(e: ImportError) -> ImportError:
+    return ImportError(
+        f"ONNX embed backend needs {e.name or 'onnxruntime'}: pip install -r {ONNX_REQUIREMENTS}"
+    )
+
+
+class OnnxEmbedder:
+    """
+    Эмбеддер (e5 и другие XLM-R/BERT с mean pooling) в ONNX Runtime без torch.
+    Граф экспортируется из HF один раз (export_onnx, тут torch нужен) в
+    export_dir и дальше грузится как есть. Тексты сортируются по длине,
+    чтобы в батче было меньше паддинга.
+    tokenizer — tokenizers.Tokenizer; encode(text, add_special_tokens=False)
+    совместим с TokenCounter.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        export_dir: Path = None,
+        quantize: bool = True,
+        threads: int = None,
+        batch_size: int = 32,
+        max_length: int = 512,
+    ):
+        try:
+            import onnxruntime as ort
+            from tokenizers import Tokenizer
+        except ImportError as e:
+            raise _onnx_missing(e) from e
+
+        self.model_name = model_name
+        self.batch_size = batch_size
+        model_dir = Path(export_dir or DEFAULT_EXPORT_DIR) / _slug(model_name)
+        model_path = model_dir / ("model.int8.onnx" if quantize else "model.onnx")
+        if not model_path.exists():
+            export_onnx(model_name, model_dir, quantize)
+
+        # для подсчёта токенов — без обрезки; для батчей — с обрезкой и паддингом
+        self.tokenizer = Tokenizer.from_file(str(model_dir / "tokenizer.json"))
+        self._batch_tokenizer = Tokenizer.from_file(str(model_dir / "tokenizer.json"))
+        self._batch_tokenizer.enable_truncation(max_length)
+        pad_id = self.tokenizer.token_to_id("<pad>")
+        if pad_id is None:
+            pad_id = self.tokenizer.token_to_id("[PAD]") or 0
+        self._batch_tokenizer.enable_padding(pad_id=pad_id)
+
+        opts = ort.SessionOptions()
+        opts.intra_op_num_threads = threads or available_cores()
+        opts.inter_op_num_threads = 1
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(str(model_path), opts, providers=["CPUExecutionProvider"])
+        self._inputs = {i.name for i in self.session.get_inputs()}
+        logger.info(
+            "Loaded ONNX embedder %s (%s, %d threads)",
+            model_name, model_path.name, opts.intra_op_num_threads,
+        )
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        encodings = self._batch_tokenizer.encode_batch(texts)
+        ids = np.array([e.ids for e in encodings], dtype="int64")
+        mask = np.array([e.attention_mask for e in encodings], dtype="int64")
+        feed = {"input_ids": ids, "attention_mask": mask}
+        if "token_type_ids" in self._inputs:
+            feed["token_type_ids"] = np.zeros_like(ids)
+        hidden = self.session.run(None, feed)[0]
+        # mean pooling по маске — как в конфигурации sentence-transformers у e5
+        m = mask[..., None].astype("float32")
+        return (hidden * m).sum(axis=1) / np.maximum(m.sum(axis=1), 1e-9)
+
+    def encode(self, texts: List[str], batch_size: int = None, **kwargs) -> np.ndarray:
+        texts = list(texts)
+        batch_size = batch_size or self.batch_size
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        out = None
+        for s in range(0, len(order), batch_size):
+            idx = order[s:s + batch_size]
+            vecs = self._encode_batch([texts[i] for i in idx])
+            if out is None:
+                out = np.zeros((len(texts), vecs.shape[1]), dtype="float32")
+            out[idx] = vecs
+        return out if out is not None else np.zeros((0, 0), dtype="float32")
+
+
+def export_onnx(model_name: str, model_dir: Path, quantize: bool = True):
+    """HF-модель -> model.onnx (+ model.int8.onnx) и tokenizer.json в model_dir."""
+    try:
+        import torch
+        from transformers import AutoModel, AutoTokenizer
+    except ImportError as e:
+        raise _onnx_missing(e) from e
+
+    model_dir = Path(model_dir)
+    model_dir.mkdir(parents=True, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    tokenizer.save_pretrained(model_dir)
+    model = AutoModel.from_pretrained(model_name).eval()
+
+    class _Hidden(torch.nn.Module):
+        # только last_hidden_state: pooling делаем сами
+        def __init__(self, inner):
+            super().__init__()
+            self.inner = inner
+
+        def forward(self, input_ids, attention_mask):
+            return self.inner(input_ids=input_ids, attention_mask=attention_mask).last_hidden_state
+
+    sample = tokenizer(["пример текста"], return_tensors="pt")
+    fp32_path = model_dir / "model.onnx"
+    axes = {0: "batch", 1: "seq"}
+    with torch.no_grad():
+        torch.onnx.export(
+            _Hidden(model),
+            (sample["input_ids"], sample["attention_mask"]),
+            str(fp32_path),
+            input_names=["input_ids", "attention_mask"],
+            output_names=["last_hidden_state"],
+            dynamic_axes={"input_ids": axes, "attention_mask": axes, "last_hidden_state": axes},
+            opset_version=17,
+        )
+    logger.info("Exported %s to %s", model_name, fp32_path)
+    if quantize:
+        try:
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+        except ImportError as e:
+            raise _onnx_missing(e) from e
+
+        quantize_dynamic(str(fp32_path), str(model_dir / "model.int8.onnx"), weight_type=QuantType.QInt8)
+        logger.info("Quantized %s to int8", model_name)
+
+
+def load_embedder(model_name: str, backend: str = "torch", threads: int = None, export_dir: Path = None):
+    """
+    Эмбеддер с encode(texts) по имени бэкенда. torch (sentence-transformers)
+    и onnxruntime импортируются только здесь — импорт пайплайна их не тянет.
+    threads — потоки для матричных операций (None — доступные процессу ядра).
+    """
+    if backend not in EMBED_BACKENDS:
+        raise ValueError(f"Unknown embed backend: {backend}")
+    threads = threads or available_cores()
+    if backend == "torch":
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        torch.set_num_threads(threads)
+        logger.info("Loading %s with torch (%d threads)", model_name, threads)
+        return SentenceTransformer(model_name)
+    return OnnxEmbedder(model_name, export_dir, quantize=backend == "onnx-int8", threads=threads)
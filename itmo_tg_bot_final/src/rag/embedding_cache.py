@@ -0,0 +1,359 @@
+# src/rag/embedding_cache.py
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+try:
+    import fcntl
+except ImportError:             # Windows
+    fcntl = None
+    import msvcrt
+
+import faiss
+import numpy as np
+
+from src.rag.ann import MmapFlatIndex
+from src.rag.chunk_store import ChunkStore
+from src.rag.lexical import BM25Index, MmapBM25Index
+
+logger = logging.getLogger(__name__)
+
+# опубликованная версия снапшота и сколько последних версий хранить рядом с ней:
+# процессы, открывшие старую версию, дорабатывают на ней (mmap)
+SNAPSHOT_POINTER = "CURRENT"
+SNAPSHOT_KEEP = 2
+# версия формата: снапшот старого формата считается устаревшим и пересобирается
+SNAPSHOT_FORMAT = 2
+
+
+class IndexSnapshot(NamedTuple):
+    index: object
+    chunks: ChunkStore
+    vectors: Optional[np.ndarray] = None            # точные нормированные векторы (mmap)
+    lexical: Optional[MmapBM25Index] = None         # BM25 по тем же чанкам (mmap)
+    facts: Optional[Dict[str, List[list]]] = None   # FactStore.dump()
+    sources: Optional[List[str]] = None             # источники документов корпуса
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def _slug(name: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]+", "__", name)
+
+
+def _atomic_write_bytes(path: Path, data: bytes):
+    # уникальное имя: параллельные писатели не затирают чужой tmp
+    tmp = path.with_name(f"{path.name}.{uuid.uuid4().hex[:8]}.tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+
+@contextmanager
+def _file_lock(path: Path):
+    """Межпроцессная блокировка на файле (flock, на Windows — msvcrt.locking)."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class EmbeddingCache:
+    """
+    Контентно-адресуемый кеш эмбеддингов на диске.
+    Ключ — (модель эмбеддера, sha1 текста чанка). Для каждой модели —
+    сегменты seg.<время>.<id>: .npy с векторами и .json с ключами (пишется
+    последним, сегмент без него не читается). Промах дописывает новый сегмент
+    только с новыми строками, старые файлы не переписываются; параллельные
+    процессы пишут каждый свои сегменты. prune() после сборки выкидывает
+    ключи, которых нет в корпусе, сливая сегменты в один — не на каждой
+    сборке, а когда мёртвых строк или сегментов накопилось достаточно.
+    """
+
+    COMPACT_SEGMENTS = 16      # больше сегментов — сливаем (меньше файлов на старте)
+    COMPACT_STALE = 0.25       # доля строк не из корпуса, при которой сливаем
+
+    def __init__(self, cache_dir: Path, model_name: str):
+        self.dir = Path(cache_dir) / "embeddings" / _slug(model_name)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        # формат до сегментов: одна пара файлов, читается и удаляется при слиянии
+        self._legacy = (self.dir / "keys.json", self.dir / "vectors.npy")
+        self._lock_path = self.dir / ".lock"
+        self._rows: Dict[str, int] = {}
+        self._vectors: Optional[np.ndarray] = None
+        self._segments: List[Path] = []      # прочитанные и записанные этим процессом
+        self._load()
+
+    def _read(self, keys_path: Path, vecs_path: Path) -> Tuple[List[str], Optional[np.ndarray]]:
+        try:
+            keys = json.loads(keys_path.read_text(encoding="utf-8"))
+            vecs = np.load(vecs_path)
+        except (OSError, ValueError) as e:
+            logger.warning("Embedding cache segment %s is unreadable, ignoring: %s", keys_path, e)
+            return [], None
+        if len(keys) != vecs.shape[0]:
+            logger.warning("Embedding cache segment %s is inconsistent, ignoring", keys_path)
+            return [], None
+        return keys, vecs
+
+    def _add(self, keys: List[str], vecs: np.ndarray):
+        if self._vectors is not None and vecs.shape[1] != self._vectors.shape[1]:
+            logger.warning("Embedding cache at %s mixes dimensions, ignoring a segment", self.dir)
+            return
+        fresh = [i for i, k in enumerate(keys) if k not in self._rows]
+        if not fresh:
+            return
+        base = 0 if self._vectors is None else self._vectors.shape[0]
+        for j, i in enumerate(fresh):
+            self._rows[keys[i]] = base + j
+        new = vecs[fresh]
+        self._vectors = new if self._vectors is None else np.vstack([self._vectors, new])
+
+    def _load(self):
+        with _file_lock(self._lock_path):
+            if all(p.exists() for p in self._legacy):
+                keys, vecs = self._read(*self._legacy)
+                if vecs is not None:
+                    self._add(keys, vecs)
+            for keys_path in sorted(self.dir.glob("seg.*.json")):
+                keys, vecs = self._read(keys_path, keys_path.with_suffix(".npy"))
+                if vecs is not None:
+                    self._add(keys, vecs)
+                    self._segments.append(keys_path)
+        if self._rows:
+            logger.info(
+                "Loaded %d cached embeddings from %s (%d segments)",
+                len(self._rows), self.dir, len(self._segments),
+            )
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def _write_segment(self, keys: List[str], vecs: np.ndarray) -> Path:
+        """Вызывать под блокировкой."""
+        name = f"seg.{time.time_ns():016x}.{uuid.uuid4().hex[:8]}"
+        tmp = self.dir / f"{name}.tmp.npy"
+        np.save(tmp, np.ascontiguousarray(vecs, dtype="float32"))
+        os.replace(tmp, self.dir / f"{name}.npy")
+        keys_path = self.dir / f"{name}.json"
+        _atomic_write_bytes(keys_path, json.dumps(keys).encode("utf-8"))
+        self._segments.append(keys_path)
+        return keys_path
+
+    def encode(
+        self, texts: List[str], encode_fn: Callable[[List[str]], np.ndarray]
+    ) -> np.ndarray:
+        """
+        Возвращает эмбеддинги для texts в том же порядке.
+        encode_fn вызывается только для текстов, которых ещё нет в кеше.
+        """
+        hashes = [text_hash(t) for t in texts]
+        missing: Dict[str, str] = {}
+        for h, t in zip(hashes, texts):
+            if h not in self._rows and h not in missing:
+                missing[h] = t
+
+        if missing:
+            new = np.asarray(encode_fn(list(missing.values())), dtype="float32")
+            self._add(list(missing), new)
+            with _file_lock(self._lock_path):
+                self._write_segment(list(missing), new)
+        logger.info(
+            "Embeddings: %d from cache, %d encoded", len(texts) - len(missing), len(missing)
+        )
+
+        if not texts:
+            dim = 0 if self._vectors is None else self._vectors.shape[1]
+            return np.zeros((0, dim), dtype="float32")
+        return self._vectors[[self._rows[h] for h in hashes]].astype("float32", copy=True)
+
+    def prune(self, texts: Iterable[str], force: bool = False) -> int:
+        """
+        Вызывается по окончании сборки с текстами всех чанков корпуса.
+        Если строк не из корпуса не меньше COMPACT_STALE или сегментов больше
+        COMPACT_SEGMENTS (force — всегда), живые строки сливаются в один
+        сегмент, а прочитанные/записанные этим процессом сегменты удаляются;
+        чужие сегменты, появившиеся после _load, не трогаются.
+        Возвращает число выкинутых строк.
+        """
+        live = {text_hash(t) for t in texts}
+        stale = [h for h in self._rows if h not in live]
+        many_stale = bool(stale) and len(stale) >= self.COMPACT_STALE * len(self._rows)
+        if not (force or many_stale or len(self._segments) > self.COMPACT_SEGMENTS):
+            return 0
+        keys = [h for h in self._rows if h in live]
+        vecs = self._vectors[[self._rows[h] for h in keys]] if keys else None
+        with _file_lock(self._lock_path):
+            old, self._segments = self._segments, []
+            if keys:
+                self._write_segment(keys, vecs)
+            for keys_path in old:
+                keys_path.unlink(missing_ok=True)
+                keys_path.with_suffix(".npy").unlink(missing_ok=True)
+            for path in self._legacy:
+                path.unlink(missing_ok=True)
+        self._rows = {h: i for i, h in enumerate(keys)}
+        self._vectors = vecs
+        logger.info("Embedding cache at %s compacted: %d kept, %d dropped", self.dir, len(keys), len(stale))
+        return len(stale)
+
+
+def chunks_fingerprint(model_name: str, chunks: List[Dict]) -> str:
+    """Отпечаток набора чанков: меняется при смене модели, любого текста или метаданных."""
+    h = hashlib.sha1(model_name.encode("utf-8"))
+    for c in chunks:
+        meta = {k: v for k, v in c.items() if k != "page_content"}
+        h.update(b"\0")
+        h.update(json.dumps(meta, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+        h.update(b"\0")
+        h.update(text_hash(c["page_content"]).encode("ascii"))
+    return h.hexdigest()
+
+
+def save_index_snapshot(
+    snapshot_dir: Path,
+    index,
+    chunks: List[Dict],
+    fingerprint: str,
+    vectors: np.ndarray = None,
+    lexical: BM25Index = None,
+    facts: Dict[str, List[list]] = None,
+    sources: Sequence[str] = None,
+) -> str:
+    """
+    Сохраняет FAISS-индекс, чанки (колоночный ChunkStore) и, если даны,
+    точные нормированные векторы (vectors.npy, для пересчёта оценок), BM25
+    (MmapBM25Index), факты (facts.json) и источники документов в новый
+    каталог версии v.<время>.<id> и публикует его атомарной подменой файла
+    CURRENT. Воркеру, открывшему версию, не нужны ни документы, ни чанкинг. Чужие и уже открытые версии не трогаются: читатель видит либо
+    старую, либо новую целиком. Хранятся SNAPSHOT_KEEP последних версий.
+    Возвращает имя версии.
+    """
+    snapshot_dir = Path(snapshot_dir)
+    snapshot_dir.mkdir(parents=True, exist_ok=True)
+    version = f"v.{time.time_ns():016x}.{uuid.uuid4().hex[:8]}"
+    version_dir = snapshot_dir / version
+    version_dir.mkdir()
+    faiss.write_index(index, str(version_dir / "index.faiss"))
+    ChunkStore.write(version_dir / "chunks", chunks)
+    if vectors is not None:
+        with open(version_dir / "vectors.npy", "wb") as f:
+            np.save(f, np.ascontiguousarray(vectors, dtype="float32"))
+    if lexical is not None:
+        MmapBM25Index.write(version_dir / "lexical", lexical)
+    if facts is not None:
+        (version_dir / "facts.json").write_text(json.dumps(facts, ensure_ascii=False), encoding="utf-8")
+    _atomic_write_bytes(
+        version_dir / "meta.json",
+        json.dumps({
+            "format": SNAPSHOT_FORMAT,
+            "fingerprint": fingerprint,
+            "ntotal": int(index.ntotal),
+            "vectors": vectors is not None,
+            # точный flat-индекс при загрузке заменяется поиском по vectors.npy
+            "flat": vectors is not None and isinstance(index, faiss.IndexFlat),
+            "lexical": lexical is not None,
+            "facts": facts is not None,
+            "sources": None if sources is None else list(sources),
+        }, ensure_ascii=False).encode("utf-8"),
+    )
+    with _file_lock(snapshot_dir / ".lock"):
+        _atomic_write_bytes(snapshot_dir / SNAPSHOT_POINTER, version.encode("ascii"))
+        _prune_snapshots(snapshot_dir, version)
+    logger.info("Saved index snapshot %s (%d vectors) to %s", version, index.ntotal, snapshot_dir)
+    return version
+
+
+def _prune_snapshots(snapshot_dir: Path, current: str):
+    # имена версий упорядочены по времени: недописанная чужая версия новее
+    # опубликованных и под удаление не попадает
+    versions = sorted(p.name for p in snapshot_dir.glob("v.*") if p.is_dir())
+    keep = set(versions[-SNAPSHOT_KEEP:]) | {current}
+    for name in versions:
+        if name not in keep:
+            shutil.rmtree(snapshot_dir / name, ignore_errors=True)
+    # снапшот прежнего формата (файлы прямо в snapshot_dir)
+    for old in ("meta.json", "index.faiss", "vectors.npy"):
+        (snapshot_dir / old).unlink(missing_ok=True)
+    for old in snapshot_dir.glob("chunks*"):
+        if old.is_dir():
+            shutil.rmtree(old, ignore_errors=True)
+        else:
+            old.unlink()
+
+
+def load_index_snapshot(
+    snapshot_dir: Path, fingerprint: Optional[str] = None, version: str = None
+) -> Optional[IndexSnapshot]:
+    """
+    Загружает опубликованную (или заданную version) версию снапшота, если
+    она есть и (при заданном fingerprint) совпадает. Индекс, чанки и векторы
+    отображаются в память (mmap) только для чтения; flat-индекс не читается
+    вовсе — поиск идёт по тем же векторам (MmapFlatIndex), и их страницы
+    общие у всех процессов, открывших снапшот. BM25 тоже отображается в память.
+    """
+    snapshot_dir = Path(snapshot_dir)
+    if version is None:
+        try:
+            version = (snapshot_dir / SNAPSHOT_POINTER).read_text(encoding="ascii").strip()
+        except OSError:
+            return None
+    version_dir = snapshot_dir / version
+    try:
+        meta = json.loads((version_dir / "meta.json").read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    if fingerprint is not None and (
+        meta.get("fingerprint") != fingerprint or meta.get("format") != SNAPSHOT_FORMAT
+    ):
+        logger.info("Index snapshot %s at %s is stale", version, snapshot_dir)
+        return None
+
+    try:
+        chunks = ChunkStore(version_dir / "chunks")
+        vectors = np.load(version_dir / "vectors.npy", mmap_mode="r") if meta.get("vectors") else None
+        lexical = MmapBM25Index(version_dir / "lexical") if meta.get("lexical") else None
+        facts = (
+            json.loads((version_dir / "facts.json").read_text(encoding="utf-8"))
+            if meta.get("facts") else None
+        )
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning("Index snapshot %s at %s is unreadable: %s", version, snapshot_dir, e)
+        return None
+    if meta.get("flat") and vectors is not None:
+        index = MmapFlatIndex(vectors)
+    else:
+        path = str(version_dir / "index.faiss")
+        try:
+            index = faiss.read_index(path, faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
+        except (RuntimeError, AttributeError):
+            index = faiss.read_index(path)
+    if (
+        index.ntotal != len(chunks)
+        or (vectors is not None and len(vectors) != len(chunks))
+        or (lexical is not None and lexical.n_docs != len(chunks))
+    ):
+        logger.warning("Index snapshot %s at %s is inconsistent, ignoring", version, snapshot_dir)
+        return None
+    logger.info("Loaded index snapshot %s (%d vectors) from %s", version, index.ntotal, snapshot_dir)
+    return IndexSnapshot(index, chunks, vectors, lexical, facts, meta.get("sources"))
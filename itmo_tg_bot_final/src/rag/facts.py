@@ -0,0 +1,310 @@
+# src/rag/facts.py
+import json
+import logging
+import re
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+from src.rag.chunking import BLOCK_RE, SEMESTER_RE
+
+logger = logging.getLogger(__name__)
+
+HOURS_PER_CREDIT = 36          # 1 з.е. = 36 академических часов — так строка таблицы и узнаётся
+_INT_RE = re.compile(r"^\d{1,4}$")
+# заголовок блока в начале строки, склеенной PyPDF2 с первой строкой таблицы
+_BLOCK_PREFIX_RE = re.compile(
+    r"^(обязательн\w*\s+дисциплин\w*|пул\s+выборн\w*\s+дисциплин\w*|выборн\w*\s+дисциплин\w*"
+    r"|электив\w*|практик\w*)[\s.:]*",
+    re.I,
+)
+
+# ─── НАМЕРЕНИЯ ─────────────────────────────────────────────────────────────────
+# контакты — только целыми словами («почти», «продакт-менеджером» — не о контактах)
+# и только вместе с вопросом, как связаться
+_CONTACT_NOUN_RE = re.compile(
+    r"\b(email|e mail|емейл|имейл|почта|почту|почты|почте|телефон|телефона|телефону|"
+    r"контакт|контакты|контакта|контактов|контактам)\b"
+)
+_CONTACT_ASK_RE = re.compile(r"\b(как|какой|какая|какие|какую|где|куда|кому|дайте|подскажите|скажите|нужен|нужна|нужны)\b")
+_CONTACT_REACH_RE = re.compile(
+    r"\b(связаться|написать|позвонить|дозвониться|обратиться)\s+(с\s+|к\s+)?"
+    r"(менеджер|менеджеру|менеджером|менеджерам|приемной|приемную|координатор\w*)\b"
+)
+# справка о дисциплине — только по словам о з.е., часах, семестре и блоке;
+# общие «когда», «час» («когда начинается приём документов») уводили в поиск дисциплины
+_COURSE_RE = re.compile(
+    r"\b(кредит\w*|зе|з е|зачетн\w* единиц\w*|трудоемк\w*|сколько час\w*|"
+    r"семестр\w*|электив\w*|выборн\w*|обязательн\w*|по выбору)\b"
+)
+_COMPARE_RE = re.compile(r"\b(сравн\w*|отлича\w*|различ\w*|разниц\w*)\b")
+MAX_LOOKUP_WORDS = 20          # длинный вопрос — скорее открытый, его отдаём LLM
+
+
+def normalize(text: str) -> str:
+    text = text.lower().replace("ё", "е")
+    return " ".join(re.sub(r"[^\w]+", " ", text).split())
+
+
+def stems(text: str) -> Set[str]:
+    """Грубая основа слова: первые 5 букв («продуктами» ~ «продукт»)."""
+    return {w[:5] for w in normalize(text).split()}
+
+
+class Course(NamedTuple):
+    name: str
+    program: Optional[str]
+    semesters: Tuple[str, ...]
+    credits: int
+    hours: int
+    block: Optional[str]
+    source: str
+    page: Optional[int]
+
+    @property
+    def elective(self) -> bool:
+        return bool(self.block and re.search(r"выборн|электив", self.block, re.I))
+
+
+def parse_courses(doc: Dict) -> List[Course]:
+    """
+    Строки таблиц учебного плана: «[семестры] Название з.е. часы», где
+    часы = 36 * з.е. PyPDF2 нередко склеивает строки таблицы в одну,
+    поэтому строки ищутся по парам чисел внутри строки текста.
+    Семестр и блок берутся из заголовков выше (как в StructuredChunker).
+    """
+    pages = doc.get("pages") or [doc.get("page_content", "")]
+    semester, block = None, None
+    courses = []
+    for page_no, text in enumerate(pages, start=1):
+        for line in text.split("\n"):
+            line = line.strip()
+            m_sem = SEMESTER_RE.match(line)
+            if m_sem:
+                semester, block = m_sem.group(1) or m_sem.group(2), None
+                line = line[m_sem.end():].strip()
+            tokens = line.split()
+            rows = [
+                i for i in range(1, len(tokens) - 1)
+                if _INT_RE.match(tokens[i]) and _INT_RE.match(tokens[i + 1])
+                and int(tokens[i]) > 0 and int(tokens[i + 1]) == HOURS_PER_CREDIT * int(tokens[i])
+            ]
+            if not rows:
+                m_block = BLOCK_RE.match(line)
+                if m_block:
+                    block = m_block.group(1).strip(" .:")
+                continue
+            start = 0
+            for i in rows:
+                name_tokens = tokens[start:i]
+                start = i + 2
+                sems = []
+                while name_tokens and re.fullmatch(r"\d{1,2},?", name_tokens[0]):
+                    sems.append(name_tokens.pop(0).rstrip(","))
+                name = " ".join(name_tokens).strip(" .:;●-")
+                m_block = _BLOCK_PREFIX_RE.match(name)
+                if m_block:
+                    block = m_block.group(1)
+                    name = name[m_block.end():]
+                if len(name) < 3:
+                    continue
+                courses.append(Course(
+                    name=name,
+                    program=doc.get("program"),
+                    semesters=tuple(sems) or ((semester,) if semester else ()),
+                    credits=int(tokens[i]),
+                    hours=int(tokens[i + 1]),
+                    block=block,
+                    source=doc["source"],
+                    page=page_no if doc.get("pages") else None,
+                ))
+    return courses
+
+
+class FactStore:
+    """
+    Факты учебных планов и контакты программ в памяти:
+      - дисциплины (программа, семестры, з.е., часы, блок) из таблиц PDF;
+      - название/ссылка/email/телефон менеджера программы из programs.json.
+    Поиск дисциплины — по обратному индексу основ слов, без эмбеддингов.
+    Обновление пересобирает индексы и подменяет их одной операцией.
+    """
+
+    def __init__(self):
+        self._by_source: Dict[str, List[Course]] = {}
+        self.programs: Dict[str, Dict] = {}
+        self._courses: List[Course] = []
+        self._course_stems: List[Set[str]] = []
+        self._index: Dict[str, Set[int]] = {}
+        self._aliases: List[Tuple[Set[str], str]] = []
+
+    def __len__(self) -> int:
+        return len(self._courses)
+
+    # ─── наполнение ──────────────────────────────────────────────────────────
+    def load_programs(self, json_path: Path):
+        programs = {}
+        if json_path and Path(json_path).exists():
+            for entry in json.loads(Path(json_path).read_text(encoding="utf-8")):
+                if entry.get("slug"):
+                    programs[entry["slug"]] = entry
+        aliases = []
+        for slug, entry in programs.items():
+            names = [slug.replace("_", " ")] + (entry.get("title") or "").split("/")
+            for name in names:
+                words = normalize(name).split()
+                if not words:
+                    continue
+                aliases.append((stems(name), slug))
+                if len(words) > 1:
+                    aliases.append(({"".join(w[0] for w in words)}, slug))   # «ИИ»
+        self.programs, self._aliases = programs, aliases
+
+    def update(self, docs: List[Dict], remove_sources=()):
+        by_source = {s: c for s, c in self._by_source.items() if s not in set(remove_sources)}
+        for doc in docs:
+            by_source[doc["source"]] = parse_courses(doc)
+        self._set(by_source)
+
+    def dump(self) -> Dict[str, List[list]]:
+        """Дисциплины по источникам в JSON-виде (для снапшота индекса)."""
+        return {src: [list(c) for c in courses] for src, courses in self._by_source.items()}
+
+    def restore(self, data: Dict[str, List[list]]):
+        """Обратное dump(): дисциплины без повторного разбора документов."""
+        self._set({
+            src: [Course(*row[:2], tuple(row[2]), *row[3:]) for row in rows]
+            for src, rows in data.items()
+        })
+
+    def _set(self, by_source: Dict[str, List[Course]]):
+        courses = [c for src in sorted(by_source) for c in by_source[src]]
+        course_stems = [stems(c.name) for c in courses]
+        index: Dict[str, Set[int]] = {}
+        for i, st in enumerate(course_stems):
+            for s in st:
+                index.setdefault(s, set()).add(i)
+        self._by_source = by_source
+        self._courses, self._course_stems, self._index = courses, course_stems, index
+        logger.info("Fact store: %d courses from %d sources", len(courses), sum(map(bool, by_source.values())))
+
+    # ─── поиск ───────────────────────────────────────────────────────────────
+    def find_programs(self, text: str) -> List[str]:
+        """Программы, названные в тексте; «AI Product» не засчитывается ещё и как «AI»."""
+        q = stems(text)
+        hits = [(st, slug) for st, slug in self._aliases if st <= q]
+        found = []
+        for st, slug in hits:
+            if any(st < other and slug != other_slug for other, other_slug in hits):
+                continue
+            if slug not in found:
+                found.append(slug)
+        return found
+
+    def find_courses(self, text: str, min_overlap: float = 0.75) -> List[Course]:
+        """Дисциплины, почти все слова названия которых есть в тексте (лучшие по доле совпадения)."""
+        q = stems(text)
+        candidates = set().union(*(self._index.get(s, set()) for s in q)) if q else set()
+        scored = []
+        for i in candidates:
+            st = self._course_stems[i]
+            overlap = len(st & q) / len(st)
+            if overlap >= min_overlap:
+                scored.append((overlap, len(st), i))
+        if not scored:
+            return []
+        best = max((o, n) for o, n, _ in scored)
+        return [self._courses[i] for o, n, i in sorted(scored, key=lambda x: x[2]) if (o, n) == best]
+
+    def courses_of(self, program: str) -> List[Course]:
+        return [c for c in self._courses if c.program == program]
+
+    def title(self, program: Optional[str]) -> str:
+        return (self.programs.get(program) or {}).get("title") or program or "?"
+
+
+def _cite(c: Course) -> str:
+    return f"{c.source}, стр. {c.page}" if c.page else c.source
+
+
+class IntentMatcher:
+    """
+    Быстрые ответы без LLM на вопросы-справки: контакты менеджера программы,
+    з.е./семестр/блок дисциплины, сравнение программ по учебным планам.
+    match() возвращает {"answer", "sources"} или None — тогда вопрос идёт в RAG.
+    """
+
+    def __init__(self, store: FactStore):
+        self.store = store
+
+    def match(self, question: str) -> Optional[Dict]:
+        q = normalize(question)
+        if not q or len(q.split()) > MAX_LOOKUP_WORDS:
+            return None
+        if _CONTACT_REACH_RE.search(q) or (
+            _CONTACT_NOUN_RE.search(q) and (_CONTACT_ASK_RE.search(q) or "?" in question)
+        ):
+            return self._contacts(question)
+        if _COMPARE_RE.search(q):
+            return self._compare(question)
+        if _COURSE_RE.search(q):
+            return self._course(question)
+        return None
+
+    def _contacts(self, question: str) -> Optional[Dict]:
+        store = self.store
+        # без названной программы список всех (после обхода каталога — десятки) не выдаём
+        slugs = store.find_programs(question) or (list(store.programs) if len(store.programs) == 1 else [])
+        lines, sources = [], []
+        for slug in slugs:
+            entry = store.programs[slug]
+            contacts = ", ".join(x for x in (entry.get("manager_email"), entry.get("manager_phone")) if x)
+            if contacts:
+                lines.append(f"**{store.title(slug)}** — контакты менеджера: {contacts}")
+                sources.append(entry.get("url") or slug)
+        if not lines:
+            return None
+        return {"answer": "\n".join(lines), "sources": sources}
+
+    def _course(self, question: str) -> Optional[Dict]:
+        courses = self.store.find_courses(question)
+        programs = self.store.find_programs(question)
+        if programs:
+            courses = [c for c in courses if c.program in programs] or courses
+        if not courses:
+            return None
+        lines = []
+        for c in courses:
+            parts = [f"{c.credits} з.е. ({c.hours} ч)"]
+            if c.semesters:
+                parts.append(f"семестр {', '.join(c.semesters)}")
+            if c.block:
+                parts.append(("по выбору: " if c.elective else "") + c.block)
+            lines.append(f"**{c.name}** ({self.store.title(c.program)}): " + "; ".join(parts))
+        return {"answer": "\n".join(lines), "sources": [_cite(c) for c in courses]}
+
+    def _compare(self, question: str) -> Optional[Dict]:
+        store = self.store
+        slugs = store.find_programs(question)
+        if len(slugs) < 2:
+            return None
+        plans = {s: store.courses_of(s) for s in slugs}
+        if len(plans) < 2 or not all(plans.values()):
+            return None
+        lines = ["Сравнение по учебным планам:"]
+        for slug, courses in plans.items():
+            electives = sum(c.elective for c in courses)
+            lines.append(
+                f"• **{store.title(slug)}**: дисциплин — {len(courses)}, "
+                f"всего {sum(c.credits for c in courses)} з.е., по выбору — {electives}"
+            )
+        names = {slug: {normalize(c.name) for c in courses} for slug, courses in plans.items()}
+        common = set.intersection(*names.values())
+        if common:
+            shown = sorted(c.name for c in plans[slugs[0]] if normalize(c.name) in common)[:10]
+            lines.append("Общие дисциплины: " + ", ".join(shown))
+        for slug, courses in plans.items():
+            only = [c.name for c in courses if normalize(c.name) not in common][:10]
+            if only:
+                lines.append(f"Только в «{store.title(slug)}»: " + ", ".join(only))
+        sources = sorted({c.source for courses in plans.values() for c in courses})
+        return {"answer": "\n".join(lines), "sources": sources}
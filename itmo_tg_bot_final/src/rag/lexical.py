@@ -0,0 +1,253 @@
+# src/rag/lexical.py
+import json
+import math
+import os
+import re
+from collections import Counter
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+# ─── Русский стеммер (Snowball/Porter) ───────────────────────────────────────────
+_VOWELS = "аеиоуыэюя"
+
+_PERFECTIVE_GERUND_1 = ("вшись", "вши", "в")                      # после а/я
+_PERFECTIVE_GERUND_2 = ("ившись", "ывшись", "ивши", "ывши", "ив", "ыв")
+_REFLEXIVE = ("ся", "сь")
+_ADJECTIVE = (
+    "ими", "ыми", "его", "ого", "ему", "ому", "ее", "ие", "ые", "ое", "ей", "ий",
+    "ый", "ой", "ем", "им", "ым", "ом", "их", "ых", "ую", "юю", "ая", "яя", "ою", "ею",
+)
+_PARTICIPLE_1 = ("ем", "нн", "вш", "ющ", "щ")                     # после а/я
+_PARTICIPLE_2 = ("ивш", "ывш", "ующ")
+_VERB_1 = (                                                        # после а/я
+    "ете", "йте", "ешь", "нно", "ла", "на", "ли", "ем", "ло", "но", "ет", "ют",
+    "ны", "ть", "й", "л", "н",
+)
+_VERB_2 = (
+    "ейте", "уйте", "ила", "ыла", "ена", "ите", "или", "ыли", "ило", "ыло", "ено",
+    "ует", "уют", "ены", "ить", "ыть", "ишь", "ей", "уй", "ил", "ыл", "им", "ым",
+    "ен", "ят", "ит", "ыт", "ую", "ю",
+)
+_NOUN = (
+    "иями", "ями", "ами", "ией", "иям", "ием", "иях", "ев", "ов", "ие", "ье", "еи",
+    "ии", "ей", "ой", "ий", "ям", "ем", "ам", "ом", "ах", "ях", "ию", "ью", "ия",
+    "ья", "а", "е", "и", "й", "о", "у", "ы", "ь", "ю", "я",
+)
+_SUPERLATIVE = ("ейше", "ейш")
+_DERIVATIONAL = ("ость", "ост")
+
+
+def _by_length(endings):
+    return tuple(sorted(endings, key=len, reverse=True))
+
+
+_PERFECTIVE_GERUND_1, _PERFECTIVE_GERUND_2 = _by_length(_PERFECTIVE_GERUND_1), _by_length(_PERFECTIVE_GERUND_2)
+_ADJECTIVE, _NOUN = _by_length(_ADJECTIVE), _by_length(_NOUN)
+_PARTICIPLE_1, _PARTICIPLE_2 = _by_length(_PARTICIPLE_1), _by_length(_PARTICIPLE_2)
+_VERB_1, _VERB_2 = _by_length(_VERB_1), _by_length(_VERB_2)
+
+
+def _regions(word: str) -> Tuple[int, int]:
+    """Начала областей RV и R2 (см. описание алгоритма Snowball)."""
+    rv = len(word)
+    for i, ch in enumerate(word):
+        if ch in _VOWELS:
+            rv = i + 1
+            break
+
+    def next_region(start):
+        for i in range(start + 1, len(word)):
+            if word[i] not in _VOWELS and word[i - 1] in _VOWELS:
+                return i + 1
+        return len(word)
+
+    r1 = next_region(0)
+    return rv, next_region(r1)
+
+
+def _strip(word: str, rv: int, endings, after_a: bool = False) -> Tuple[str, bool]:
+    for e in endings:
+        if word.endswith(e) and len(word) - len(e) >= rv:
+            if after_a:
+                pos = len(word) - len(e)
+                if pos - 1 < rv or word[pos - 1] not in "ая":
+                    continue
+            return word[: len(word) - len(e)], True
+    return word, False
+
+
+@lru_cache(maxsize=200_000)
+def stem_ru(word: str) -> str:
+    if not re.fullmatch(r"[а-я]+", word) or len(word) <= 2:
+        return word
+    rv, r2 = _regions(word)
+
+    # Шаг 1
+    w, found = _strip(word, rv, _PERFECTIVE_GERUND_1, after_a=True)
+    if not found:
+        w, found = _strip(word, rv, _PERFECTIVE_GERUND_2)
+    if not found:
+        w, _ = _strip(w, rv, _REFLEXIVE)
+        w2, found = _strip(w, rv, _ADJECTIVE)
+        if found:
+            w3, f = _strip(w2, rv, _PARTICIPLE_1, after_a=True)
+            if not f:
+                w3, f = _strip(w2, rv, _PARTICIPLE_2)
+            w = w3
+        else:
+            w2, found = _strip(w, rv, _VERB_1, after_a=True)
+            if not found:
+                w2, found = _strip(w, rv, _VERB_2)
+            if not found:
+                w2, found = _strip(w, rv, _NOUN)
+            w = w2
+
+    # Шаг 2
+    if w.endswith("и") and len(w) - 1 >= rv:
+        w = w[:-1]
+    # Шаг 3
+    w, _ = _strip(w, max(rv, r2), _DERIVATIONAL)
+    # Шаг 4
+    if w.endswith("нн") and len(w) - 1 >= rv:
+        w = w[:-1]
+    else:
+        w2, found = _strip(w, rv, _SUPERLATIVE)
+        if found:
+            w = w2[:-1] if w2.endswith("нн") else w2
+        elif w.endswith("ь") and len(w) - 1 >= rv:
+            w = w[:-1]
+    return w
+
+
+_TOKEN_RE = re.compile(r"[0-9a-zа-я]+(?:[.\-][0-9a-zа-я]+)*")
+
+
+def tokenize_ru(text: str) -> List[str]:
+    """
+    Токенизация под русские учебные планы: нижний регистр, ё→е, коды вида
+    02.04.03 остаются одним токеном, слова через дефис дают и целое слово, и части;
+    русские слова стеммятся.
+    """
+    text = text.lower().replace("ё", "е")
+    out = []
+    for t in _TOKEN_RE.findall(text):
+        out.append(stem_ru(t))
+        if "-" in t:
+            out.extend(stem_ru(part) for part in t.split("-"))
+    return out
+
+
+# ─── BM25 ───────────────────────────────────────────────────────────────────────
+class BM25Index:
+    """Okapi BM25 поверх списка текстов (индексы совпадают с позициями в списке)."""
+
+    def __init__(self, texts: Sequence[str], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, List[Tuple[int, int]]] = {}
+        self.doc_len: List[int] = []
+        for doc_id, text in enumerate(texts):
+            tf = Counter(tokenize_ru(text))
+            self.doc_len.append(sum(tf.values()))
+            for term, n in tf.items():
+                self.postings.setdefault(term, []).append((doc_id, n))
+        self.n_docs = len(self.doc_len)
+        self.avg_len = (sum(self.doc_len) / self.n_docs) if self.n_docs else 0.0
+        self.idf = {
+            term: math.log(1 + (self.n_docs - len(p) + 0.5) / (len(p) + 0.5))
+            for term, p in self.postings.items()
+        }
+
+    def search(self, query: str, k: int) -> List[Tuple[float, int]]:
+        scores: Dict[int, float] = {}
+        for term in set(tokenize_ru(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for doc_id, tf in self.postings[term]:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_len[doc_id] / (self.avg_len or 1.0))
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        top = sorted(scores.items(), key=lambda x: -x[1])[:k]
+        return [(s, i) for i, s in top]
+
+
+class MmapBM25Index:
+    """
+    BM25Index, сохранённый на диск и отображаемый в память (mmap), как ChunkStore:
+      terms.npy               — словарь, отсортированный (поиск терма — бинарный);
+      offsets.npy (T+1)       — границы постингов терма в doc_ids/tfs;
+      doc_ids.npy, tfs.npy    — постинги подряд; idf.npy, doc_len.npy;
+      bm25.json               — k1, b, средняя длина (пишется последним).
+    В куче процесса почти ничего нет: страницы общие у всех процессов,
+    открывших снапшот. Оценки те же, что у BM25Index.
+    """
+
+    def __init__(self, store_dir: Path):
+        store_dir = Path(store_dir)
+        meta = json.loads((store_dir / "bm25.json").read_text(encoding="utf-8"))
+        self.k1, self.b, self.avg_len = meta["k1"], meta["b"], meta["avg_len"]
+        self.terms = np.load(store_dir / "terms.npy", mmap_mode="r")
+        self.offsets = np.load(store_dir / "offsets.npy", mmap_mode="r")
+        self.doc_ids = np.load(store_dir / "doc_ids.npy", mmap_mode="r")
+        self.tfs = np.load(store_dir / "tfs.npy", mmap_mode="r")
+        self.idf = np.load(store_dir / "idf.npy", mmap_mode="r")
+        self.doc_len = np.load(store_dir / "doc_len.npy", mmap_mode="r")
+        self.n_docs = len(self.doc_len)
+
+    @staticmethod
+    def write(store_dir: Path, index: BM25Index) -> "MmapBM25Index":
+        store_dir = Path(store_dir)
+        store_dir.mkdir(parents=True, exist_ok=True)
+        terms = sorted(index.postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        for j, term in enumerate(terms):
+            offsets[j + 1] = offsets[j] + len(index.postings[term])
+        postings = np.array(
+            [p for term in terms for p in index.postings[term]], dtype=np.int32
+        ).reshape(-1, 2)
+        width = max((len(t) for t in terms), default=1)
+        np.save(store_dir / "terms.npy", np.array(terms, dtype=f"<U{width}"))
+        np.save(store_dir / "offsets.npy", offsets)
+        np.save(store_dir / "doc_ids.npy", np.ascontiguousarray(postings[:, 0]))
+        np.save(store_dir / "tfs.npy", np.ascontiguousarray(postings[:, 1]))
+        np.save(store_dir / "idf.npy", np.array([index.idf[t] for t in terms], dtype=np.float64))
+        np.save(store_dir / "doc_len.npy", np.array(index.doc_len, dtype=np.int32))
+        tmp = store_dir / "bm25.json.tmp"
+        tmp.write_text(json.dumps({"k1": index.k1, "b": index.b, "avg_len": index.avg_len}), encoding="utf-8")
+        os.replace(tmp, store_dir / "bm25.json")
+        return MmapBM25Index(store_dir)
+
+    def _term(self, term: str) -> int:
+        j = int(np.searchsorted(self.terms, term))
+        return j if j < len(self.terms) and self.terms[j] == term else -1
+
+    def search(self, query: str, k: int) -> List[Tuple[float, int]]:
+        ids, scores = [], []
+        for term in set(tokenize_ru(query)):
+            j = self._term(term)
+            if j < 0:
+                continue
+            lo, hi = int(self.offsets[j]), int(self.offsets[j + 1])
+            docs = np.asarray(self.doc_ids[lo:hi])
+            tf = np.asarray(self.tfs[lo:hi], dtype=np.float64)
+            norm = self.k1 * (1 - self.b + self.b * self.doc_len[docs] / (self.avg_len or 1.0))
+            ids.append(docs)
+            scores.append(self.idf[j] * tf * (self.k1 + 1) / (tf + norm))
+        if not ids:
+            return []
+        docs, inverse = np.unique(np.concatenate(ids), return_inverse=True)
+        totals = np.bincount(inverse, weights=np.concatenate(scores))
+        top = np.argsort(-totals, kind="stable")[:k]
+        return [(float(totals[t]), int(docs[t])) for t in top]
+
+
+def rrf_fuse(rankings: List[List[int]], weights: List[float], k: int = 60) -> List[Tuple[float, int]]:
+    """Reciprocal rank fusion: score(d) = Σ w_i / (k + rank_i(d)), rank с 1."""
+    fused: Dict[int, float] = {}
+    for ranking, w in zip(rankings, weights):
+        for rank, doc_id in enumerate(ranking, start=1):
+            fused[doc_id] = fused.get(doc_id, 0.0) + w / (k + rank)
+    return sorted(((s, i) for i, s in fused.items()), key=lambda x: -x[0])
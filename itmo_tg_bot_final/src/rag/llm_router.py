@@ -0,0 +1,454 @@
+# src/rag/llm_router.py
+import asyncio
+import collections
+import logging
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+import httpx
+import openai
+from openai import AsyncOpenAI, OpenAI
+
+from src.rag.metrics import Metrics, Trace
+
+logger = logging.getLogger(__name__)
+
+LATENCY_WINDOW = 200           # последних длительностей на эндпоинт для квантиля
+HEDGE_MIN_SAMPLES = 20         # пока их меньше — p95 не оценить, дубль не шлём
+
+
+class NoHealthyEndpoint(RuntimeError):
+    pass
+
+
+def retryable(e: BaseException) -> bool:
+    """Сбой эндпоинта (сеть, таймаут, 5xx, 429) — есть смысл идти в другой. 4xx — ошибка запроса."""
+    if isinstance(e, (openai.APIConnectionError, openai.APITimeoutError, httpx.TransportError)):
+        return True
+    if isinstance(e, openai.APIStatusError):
+        return e.status_code >= 500 or e.status_code in (408, 429)
+    return False
+
+
+def quantile(values, q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Endpoint:
+    """
+    OpenAI-совместимый сервер (реплика vLLM или внешняя модель) и его состояние:
+    запросы в работе, EWMA и окно длительностей, circuit breaker.
+    tier — очередь использования: 0 — основные, 1 — запасные (только при
+    отказе всех основных, и дубли в них не шлются).
+    model — имя модели на этом сервере (None — как в запросе);
+    vllm_params=False — не отправлять extra_body с параметрами vLLM.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        api_key: str = "",
+        name: str = None,
+        model: str = None,
+        tier: int = 0,
+        vllm_params: bool = True,
+    ):
+        self.base_url = base_url
+        self.api_key = api_key or "EMPTY"
+        self.name = name or base_url
+        self.model = model
+        self.tier = tier
+        self.vllm_params = vllm_params
+        self.outstanding = 0
+        self.ewma: Optional[float] = None
+        self.latency = collections.deque(maxlen=LATENCY_WINDOW)
+        self.ttft = collections.deque(maxlen=LATENCY_WINDOW)
+        self.failures = 0
+        self.open_until: Optional[float] = None
+        self.probing: Optional[object] = None    # метка идущего пробного запроса
+        self._lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return f"Endpoint({self.name!r}, tier={self.tier})"
+
+    def load(self) -> float:
+        """Ожидаемое время до ответа: (в работе + 1) * типичная длительность."""
+        return (self.outstanding + 1) * (self.ewma or 0.0)
+
+    def available(self, now: float) -> bool:
+        if self.open_until is None:
+            return True
+        # half-open: после паузы пропускаем один пробный запрос
+        return now >= self.open_until and self.probing is None
+
+    def acquire(self) -> Optional[object]:
+        """Занимает эндпоинт; в half-open возвращает метку пробного запроса."""
+        with self._lock:
+            self.outstanding += 1
+            if self.open_until is not None:
+                self.probing = object()
+                return self.probing
+            return None
+
+    def release(self, probe: Optional[object] = None):
+        """
+        probe — метка из acquire(). Проба, кончившаяся без вердикта (отменена
+        как проигравший дубль, 4xx), снимается — иначе эндпоинт не вернётся никогда.
+        """
+        with self._lock:
+            self.outstanding -= 1
+            if probe is not None and self.probing is probe:
+                self.probing = None
+
+    def success(self, seconds: float, kind: str, alpha: float = 0.2):
+        with self._lock:
+            (self.ttft if kind == "stream" else self.latency).append(seconds)
+            if kind != "stream":
+                self.ewma = seconds if self.ewma is None else (1 - alpha) * self.ewma + alpha * seconds
+            self.failures, self.open_until, self.probing = 0, None, None
+
+    def failure(self, now: float, threshold: int, cooldown: float) -> bool:
+        """True — цепь только что разомкнулась."""
+        with self._lock:
+            self.failures += 1
+            if self.probing is not None or self.failures >= threshold:
+                opened = self.open_until is None or self.probing is not None
+                self.open_until, self.probing = now + cooldown, None
+                return opened
+            return False
+
+    def adapt(self, kwargs: Dict) -> Dict:
+        kwargs = dict(kwargs)
+        if self.model:
+            kwargs["model"] = self.model
+        if not self.vllm_params:
+            kwargs.pop("extra_body", None)
+        return kwargs
+
+
+class RoutedStream:
+    """
+    Поток чанков, привязанный к эндпоинту. Владеет его слотом: aclose()
+    освобождает эндпоинт и закрывает HTTP-поток ровно один раз — и когда
+    поток дочитан, и когда его бросили, не начав читать (отмена между
+    create() и первым __anext__). Недозакрытый поток освобождает слот в __del__.
+    """
+
+    def __init__(self, ep: Endpoint, stream, chunks, first, on_error: Callable):
+        self.ep = ep
+        self._stream = stream
+        self._chunks = chunks
+        self._first = first
+        self._on_error = on_error
+        self._closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._closed:
+            raise StopAsyncIteration
+        if self._first is not None:
+            first, self._first = self._first, None
+            return first
+        try:
+            return await self._chunks.__anext__()
+        except StopAsyncIteration:
+            await self.aclose()
+            raise
+        except Exception as e:
+            if retryable(e):
+                self._on_error(self.ep, e)
+            await self.aclose()
+            raise
+
+    def _release(self) -> bool:
+        if self._closed:
+            return False
+        self._closed = True
+        self.ep.release()
+        return True
+
+    async def aclose(self):
+        if self._release():
+            await close_stream(self._stream)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+    def __del__(self):
+        self._release()
+
+
+class LLMRouter:
+    """
+    Генерация через несколько OpenAI-совместимых эндпоинтов:
+      - запрос идёт в доступный эндпоинт с наименьшей нагрузкой
+        (запросы в работе × EWMA длительности), основные раньше запасных;
+      - если ответа (для stream — первого токена) нет дольше hedge_quantile
+        длительностей этого эндпоинта (или фиксированного hedge_delay),
+        тот же запрос дублируется в следующий эндпоинт; побеждает первый,
+        проигравший отменяется;
+      - сбой (сеть, таймаут, 5xx, 429) — повтор в другом эндпоинте;
+        failure_threshold сбоев подряд размыкают цепь на cooldown секунд,
+        потом один пробный запрос решает, вернуть ли эндпоинт.
+    Клиенты без ретраев SDK: повторы — забота роутера.
+    Дубль занимает слот в slots (семафор генераций вызывающего) и
+    отправляется, только если слот свободен: лимит генераций не превышается.
+    """
+
+    def __init__(
+        self,
+        endpoints: List[Endpoint],
+        hedge_quantile: Optional[float] = 0.95,
+        hedge_delay: Optional[float] = None,
+        failure_threshold: int = 3,
+        cooldown: float = 10.0,
+        request_timeout: float = 120.0,
+        max_connections: int = 32,
+        metrics: Metrics = None,
+    ):
+        if not endpoints:
+            raise ValueError("LLMRouter needs at least one endpoint")
+        self.endpoints = list(endpoints)
+        self.hedge_quantile = hedge_quantile
+        self.hedge_delay = hedge_delay
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.request_timeout = request_timeout
+        self.max_connections = max_connections
+        self.metrics = metrics or Metrics()
+        self._sync_clients = {}
+        self._async_loop = None
+        self._async_clients = {}
+
+    # ─── выбор эндпоинта ─────────────────────────────────────────────────────
+    def pick(self, exclude=(), max_tier: int = None) -> Optional[Endpoint]:
+        now = time.monotonic()
+        candidates = [
+            (ep.tier, ep.load(), ep.outstanding, i, ep) for i, ep in enumerate(self.endpoints)
+            if ep not in exclude and ep.available(now) and (max_tier is None or ep.tier <= max_tier)
+        ]
+        return min(candidates)[-1] if candidates else None
+
+    def hedge_after(self, ep: Endpoint, kind: str) -> Optional[float]:
+        if self.hedge_delay is not None:
+            return self.hedge_delay
+        samples = ep.ttft if kind == "stream" else ep.latency
+        if self.hedge_quantile is None or len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        return quantile(samples, self.hedge_quantile)
+
+    def _failed(self, ep: Endpoint, e: BaseException):
+        self.metrics.inc("llm_requests_total", endpoint=ep.name, outcome="error")
+        if ep.failure(time.monotonic(), self.failure_threshold, self.cooldown):
+            self.metrics.inc("llm_circuit_open_total", endpoint=ep.name)
+            logger.warning("LLM endpoint %s is down, circuit open for %.0fs: %s", ep.name, self.cooldown, e)
+
+    def _succeeded(self, ep: Endpoint, seconds: float, kind: str):
+        ep.success(seconds, kind)
+        self.metrics.inc("llm_requests_total", endpoint=ep.name, outcome="ok")
+        self.metrics.observe("llm_endpoint_seconds", seconds, endpoint=ep.name, kind=kind)
+
+    # ─── клиенты ─────────────────────────────────────────────────────────────
+    def _async_client(self, ep: Endpoint) -> AsyncOpenAI:
+        loop = asyncio.get_running_loop()
+        if self._async_loop is not loop:
+            self._async_clients, self._async_loop = {}, loop
+        if ep.name not in self._async_clients:
+            limits = httpx.Limits(max_connections=self.max_connections,
+                                  max_keepalive_connections=self.max_connections)
+            self._async_clients[ep.name] = AsyncOpenAI(
+                api_key=ep.api_key, base_url=ep.base_url, max_retries=0,
+                http_client=httpx.AsyncClient(limits=limits, timeout=self.request_timeout),
+            )
+        return self._async_clients[ep.name]
+
+    def _sync_client(self, ep: Endpoint) -> OpenAI:
+        if ep.name not in self._sync_clients:
+            self._sync_clients[ep.name] = OpenAI(
+                api_key=ep.api_key, base_url=ep.base_url, max_retries=0, timeout=self.request_timeout,
+            )
+        return self._sync_clients[ep.name]
+
+    # ─── попытки ─────────────────────────────────────────────────────────────
+    def _launch(self, ep: Endpoint, call: Callable, kind: str) -> asyncio.Task:
+        """
+        Попытка в ep. Эндпоинт занимается сразу, до старта задачи, чтобы
+        следующий pick() уже видел нагрузку; для stream он остаётся занятым
+        до конца потока (освобождает RoutedStream или _discard).
+        """
+        probe = ep.acquire()
+
+        async def attempt():
+            t0 = time.perf_counter()
+            try:
+                result = await call(ep)
+            except Exception as e:
+                if retryable(e):
+                    self._failed(ep, e)
+                raise
+            self._succeeded(ep, time.perf_counter() - t0, kind)
+            return result
+
+        def done(task: asyncio.Task):
+            if task.cancelled():
+                self.metrics.inc("llm_requests_total", endpoint=ep.name, outcome="cancelled")
+            if task.cancelled() or task.exception() is not None or kind != "stream":
+                ep.release(probe)
+
+        task = asyncio.create_task(attempt())
+        task.add_done_callback(done)
+        return task
+
+    async def _race(self, call: Callable, kind: str, trace: Trace = None, slots: asyncio.Semaphore = None):
+        """
+        Первый успешный результат среди попыток: основная, дубль после
+        hedge-задержки, повторы после сбоев. Слот дубля из slots возвращается,
+        когда гонка решена: дальше жива одна попытка, и её покрывает слот вызывающего.
+        """
+        tasks: Dict[asyncio.Task, Endpoint] = {}
+        tried: List[Endpoint] = []
+        hedged = False
+        hedge_slot = False
+        last_error = None
+        try:
+            while True:
+                if not tasks:
+                    ep = self.pick(exclude=tried)
+                    if ep is None:
+                        raise last_error or NoHealthyEndpoint("No available LLM endpoints")
+                    tried.append(ep)
+                    tasks[self._launch(ep, call, kind)] = ep
+                primary = next(iter(tasks.values()))
+                delay = None if hedged or len(tasks) > 1 else self.hedge_after(primary, kind)
+                done, _ = await asyncio.wait(tasks, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedged = True
+                    ep = self.pick(exclude=tried, max_tier=primary.tier)
+                    if ep is not None and slots is not None:
+                        if slots.locked():
+                            logger.debug("No free generation slot, not hedging to %s", ep.name)
+                            ep = None
+                        else:
+                            await slots.acquire()
+                            hedge_slot = True
+                    if ep is not None:
+                        logger.info("Hedging LLM request from %s to %s after %.2fs", primary.name, ep.name, delay)
+                        self.metrics.inc("llm_hedges_total", endpoint=ep.name)
+                        tried.append(ep)
+                        tasks[self._launch(ep, call, kind)] = ep
+                    continue
+                winner = None
+                for task in done:
+                    ep = tasks.pop(task)
+                    if task.exception() is None and winner is None:
+                        winner = task.result(), ep
+                    elif task.exception() is None:
+                        await self._discard(task.result(), ep, kind)
+                    elif retryable(task.exception()):
+                        last_error = task.exception()
+                    else:
+                        raise task.exception()
+                if winner is not None:
+                    if trace is not None:
+                        trace.set(llm_endpoint=winner[1].name, llm_attempts=len(tried), llm_hedged=hedged)
+                    return winner
+        finally:
+            for task, ep in tasks.items():
+                if task.done() and not task.cancelled() and task.exception() is None:
+                    await self._discard(task.result(), ep, kind)
+                else:
+                    task.cancel()
+            if hedge_slot:
+                slots.release()
+
+    async def _discard(self, result, ep: Endpoint, kind: str):
+        # дубль тоже успел — закрываем его поток и освобождаем эндпоинт
+        if kind == "stream":
+            await close_stream(result[0])
+            ep.release()
+
+    # ─── API ─────────────────────────────────────────────────────────────────
+    async def create(self, trace: Trace = None, slots: asyncio.Semaphore = None, **kwargs):
+        """
+        Аналог AsyncOpenAI.chat.completions.create. С stream=True возвращает
+        RoutedStream; дубль и повтор возможны только до первого чанка, потом
+        поток привязан к эндпоинту. Вызывающий обязан закрыть поток (aclose),
+        даже если не читал его. slots — семафор генераций для дублей.
+        """
+        if not kwargs.get("stream"):
+            async def call(ep):
+                return await self._async_client(ep).chat.completions.create(**ep.adapt(kwargs))
+
+            resp, _ = await self._race(call, "complete", trace, slots)
+            return resp
+
+        async def open_stream(ep):
+            stream = await self._async_client(ep).chat.completions.create(**ep.adapt(kwargs))
+            chunks = stream.__aiter__()
+            try:
+                first = await chunks.__anext__()
+            except StopAsyncIteration:
+                first = None
+            except BaseException:
+                await close_stream(stream)
+                raise
+            return stream, chunks, first
+
+        (stream, chunks, first), ep = await self._race(open_stream, "stream", trace, slots)
+        return RoutedStream(ep, stream, chunks, first, self._failed)
+
+    def create_sync(self, trace: Trace = None, **kwargs):
+        """Синхронный вариант без дублей: выбор по нагрузке и повтор в другом эндпоинте при сбое."""
+        tried: List[Endpoint] = []
+        last_error = None
+        while True:
+            ep = self.pick(exclude=tried)
+            if ep is None:
+                raise last_error or NoHealthyEndpoint("No available LLM endpoints")
+            tried.append(ep)
+            probe = ep.acquire()
+            t0 = time.perf_counter()
+            try:
+                resp = self._sync_client(ep).chat.completions.create(**ep.adapt(kwargs))
+            except Exception as e:
+                if not retryable(e):
+                    raise
+                self._failed(ep, e)
+                last_error = e
+                continue
+            finally:
+                ep.release(probe)
+            self._succeeded(ep, time.perf_counter() - t0, "complete")
+            if trace is not None:
+                trace.set(llm_endpoint=ep.name, llm_attempts=len(tried), llm_hedged=False)
+            return resp
+
+    def stats(self) -> List[Dict]:
+        now = time.monotonic()
+        return [
+            {
+                "name": ep.name,
+                "tier": ep.tier,
+                "outstanding": ep.outstanding,
+                "ewma": ep.ewma,
+                "p95": quantile(ep.latency, 0.95),
+                "available": ep.available(now),
+            }
+            for ep in self.endpoints
+        ]
+
+
+async def close_stream(stream):
+    """Закрывает поток чанков: RoutedStream и AsyncStream новых SDK — aclose(), старых — close()."""
+    close = getattr(stream, "aclose", None) or getattr(stream, "close", None)
+    if close is not None:
+        await close()
@@ -0,0 +1,230 @@
+# src/rag/metrics.py
+import bisect
+import json
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+slow_logger = logging.getLogger("rag.slow")
+
+# секунды: от поиска по индексу (мс) до долгой генерации
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SCORE_BUCKETS = (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0)
+
+_HELP = {
+    "rag_requests_total": ("counter", "Запросы по типу и исходу"),
+    "rag_cache_hits_total": ("counter", "Ответы из кеша ответов (exact / similar)"),
+    "rag_tokens_total": ("counter", "Токены из usage ответа LLM (prompt / completion / cached)"),
+    "rag_request_seconds": ("histogram", "Полное время обработки запроса"),
+    "rag_stage_seconds": ("histogram", "Время этапов запроса"),
+    "rag_top_score": ("histogram", "Лучшая косинусная оценка среди найденных чанков"),
+    "bot_rejected_total": ("counter", "Сообщения, отклонённые допуском (лимит, перегрузка, таймаут)"),
+    "webhook_updates_total": ("counter", "Апдейты вебхука, переданные воркеру"),
+    "webhook_rejected_total": ("counter", "Апдейты вебхука, отклонённые из-за полной очереди воркера"),
+    "llm_requests_total": ("counter", "Попытки генерации по эндпоинтам LLM и исходу (ok / error / cancelled)"),
+    "llm_hedges_total": ("counter", "Дубли запроса, отправленные в эндпоинт после hedge-задержки"),
+    "llm_circuit_open_total": ("counter", "Размыкания цепи эндпоинта LLM после сбоев подряд"),
+    "llm_endpoint_seconds": ("histogram", "Время ответа эндпоинта LLM (для stream — до первого токена)"),
+}
+
+
+class Trace:
+    """
+    Трасса одного запроса: длительности этапов (секунды, повторный этап
+    суммируется) и сведения о запросе — токены из usage, оценки поиска,
+    попадание в кеш, исход. Этапы могут вкладываться: retrieve включает
+    embed / search / lexical_wait, остаток — ожидание в очереди батчера.
+    """
+
+    def __init__(self, kind: str, question: str = ""):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.question = question
+        self.started = time.perf_counter()
+        self.total: Optional[float] = None
+        self.stages: Dict[str, float] = {}
+        self.info: Dict = {"outcome": "ok"}
+
+    def add(self, stage: str, seconds: float):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, name: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - t0)
+
+    def set(self, **info):
+        self.info.update(info)
+
+    def set_usage(self, usage):
+        """usage из ответа OpenAI-совместимого сервера (у vLLM — с cached_tokens)."""
+        if usage is None:
+            return
+        details = getattr(usage, "prompt_tokens_details", None)
+        self.set(
+            prompt_tokens=usage.prompt_tokens,
+            completion_tokens=usage.completion_tokens,
+            cached_tokens=getattr(details, "cached_tokens", None) or 0,
+        )
+
+    def as_dict(self) -> Dict:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "question": self.question,
+            "total": round(self.total if self.total is not None else time.perf_counter() - self.started, 4),
+            "stages": {k: round(v, 4) for k, v in self.stages.items()},
+            **self.info,
+        }
+
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)      # последний — +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """
+    Счётчики и гистограммы в памяти процесса, рендер в текстовом формате
+    Prometheus. finish(trace) раскладывает трассу по метрикам и пишет
+    в лог rag.slow полную разбивку запросов дольше slow_threshold секунд.
+    """
+
+    def __init__(self, slow_threshold: float = None):
+        self.slow_threshold = slow_threshold
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, Tuple], float] = {}
+        self._histograms: Dict[Tuple[str, Tuple], Histogram] = {}
+
+    @staticmethod
+    def _key(name: str, labels: Dict) -> Tuple[str, Tuple]:
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, buckets=LATENCY_BUCKETS, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = Histogram(buckets)
+            self._histograms[key].observe(value)
+
+    def counter(self, name: str, **labels) -> float:
+        return self._counters.get(self._key(name, labels), 0)
+
+    def histogram(self, name: str, **labels) -> Optional[Histogram]:
+        return self._histograms.get(self._key(name, labels))
+
+    # ─── трассы ──────────────────────────────────────────────────────────────
+    def trace(self, kind: str, question: str = "") -> Trace:
+        return Trace(kind, question)
+
+    def finish(self, trace: Trace):
+        trace.total = time.perf_counter() - trace.started
+        info = trace.info
+        self.inc("rag_requests_total", kind=trace.kind, outcome=info["outcome"])
+        self.observe("rag_request_seconds", trace.total, kind=trace.kind)
+        for stage, sec in trace.stages.items():
+            self.observe("rag_stage_seconds", sec, stage=stage)
+        if info.get("cache"):
+            self.inc("rag_cache_hits_total", kind=info["cache"])
+        for kind in ("prompt", "completion", "cached"):
+            if info.get(f"{kind}_tokens"):
+                self.inc("rag_tokens_total", info[f"{kind}_tokens"], type=kind)
+        if info.get("scores"):
+            self.observe("rag_top_score", max(info["scores"]), buckets=SCORE_BUCKETS)
+
+        if self.slow_threshold is not None and trace.total >= self.slow_threshold:
+            slow_logger.warning("Slow request %s", json.dumps(trace.as_dict(), ensure_ascii=False))
+        else:
+            logger.debug("Trace %s", trace.as_dict())
+
+    # ─── экспорт ─────────────────────────────────────────────────────────────
+    @staticmethod
+    def _labels(labels: Tuple, extra: Tuple = ()) -> str:
+        pairs = labels + extra
+        if not pairs:
+            return ""
+        body = ",".join(f'{k}="{str(v)}"'.replace("\n", " ") for k, v in pairs)
+        return "{" + body + "}"
+
+    def render(self) -> str:
+        """Текстовый формат Prometheus (exposition format 0.0.4)."""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(
+                (key, (h.buckets, list(h.counts), h.sum, h.count)) for key, h in self._histograms.items()
+            )
+        lines: List[str] = []
+        seen = set()
+
+        def header(name):
+            if name not in seen:
+                seen.add(name)
+                kind, help_ = _HELP.get(name, ("untyped", name))
+                lines.append(f"# HELP {name} {help_}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in counters:
+            header(name)
+            lines.append(f"{name}{self._labels(labels)} {value:g}")
+        for (name, labels), (buckets, counts, total, count) in histograms:
+            header(name)
+            cumulative = 0
+            for bound, n in zip(list(buckets) + ["+Inf"], counts):
+                cumulative += n
+                le = bound if bound == "+Inf" else f"{bound:g}"
+                lines.append(f"{name}_bucket{self._labels(labels, (('le', le),))} {cumulative}")
+            lines.append(f"{name}_sum{self._labels(labels)} {total:.6f}")
+            lines.append(f"{name}_count{self._labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+def start_metrics_server(metrics: Metrics, host: str = "127.0.0.1", port: int = 9100):
+    """
+    Отдаёт /metrics (Prometheus) и /health из фонового потока.
+    Возвращает server; остановка — server.shutdown().
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split("?")[0] == "/metrics":
+                body, ctype = metrics.render().encode("utf-8"), "text/plain; version=0.0.4; charset=utf-8"
+            elif self.path == "/health":
+                body, ctype = b"ok\n", "text/plain"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    logger.info("Metrics endpoint: http://%s:%d/metrics", host, server.server_address[1])
+    return server
@@ -1,19 +1,58 @@
 import os
 import json
+import asyncio
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
-from typing import List, Dict
+from typing import AsyncIterator, List, Dict, NamedTuple, Optional, Sequence, Tuple, Union
 
 import faiss
-from openai import OpenAI
-from sentence_transformers import SentenceTransformer
-from src.parsers.pdf_parser import PDFParser
+import httpx
+import numpy as np
+from openai import AsyncOpenAI, OpenAI
+from src.parsers.page_store import PageStore, file_hash, normalize_text
+from src.rag.ann import IndexParams, build_index, configure_search, prepare_index
+from src.rag.answer_cache import AnswerCache, chunk_set_key
+from src.rag.batching import QueryBatcher
+from src.rag.chunking import StructuredChunker
+from src.rag.context import TokenCounter, pack_context, render_context
+from src.rag.conversation import ConversationStore
+from src.rag.embedders import load_embedder
+from src.rag.facts import FactStore, IntentMatcher
+from src.rag.lexical import BM25Index, MmapBM25Index, rrf_fuse
+from src.rag.llm_router import LLMRouter, close_stream
+from src.rag.metrics import Metrics, Trace
+from src.rag.rerank import CrossEncoderReranker
+from src.rag.embedding_cache import (
+    EmbeddingCache,
+    chunks_fingerprint,
+    load_index_snapshot,
+    save_index_snapshot,
+)
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
 
+DEFAULT_SYSTEM_PROMPT = (
+    "Вы — экспертный помощник, помогающий абитуриентам "
+    "выбрать магистерскую программу ИТМО. "
+    "Отвечайте ТОЛЬКО на вопросы о магистерских программах ИТМО, их учебных планах, "
+    "элективах и процессе поступления. Если вопрос не по теме, отвечайте: "
+    "«Я могу помочь только по вопросам поступления на магистратуру ИТМО.»"
+)
+
+
 def chunk_text(text: str, chunk_size: int, chunk_overlap: int) -> List[str]:
+    return [c for _, c in chunk_text_with_offsets(text, chunk_size, chunk_overlap)]
+
+
+def chunk_text_with_offsets(
+    text: str, chunk_size: int, chunk_overlap: int
+) -> List[Tuple[int, str]]:
     step = chunk_size - chunk_overlap
     if step <= 0:
         raise ValueError("chunk_size must be > chunk_overlap")
@@ -21,11 +60,118 @@ def chunk_text(text: str, chunk_size: int, chunk_overlap: int) -> List[str]:
     i = 0
     n = len(text)
     while i < n:
-        chunks.append(text[i : i + chunk_size])
+        chunks.append((i, text[i : i + chunk_size]))
         i += step
     return chunks
 
 
+def load_json_docs(json_path: Path) -> List[Dict]:
+    docs = []
+    for entry in json.loads(Path(json_path).read_text(encoding="utf-8")):
+        txt = ""
+        if entry.get("title"):
+            txt += entry["title"] + "\n\n"
+        if entry.get("description"):
+            txt += entry["description"] + "\n\n"
+        doc = {"page_content": txt, "source": entry.get("url", "")}
+        if entry.get("slug"):
+            doc["program"] = entry["slug"]
+        docs.append(doc)
+    logger.info("Loaded %d JSON docs", len(docs))
+    return docs
+
+
+def build_program_overview(json_path: Path) -> str:
+    """
+    Короткая неизменная справка по программам из programs.json.
+    Идёт в начало промпта вместе с системным промптом, поэтому должна быть
+    детерминированной (тот же JSON -> байт-в-байт тот же текст).
+    """
+    lines = ["Справка по программам:"]
+    for entry in json.loads(Path(json_path).read_text(encoding="utf-8")):
+        line = f"- {entry.get('title') or entry.get('slug') or ''}"
+        if entry.get("url"):
+            line += f" ({entry['url']})"
+        contacts = ", ".join(x for x in (entry.get("manager_email"), entry.get("manager_phone")) if x)
+        if contacts:
+            line += f"; контакты менеджера: {contacts}"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def _pdf_programs(json_path: Optional[Path]) -> Dict[str, str]:
+    """Имя PDF-файла -> slug программы (по pdf_url из programs.json)."""
+    if not json_path or not Path(json_path).exists():
+        return {}
+    out = {}
+    for entry in json.loads(Path(json_path).read_text(encoding="utf-8")):
+        if entry.get("pdf_url") and entry.get("slug"):
+            out[entry["pdf_url"].rstrip("/").split("/")[-1]] = entry["slug"]
+    return out
+
+
+def load_pdf_docs(
+    pdf_dir: Path, json_path: Path = None, cache_dir: Path = None, max_workers: int = None
+) -> List[Dict]:
+    """
+    PDF -> документы с постраничным текстом (pages) для цитирования страниц.
+    Извлечение параллельное; с cache_dir страницы кешируются по хешу файла.
+    """
+    store = PageStore(Path(cache_dir) / "pages") if cache_dir else None
+    programs = _pdf_programs(json_path)
+    pdfs = sorted(Path(pdf_dir).glob("*.pdf"))
+    extracted = {}
+    if store is not None:
+        for pdf in pdfs:
+            cached = store.get(file_hash(pdf))
+            if cached is not None:
+                extracted[pdf] = cached
+    missing = [p for p in pdfs if p not in extracted]
+    if missing:
+        # PyPDF2 и пул процессов нужны только при промахе кеша страниц
+        from src.parsers.pdf_parser import extract_pdfs
+
+        extracted.update(extract_pdfs(missing, store=store, max_workers=max_workers))
+    docs = []
+    for pdf in pdfs:
+        raw_pages = extracted[pdf]
+        pages = [normalize_text(p) for p in raw_pages]
+        doc = {
+            "page_content": "\n\n".join(p for p in pages if p),
+            "pages": pages,
+            "source": pdf.name,
+        }
+        if pdf.name in programs:
+            doc["program"] = programs[pdf.name]
+        docs.append(doc)
+    logger.info("Loaded %d PDF docs", len(docs))
+    return docs
+
+
+def cite_source(doc: Dict) -> str:
+    """Подпись источника для ответа: файл/URL и, для PDF, страницы."""
+    if doc.get("page") is None:
+        return doc["source"]
+    if doc.get("page_end"):
+        return f"{doc['source']}, стр. {doc['page']}–{doc['page_end']}"
+    return f"{doc['source']}, стр. {doc['page']}"
+
+
+class _IndexState(NamedTuple):
+    index: object
+    chunks: Sequence[Dict]                  # list или ChunkStore (mmap)
+    lexical: Optional[Union[BM25Index, MmapBM25Index]] = None
+    vectors: Optional[np.ndarray] = None    # точные нормированные векторы (часто mmap)
+
+
+class _Dialog(NamedTuple):
+    chat_id: object
+    question: str                           # как задан пользователем
+    query: str                              # самостоятельный запрос для поиска и кеша
+    topic: str
+    history: List[Dict]                     # реплики истории для промпта
+
+
 class RAGService:
     def __init__(
         self,
@@ -44,6 +190,49 @@ class RAGService:
         presence_penalty: float = 1.5,
         enable_thinking: bool = False,
         system_prompt: str = None,
+        cache_dir: Path = None,
+        max_concurrent_generations: int = 4,
+        embed_workers: int = 2,
+        request_timeout: float = 120.0,
+        batch_max_size: int = 16,
+        batch_max_wait_ms: float = 2.0,
+        answer_cache_size: int = 512,
+        answer_cache_ttl: float = 3600.0,
+        answer_cache_similarity: float = 0.97,
+        context_token_budget: int = 1500,
+        tokenizer_name: str = None,
+        max_model_len: int = None,
+        include_overview: bool = False,
+        hybrid: bool = False,
+        dense_weight: float = 1.0,
+        lexical_weight: float = 1.0,
+        rrf_k: int = 60,
+        chunker: str = "structured",
+        chunk_tokens: int = 256,
+        pdf_workers: int = None,
+        index_type: str = "auto",
+        hnsw_m: int = 32,
+        hnsw_ef_construction: int = 200,
+        hnsw_ef_search: int = 64,
+        ivf_nlist: int = None,
+        ivf_nprobe: int = 16,
+        quantization: str = "none",
+        pq_m: int = 64,
+        rescore_factor: int = 4,
+        embedder=None,
+        embed_backend: str = "torch",
+        embed_threads: int = None,
+        metrics: Metrics = None,
+        reranker=None,
+        rerank_model: str = None,
+        rerank_candidates: int = 20,
+        rerank_threshold: float = 0.1,
+        rerank_dominance: float = 0.05,
+        conversations: ConversationStore = None,
+        history_token_budget: int = 600,
+        fact_answers: bool = True,
+        llm_router: LLMRouter = None,
+        snapshot_readonly: bool = False,
     ):
         # API key/base
         self.api_key = os.getenv("OPENAI_API_KEY", "")
@@ -59,77 +248,604 @@ class RAGService:
         self.top_k = top_k
         self.presence_penalty = presence_penalty
         self.enable_thinking = enable_thinking
+        self.context_token_budget = context_token_budget
+        self.max_model_len = max_model_len
+        self.token_counter = TokenCounter(tokenizer_name)
+        if self.token_counter.tokenizer is None:
+            logger.warning(
+                "No tokenizer for the served model: context and history budgets are estimated "
+                "at %.0f chars per token, set tokenizer_name to its HF id", TokenCounter.CHARS_PER_TOKEN,
+            )
 
         # Russian system prompt
-        self.system_prompt = system_prompt or (
-            "Вы — экспертный помощник, помогающий абитуриентам "
-            "выбрать между магистерскими программами ИТМО «AI‑product» и «Искусственный интеллект». "
-            "Отвечайте ТОЛЬКО на вопросы по этим программам, учебным планам, элективам и "
-            "процессу поступления. Если вопрос не по теме, отвечайте: "
-            "«Я могу помочь только по вопросам поступления на магистратуру ИТМО.»"
+        self.system_prompt = system_prompt or DEFAULT_SYSTEM_PROMPT
+
+        # Стабильный префикс промпта: одинаков для всех запросов, чтобы vLLM
+        # переиспользовал его KV-кеш (automatic prefix caching)
+        self.include_overview = include_overview
+        self.prompt_prefix = self._make_prompt_prefix(json_path)
+
+        # длительности этапов холодного старта, секунды
+        self.startup_timings: Dict[str, float] = {}
+        t0 = time.perf_counter()
+
+        # 1) JSON + 2) PDF (страницы PDF кешируются в cache_dir/pages).
+        # snapshot_readonly — процесс только читает опубликованный снапшот
+        # (воркеры вебхука), собирает и пишет его кто-то один. Документы такой
+        # процесс не читает и не чанкует: индекс, чанки, BM25 и факты — из снапшота
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self.pdf_workers = pdf_workers
+        self.snapshot_readonly = snapshot_readonly
+        published = None
+        if snapshot_readonly:
+            published = load_index_snapshot(self.cache_dir / "index") if self.cache_dir else None
+            if published is None:
+                raise RuntimeError(f"No published index snapshot in {self.cache_dir}")
+            docs: List[Dict] = []
+            self.doc_sources: List[str] = list(
+                published.sources if published.sources is not None
+                else dict.fromkeys(c["source"] for c in published.chunks)
+            )
+            t0 = self._mark("load_snapshot", t0)
+        else:
+            docs = load_json_docs(json_path) + load_pdf_docs(
+                pdf_dir, json_path, self.cache_dir, pdf_workers
+            )
+            logger.info("Loaded total %d docs", len(docs))
+            # тексты документов после чанкинга не держим, для синхронизации хватает источников
+            self.doc_sources = [d["source"] for d in docs]
+            t0 = self._mark("load_docs", t0)
+
+        # Факты учебных планов и контакты программ: справочные вопросы
+        # («сколько з.е. у …», «email менеджера») отвечаются без поиска и LLM
+        self.facts = FactStore()
+        self.facts.load_programs(json_path)
+        if published is None:
+            self.facts.update(docs)
+        elif published.facts is not None:
+            self.facts.restore(published.facts)
+        self.intents = IntentMatcher(self.facts) if fact_answers else None
+        t0 = self._mark("facts", t0)
+
+        # 3) Chunking (structured — по структуре документа в токенах эмбеддера,
+        #    window — окно chunk_size символов с перекрытием chunk_overlap)
+        if chunker not in ("structured", "window"):
+            raise ValueError(f"Unknown chunker: {chunker}")
+        self.hf_embed_model = hf_embed_model
+        # embedder — готовый объект с encode(texts) (например, для бенчмарков);
+        # иначе бэкенд embed_backend: torch | onnx | onnx-int8 (экспорт в cache_dir/onnx),
+        # embed_threads потоков (None — ядра, доступные контейнеру)
+        self.embed_backend = embed_backend
+        # векторы разных бэкендов чуть отличаются — кеш и снапшот у каждого свои
+        self.embed_key = hf_embed_model if embed_backend == "torch" else f"{hf_embed_model}@{embed_backend}"
+        if embedder is None:
+            embedder = load_embedder(
+                hf_embed_model, embed_backend, embed_threads,
+                self.cache_dir / "onnx" if self.cache_dir else None,
+            )
+        self.embedder = embedder
+        t0 = self._mark("load_embedder", t0)
+        self.chunker = chunker
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self._structured_chunker = StructuredChunker(
+            TokenCounter(tokenizer=getattr(self.embedder, "tokenizer", None)), chunk_tokens
         )
+        chunks: List[Dict] = []
+        if published is None:
+            for doc in docs:
+                chunks.extend(self._chunk_doc(doc))
+            logger.info("Split into %d chunks (%s)", len(chunks), chunker)
+            t0 = self._mark("chunking", t0)
 
-        # 1) JSON
-        self.docs: List[Dict] = []
-        for entry in json.loads(Path(json_path).read_text(encoding="utf-8")):
-            txt = ""
-            if entry.get("title"):
-                txt += entry["title"] + "\n\n"
-            if entry.get("description"):
-                txt += entry["description"] + "\n\n"
-            self.docs.append({"page_content": txt, "source": entry.get("url", "")})
-        logger.info("Loaded %d JSON docs", len(self.docs))
-
-        # 2) PDF
-        parser = PDFParser()
-        for pdf in Path(pdf_dir).glob("*.pdf"):
-            raw = parser.extract_text(pdf)
-            struct = parser.parse_structured(raw)
-            self.docs.append({"page_content": struct["raw"], "source": pdf.name})
-        logger.info("Loaded total %d docs", len(self.docs))
-
-        # 3) Chunking
-        self.chunks: List[Dict] = []
-        for doc in self.docs:
-            for c in chunk_text(doc["page_content"], chunk_size, chunk_overlap):
-                self.chunks.append({"page_content": c, "source": doc["source"]})
-        logger.info("Split into %d chunks", len(self.chunks))
-
-        # 4) Embeddings + FAISS
-        self.embedder = SentenceTransformer(hf_embed_model)
-        texts = [c["page_content"] for c in self.chunks]
-        embs = self.embedder.encode(texts, show_progress_bar=True)
-        dim = embs.shape[1]
-        faiss.normalize_L2(embs)
-        self.index = faiss.IndexFlatIP(dim)
-        self.index.add(embs)
-        logger.info("Built FAISS index with %d vectors (dim=%d)", embs.shape[0], dim)
+        # Переранжирование кросс-энкодером (reranker — готовый объект
+        # с score(query, texts), rerank_model — HF id; иначе выключено).
+        # Задаётся до индекса: от него зависит глубина поиска
+        if reranker is None and rerank_model:
+            reranker = CrossEncoderReranker(rerank_model)
+            t0 = self._mark("load_reranker", t0)
+        self.reranker = reranker
+        self.rerank_candidates = rerank_candidates
+        self.rerank_threshold = rerank_threshold
+        # разрыв косинусов топ-1 и топ-2, при котором топ считается очевидным
+        # (у e5 косинусы сжаты в ~0.7–0.9, так что 0.05 — уже заметный отрыв)
+        self.rerank_dominance = rerank_dominance
+
+        # 4) Embeddings + FAISS (со снапшотом и кешем эмбеддингов, если задан cache_dir)
+        self.embed_cache = (
+            EmbeddingCache(self.cache_dir, self.embed_key)
+            if self.cache_dir and not snapshot_readonly else None
+        )
+        self._update_lock = threading.Lock()
+        # flat — точный поиск; hnsw/ivf — приближённый для больших корпусов,
+        # recall/латентность настраиваются через ef_search / nprobe (set_search_params)
+        self.index_params = IndexParams(
+            kind=index_type,
+            hnsw_m=hnsw_m,
+            ef_construction=hnsw_ef_construction,
+            ef_search=hnsw_ef_search,
+            nlist=ivf_nlist,
+            nprobe=ivf_nprobe,
+            quantization=quantization,
+            pq_m=pq_m,
+            rescore_factor=rescore_factor,
+        )
+        if published is not None:
+            # версию, новее опубликованной, воркер подхватит reload после публикации
+            fingerprint, snapshot = None, published
+        else:
+            fingerprint = self._fingerprint(chunks)
+            snapshot = (
+                load_index_snapshot(self.cache_dir / "index", fingerprint)
+                if self.cache_dir else None
+            )
+        self.hybrid = hybrid
+        self.dense_weight = dense_weight
+        self.lexical_weight = lexical_weight
+        self.rrf_k = rrf_k
+        # отдельный пул: _search может сам выполняться в _embed_executor
+        self._lexical_executor = (
+            ThreadPoolExecutor(max_workers=embed_workers, thread_name_prefix="rag-bm25")
+            if hybrid else None
+        )
+        if snapshot is not None:
+            self._state = self._make_state(snapshot.index, snapshot.chunks, snapshot.vectors, snapshot.lexical)
+            self._mark("load_snapshot", t0)
+        else:
+            embs = self._embed_texts([c["page_content"] for c in chunks])
+            t0 = self._mark("embedding", t0)
+            self._state = self._new_state(embs, chunks, fingerprint)
+            self._mark("index", t0)
+        logger.info("Startup timings: %s", {k: round(v, 3) for k, v in self.startup_timings.items()})
 
-        # 5) OpenAI SDK клиент
+        # 5) OpenAI SDK клиент (синхронный; асинхронный создаётся лениво в aask).
+        # С llm_router генерации идут через него (несколько эндпоинтов, дубли,
+        # обход упавших), семафор по-прежнему ограничивает их общее число
         self.client = OpenAI(api_key=self.api_key, base_url=self.api_base)
+        self.llm_router = llm_router
+        self.max_concurrent_generations = max_concurrent_generations
+        self.request_timeout = request_timeout
+        self._embed_executor = ThreadPoolExecutor(
+            max_workers=embed_workers, thread_name_prefix="rag-embed"
+        )
+        self._async_loop = None
+        self._async_client = None
+        self._gen_semaphore = None
 
-    def _retrieve(self, query: str) -> List[Dict]:
-        q_emb = self.embedder.encode([query])
+        # 6) Кеш ответов (answer_cache_size=0 — выключен)
+        self.answer_cache = (
+            AnswerCache(answer_cache_size, answer_cache_ttl, answer_cache_similarity)
+            if answer_cache_size > 0 else None
+        )
+
+        # 7) Микробатчинг эмбеддинга запросов (batch_max_size=1 — выключен)
+        self._batcher = (
+            QueryBatcher(self._batched_search, batch_max_size, batch_max_wait_ms)
+            if batch_max_size > 1 else None
+        )
+
+        # 8) Трассы запросов и метрики (общий Metrics можно передать снаружи)
+        self.metrics = metrics or Metrics()
+
+        # 9) История диалогов по chat_id (None — каждый вопрос сам по себе);
+        #    в промпт идёт не больше history_token_budget токенов истории
+        self.conversations = conversations
+        self.history_token_budget = history_token_budget
+
+    def _mark(self, stage: str, t0: float) -> float:
+        now = time.perf_counter()
+        self.startup_timings[stage] = now - t0
+        return now
+
+    # Индекс и чанки меняются только вместе, одной заменой self._state
+    @property
+    def index(self):
+        return self._state.index
+
+    @property
+    def chunks(self) -> List[Dict]:
+        return self._state.chunks
+
+    def _chunk_doc(self, doc: Dict) -> List[Dict]:
+        if self.chunker == "structured":
+            return self._structured_chunker.chunk(doc)
+        return [
+            {"page_content": c, "source": doc["source"], "start": start}
+            for start, c in chunk_text_with_offsets(
+                doc["page_content"], self.chunk_size, self.chunk_overlap
+            )
+        ]
+
+    def _embed_texts(self, texts: List[str]):
+        def encode(batch):
+            return self.embedder.encode(batch, show_progress_bar=len(batch) > 1)
+
+        if self.embed_cache is None:
+            return encode(texts)
+        return self.embed_cache.encode(texts, encode)
+
+    def _make_state(
+        self, index, chunks: Sequence[Dict], vectors: np.ndarray = None, lexical: MmapBM25Index = None
+    ) -> _IndexState:
+        prepare_index(index)
+        configure_search(index, self.index_params, self._fetch_depth())
+        # BM25 строится рядом с FAISS по тем же чанкам и подменяется вместе с ним
+        # (из снапшота — готовый, отображённый в память)
+        if not self.hybrid:
+            lexical = None
+        elif lexical is None:
+            lexical = BM25Index([c["page_content"] for c in chunks])
+        return _IndexState(index, chunks, lexical, vectors)
+
+    def _new_state(self, embs, chunks: List[Dict], fingerprint: str = None) -> _IndexState:
+        embs = np.ascontiguousarray(embs, dtype="float32")
+        faiss.normalize_L2(embs)
+        index = build_index(embs, self.index_params)
+        if self.embed_cache is not None:
+            # сборка закончена: эмбеддинги чанков, которых больше нет в корпусе, — на выброс
+            self.embed_cache.prune(c["page_content"] for c in chunks)
+        if self.cache_dir and not self.snapshot_readonly:
+            # индекс, чанки, векторы и BM25 переоткрываются из снапшота через mmap:
+            # в куче процесса их не держим, страницы делятся между репликами
+            snapshot_dir = self.cache_dir / "index"
+            version = save_index_snapshot(
+                snapshot_dir, index, chunks, fingerprint or self._fingerprint(chunks), embs,
+                lexical=BM25Index([c["page_content"] for c in chunks]) if self.hybrid else None,
+                facts=self.facts.dump(),
+                sources=self.doc_sources,
+            )
+            snapshot = load_index_snapshot(snapshot_dir, version=version)
+            if snapshot is not None:
+                return self._make_state(snapshot.index, snapshot.chunks, snapshot.vectors, snapshot.lexical)
+        # без cache_dir точные векторы нужны только для пересчёта после сжатого индекса
+        return self._make_state(index, chunks, None if self.index_params.exact else embs)
+
+    @staticmethod
+    def _vectors(state: _IndexState, ids) -> np.ndarray:
+        if state.vectors is not None:
+            return np.asarray(state.vectors[ids], dtype="float32")
+        index = state.index
+        if len(ids) * 4 >= index.ntotal:
+            # заметная доля индекса (пересборка при обновлении) — дешевле одним куском
+            return index.reconstruct_n(0, index.ntotal)[ids]
+        # единичные строки (кандидаты из BM25 на запрос) — только их, а не весь индекс
+        return np.vstack([index.reconstruct(int(i)) for i in ids]).astype("float32", copy=False)
+
+    def _fingerprint(self, chunks: List[Dict]) -> str:
+        # тип индекса входит в отпечаток: смена index_type перестраивает снапшот
+        key = f"{self.embed_key}|{self.index_params.build_key(len(chunks))}"
+        return chunks_fingerprint(key, chunks)
+
+    def _candidates(self) -> int:
+        # с переранжированием берём больше кандидатов, лишние отсечёт кросс-энкодер
+        if self.reranker is not None:
+            return max(self.top_k_retrieval, self.rerank_candidates)
+        return self.top_k_retrieval
+
+    def _search_depth(self) -> int:
+        return self._candidates() * (2 if self.hybrid else 1)
+
+    def _fetch_depth(self) -> int:
+        # сжатый индекс отдаёт больше кандидатов, порядок уточняется точным косинусом
+        factor = 1 if self.index_params.exact else self.index_params.rescore_factor
+        return self._search_depth() * factor
+
+    def set_search_params(self, ef_search: int = None, nprobe: int = None):
+        """Меняет компромисс recall/латентность без перестройки индекса."""
+        changes = {k: v for k, v in (("ef_search", ef_search), ("nprobe", nprobe)) if v is not None}
+        self.index_params = self.index_params._replace(**changes)
+        configure_search(self._state.index, self.index_params, self._fetch_depth())
+
+    # ─── Инкрементальное обновление ─────────────────────────────────────────────
+    def update_documents(self, docs: List[Dict], remove_sources: List[str] = ()) -> Dict:
+        """
+        Добавляет/заменяет документы (по полю source) и удаляет remove_sources.
+        Перечанкуются и эмбеддятся только затронутые документы; новый индекс
+        собирается рядом и подменяется одной операцией, так что идущие
+        параллельно ask() видят либо старое, либо новое состояние целиком.
+        """
+        with self._update_lock:
+            state = self._state
+            old_by_source: Dict[str, List[int]] = {}
+            for i, c in enumerate(state.chunks):
+                old_by_source.setdefault(c["source"], []).append(i)
+
+            new_chunks_by_source: Dict[str, List[Dict]] = {}
+            for doc in docs:
+                new_chunks_by_source[doc["source"]] = self._chunk_doc(doc)
+
+            changed = {
+                src for src, chunks in new_chunks_by_source.items()
+                if [c["page_content"] for c in chunks]
+                != [state.chunks[i]["page_content"] for i in old_by_source.get(src, [])]
+            }
+            removed = {s for s in remove_sources if s in old_by_source} - set(new_chunks_by_source)
+            stats = {
+                "added": sorted(changed - set(old_by_source)),
+                "replaced": sorted(changed & set(old_by_source)),
+                "removed": sorted(removed),
+            }
+            if not changed and not removed:
+                logger.info("Index update: nothing changed")
+                return stats
+
+            dropped = changed | removed
+            keep = [i for i, c in enumerate(state.chunks) if c["source"] not in dropped]
+            added = [c for src in sorted(changed) for c in new_chunks_by_source[src]]
+
+            parts = []
+            if keep:
+                parts.append(self._vectors(state, keep))
+            if added:
+                parts.append(self._embed_texts([c["page_content"] for c in added]))
+            chunks = [state.chunks[i] for i in keep] + added
+            if not chunks:
+                raise ValueError("Index update would leave the index empty")
+            # факты и источники — до сборки состояния: они пишутся в снапшот вместе с индексом
+            self.facts.update([d for d in docs if d["source"] in changed], dropped)
+            self.doc_sources = [s for s in self.doc_sources if s not in dropped] + [
+                d["source"] for d in docs if d["source"] in changed
+            ]
+            self._state = self._new_state(np.vstack(parts), chunks)
+            if self.answer_cache is not None:
+                self.answer_cache.clear()
+            logger.info(
+                "Index update: +%d ~%d -%d sources, %d chunks total",
+                len(stats["added"]), len(stats["replaced"]), len(stats["removed"]), len(chunks),
+            )
+            return stats
+
+    def remove_documents(self, sources: List[str]) -> Dict:
+        return self.update_documents([], remove_sources=sources)
+
+    def sync_documents(self, docs: List[Dict]) -> Dict:
+        """Приводит индекс к ровно этому набору документов."""
+        present = {d["source"] for d in docs}
+        stale = [s for s in self.doc_sources if s not in present]
+        return self.update_documents(docs, remove_sources=stale)
+
+    def reload(self, json_path: Path, pdf_dir: Path) -> Dict:
+        """Перечитывает programs.json и PDF-ы и применяет только изменения."""
+        stats = self.sync_documents(
+            load_json_docs(json_path)
+            + load_pdf_docs(pdf_dir, json_path, self.cache_dir, self.pdf_workers)
+        )
+        self.prompt_prefix = self._make_prompt_prefix(json_path)
+        self.facts.load_programs(json_path)
+        return stats
+
+    def _make_prompt_prefix(self, json_path: Path) -> str:
+        if not self.include_overview:
+            return self.system_prompt
+        return self.system_prompt + "\n\n" + build_program_overview(json_path)
+
+    def _search_batch(
+        self, queries: List[str], timings: Dict = None
+    ) -> List[Tuple[np.ndarray, List[Tuple[float, Dict]]]]:
+        """
+        Один encode и один index.search на пачку запросов -> [(вектор запроса, hits)].
+        В timings (если передан) пишутся длительности этапов пачки.
+        """
+        timings = {} if timings is None else timings
+        state = self._state                          # один снимок на всю пачку
+        depth = self._search_depth()
+        lexical = None
+        if state.lexical is not None:
+            # BM25 считается в пуле параллельно с encode (torch отпускает GIL)
+            lexical = self._lexical_executor.submit(
+                lambda: [state.lexical.search(q, depth) for q in queries]
+            )
+        t0 = time.perf_counter()
+        q_emb = np.ascontiguousarray(self.embedder.encode(queries), dtype="float32")
         faiss.normalize_L2(q_emb)
-        scores, idxs = self.index.search(q_emb, self.top_k_retrieval)
+        t1 = time.perf_counter()
+        timings["embed"] = t1 - t0
+        fetch = self._fetch_depth()
+        scores, idxs = state.index.search(q_emb, fetch)
+        if fetch > depth:
+            scores, idxs = self._rescore(state, q_emb, idxs, depth)
+        timings["search"] = time.perf_counter() - t1
+        if lexical is None:
+            return [
+                (vec, [(float(sc), state.chunks[i]) for sc, i in zip(row_s, row_i) if i >= 0])
+                for vec, row_s, row_i in zip(q_emb, scores, idxs)
+            ]
+
+        t2 = time.perf_counter()
+        lexical = lexical.result()
+        timings["lexical_wait"] = time.perf_counter() - t2   # BM25 дольше encode + search
         out = []
-        for score, i in zip(scores[0], idxs[0]):
-            if score >= self.min_score:              # отфильтровываем по порогу
-                out.append(self.chunks[i])
-        logger.info("Retrieved %d chunks (scores first=%s)", len(out), scores[0][: len(out)])
+        for vec, row_s, row_i, lex in zip(q_emb, scores, idxs, lexical):
+            dense = {int(i): float(sc) for sc, i in zip(row_s, row_i) if i >= 0}
+            fused = rrf_fuse(
+                [list(dense), [i for _, i in lex]],
+                [self.dense_weight, self.lexical_weight],
+                k=self.rrf_k,
+            )[: self._candidates()]
+            hits = []
+            for _, i in fused:
+                # для найденных только BM25 считаем косинус явно, чтобы min_score
+                # применялся одинаково ко всем кандидатам
+                sc = dense[i] if i in dense else float(self._vectors(state, [i])[0] @ vec)
+                hits.append((sc, state.chunks[i]))
+            out.append((vec, hits))
+        return out
+
+    def _rescore(self, state: _IndexState, q_emb: np.ndarray, idxs: np.ndarray, depth: int):
+        """Точный косинус по float-векторам для кандидатов сжатого индекса."""
+        scores = np.full((len(q_emb), depth), -np.inf, dtype="float32")
+        out = np.full((len(q_emb), depth), -1, dtype="int64")
+        for r, (vec, row) in enumerate(zip(q_emb, idxs)):
+            cand = row[row >= 0]
+            if not len(cand):
+                continue
+            exact = self._vectors(state, cand) @ vec
+            order = np.argsort(-exact)[:depth]
+            scores[r, : len(order)] = exact[order]
+            out[r, : len(order)] = cand[order]
+        return scores, out
+
+    def _batched_search(self, queries: List[str]):
+        """Для QueryBatcher: к результату каждого запроса прикладываются тайминги пачки."""
+        timings = {"batch_size": len(queries)}
+        return [(vec, hits, timings) for vec, hits in self._search_batch(queries, timings)]
+
+    def _filter_hits(
+        self, hits: List[Tuple[float, Dict]], trace: Trace = None, timings: Dict = None, t0: float = None
+    ) -> List[Tuple[float, Dict]]:
+        # отфильтровываем по порогу
+        out = [(score, c) for score, c in hits if score >= self.min_score]
+        logger.debug(
+            "Retrieved %d chunks (scores first=%s)", len(out), [round(s, 3) for s, _ in hits[: len(out)]]
+        )
+        if trace is not None:
+            # retrieve — вся стадия поиска вместе с ожиданием в батчере / пуле
+            trace.add("retrieve", time.perf_counter() - t0)
+            timings = dict(timings)
+            trace.set(batch_size=timings.pop("batch_size", 1), retrieved=len(out),
+                      scores=[round(s, 3) for s, _ in hits])
+            for stage, sec in timings.items():
+                trace.add(stage, sec)
+        return out
+
+    def _select(self, query: str, hits: List[Tuple[float, Dict]], trace: Trace = None) -> List[Dict]:
+        """
+        Итоговые чанки для промпта. Без reranker — первые top_k_retrieval.
+        С reranker кандидаты пересортировываются кросс-энкодером, остаются
+        не больше top_k_retrieval с оценкой не ниже rerank_threshold (бюджет
+        токенов затем соблюдает pack_context в новом порядке). Если топ-1
+        по косинусу заметно оторвался от топ-2, кросс-энкодер не запускается.
+        """
+        top = [c for _, c in hits[: self.top_k_retrieval]]
+        if self.reranker is None or len(hits) < 2:
+            return top
+        dense = sorted((s for s, _ in hits), reverse=True)
+        if dense[0] - dense[1] >= self.rerank_dominance:
+            if trace is not None:
+                trace.set(rerank="skipped")
+            return top
+
+        t0 = time.perf_counter()
+        scores = self.reranker.score(query, [c["page_content"] for _, c in hits])
+        order = np.argsort(-scores, kind="stable")[: self.top_k_retrieval]
+        out = [hits[i][1] for i in order if scores[i] >= self.rerank_threshold]
+        if trace is not None:
+            trace.add("rerank", time.perf_counter() - t0)
+            trace.set(rerank="done", reranked=len(out),
+                      rerank_scores=[round(float(scores[i]), 3) for i in order])
         return out
 
-    def ask(self, question: str) -> Dict:
-        docs = self._retrieve(question)
-        messages = [{"role": "system", "content": self.system_prompt}]
-        for d in docs:
-            messages.append({"role": "system", "content": d["page_content"]})
+    def _search(self, query: str, trace: Trace = None) -> Tuple[np.ndarray, List[Dict]]:
+        t0 = time.perf_counter()
+        if self._batcher is not None:
+            vec, hits, timings = self._batcher.search(query)
+        else:
+            timings = {}
+            vec, hits = self._search_batch([query], timings)[0]
+        return vec, self._select(query, self._filter_hits(hits, trace, timings, t0), trace)
+
+    def _retrieve(self, query: str) -> List[Dict]:
+        return self._search(query)[1]
+
+    # ─── Трассировка ────────────────────────────────────────────────────────────
+    @contextmanager
+    def _tracing(self, trace: Optional[Trace], kind: str, question: str):
+        """
+        Трасса запроса. Если её передал вызывающий (бот — чтобы добавить
+        доставку в Telegram), он же её и закрывает; иначе трасса своя.
+        """
+        if trace is not None:
+            yield trace
+            return
+        trace = self.metrics.trace(kind, question)
+        try:
+            yield trace
+        except Exception:
+            trace.set(outcome="error")
+            raise
+        except BaseException:
+            trace.set(outcome="cancelled")
+            raise
+        finally:
+            self.metrics.finish(trace)
+
+    # ─── Кеш ответов ────────────────────────────────────────────────────────────
+    def _cache_exact(self, question: str):
+        if self.answer_cache is None:
+            return None
+        return self.answer_cache.get_exact(question)
+
+    def _cache_similar(self, q_vec: np.ndarray, docs: List[Dict]):
+        if self.answer_cache is None:
+            return None
+        return self.answer_cache.get_similar(q_vec, chunk_set_key(docs))
+
+    def _remember(self, dialog: _Dialog, q_vec: np.ndarray, docs: List[Dict], result: Dict) -> Dict:
+        # ответ, сгенерированный с историей чата, от неё зависит — другим чатам
+        # (без этой истории) его не отдаём, кешируются только ответы без истории
+        if self.answer_cache is not None and result["answer"] and not dialog.history:
+            self.answer_cache.put(dialog.query, q_vec, chunk_set_key(docs), result)
+        return result
+
+    # ─── История диалога ────────────────────────────────────────────────────────
+    def _dialog(self, question: str, chat_id, trace: Trace) -> _Dialog:
+        """Уточняющий вопрос переписывается в самостоятельный запрос, история — в реплики."""
+        if chat_id is None or self.conversations is None:
+            return _Dialog(chat_id, question, question, question, [])
+        conv = self.conversations.get(chat_id)
+        query, topic = conv.rewrite(question)
+        history = conv.messages(self.token_counter, self.history_token_budget)
+        if query != question:
+            trace.set(query=query)
+        trace.set(history_turns=sum(m["role"] == "user" for m in history))
+        return _Dialog(chat_id, question, query, topic, history)
+
+    def _fact_answer(self, dialog: _Dialog, trace: Trace) -> Optional[Dict]:
+        """Ответ из FactStore на справочный вопрос (None — нужен RAG)."""
+        if self.intents is None:
+            return None
+        with trace.stage("facts"):
+            result = self.intents.match(dialog.query)
+        if result is not None:
+            trace.set(route="facts")
+        return result
+
+    def _done(self, dialog: _Dialog, result: Dict) -> Dict:
+        if dialog.chat_id is not None and self.conversations is not None and result["answer"]:
+            self.conversations.append(dialog.chat_id, dialog.question, result["answer"], dialog.topic)
+        return result
+
+    def _build_messages(
+        self, question: str, docs: List[Dict], history: List[Dict] = ()
+    ) -> Tuple[List[Dict], List[Dict]]:
+        """
+        Собирает промпт: сначала стабильный префикс (системный промпт и,
+        опционально, справка по программам) — байт-в-байт одинаковый для всех
+        запросов, затем история чата (одинакова для соседних вопросов одного
+        чата — тоже попадает в кеш префиксов), затем переменная часть: блок
+        контекста, упакованный в context_token_budget токенов, и вопрос.
+        Возвращает (messages, реально вошедшие чанки).
+        """
+        blocks, used = pack_context(docs, self.token_counter, self.context_token_budget)
+        messages = [{"role": "system", "content": self.prompt_prefix}, *history]
+        if blocks:
+            messages.append({"role": "system", "content": render_context(blocks)})
         messages.append({"role": "user", "content": question})
+        return messages, used
+
+    def _max_tokens_for(self, messages: List[Dict]) -> int:
+        """Не даём prompt + max_tokens выйти за max_model_len сервера."""
+        if not self.max_model_len:
+            return self.max_tokens
+        # ~8 служебных токенов шаблона чата на сообщение
+        prompt = sum(self.token_counter.count(m["content"]) + 8 for m in messages)
+        return max(1, min(self.max_tokens, self.max_model_len - prompt))
 
-        resp = self.client.chat.completions.create(
+    def _completion_kwargs(self, messages: List[Dict]) -> Dict:
+        return dict(
             model=self.model_name,
             messages=messages,
-            max_tokens=self.max_tokens,
+            max_tokens=self._max_tokens_for(messages),
             temperature=self.temperature,
             top_p=self.top_p,
             presence_penalty=self.presence_penalty,
@@ -139,6 +855,191 @@ class RAGService:
             },
         )
 
-        answer = resp.choices[0].message.content
-        sources = [d["source"] for d in docs]
-        return {"answer": answer, "sources": sources}
+    def ask(self, question: str, trace: Trace = None, chat_id=None) -> Dict:
+        with self._tracing(trace, "ask", question) as trace:
+            dialog = self._dialog(question, chat_id, trace)
+            fact = self._fact_answer(dialog, trace)
+            if fact is not None:
+                return self._done(dialog, fact)
+            cached = self._cache_exact(dialog.query)
+            if cached is not None:
+                trace.set(cache="exact")
+                return self._done(dialog, cached)
+            q_vec, docs = self._search(dialog.query, trace)
+            cached = self._cache_similar(q_vec, docs)
+            if cached is not None:
+                trace.set(cache="similar")
+                return self._done(dialog, cached)
+
+            with trace.stage("context"):
+                messages, used = self._build_messages(question, docs, dialog.history)
+            with trace.stage("llm"):
+                if self.llm_router is not None:
+                    resp = self.llm_router.create_sync(trace=trace, **self._completion_kwargs(messages))
+                else:
+                    resp = self.client.chat.completions.create(**self._completion_kwargs(messages))
+            trace.set_usage(getattr(resp, "usage", None))
+
+            answer = resp.choices[0].message.content
+            sources = [cite_source(d) for d in used]
+            result = self._remember(dialog, q_vec, docs, {"answer": answer, "sources": sources})
+            return self._done(dialog, result)
+
+    # ─── Асинхронный вариант ────────────────────────────────────────────────────
+    def _loop_bound(self):
+        """
+        AsyncOpenAI и семафор привязаны к event loop, поэтому создаются лениво
+        и пересоздаются, если aask вызвали из другого цикла.
+        """
+        loop = asyncio.get_running_loop()
+        if self._async_loop is not loop:
+            limits = httpx.Limits(
+                max_connections=self.max_concurrent_generations,
+                max_keepalive_connections=self.max_concurrent_generations,
+            )
+            self._async_client = AsyncOpenAI(
+                api_key=self.api_key,
+                base_url=self.api_base,
+                http_client=httpx.AsyncClient(limits=limits, timeout=self.request_timeout),
+            )
+            self._gen_semaphore = asyncio.Semaphore(self.max_concurrent_generations)
+            self._async_loop = loop
+        return self._async_client, self._gen_semaphore
+
+    def _acreate(self, client, trace: Trace, semaphore: asyncio.Semaphore, **kwargs):
+        if self.llm_router is not None:
+            # дубли роутера занимают слоты того же семафора
+            return self.llm_router.create(trace=trace, slots=semaphore, **kwargs)
+        return client.chat.completions.create(**kwargs)
+
+    async def _asearch(self, question: str, trace: Trace = None) -> Tuple[np.ndarray, List[Dict]]:
+        t0 = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        if self._batcher is not None:
+            vec, hits, timings = await asyncio.wrap_future(self._batcher.submit(question))
+        else:
+            timings = {}
+            results = await loop.run_in_executor(
+                self._embed_executor, self._search_batch, [question], timings
+            )
+            vec, hits = results[0]
+        hits = self._filter_hits(hits, trace, timings, t0)
+        if self.reranker is None:
+            return vec, self._select(question, hits, trace)
+        # кросс-энкодер — CPU на десятки мс, не держим им event loop
+        return vec, await loop.run_in_executor(self._embed_executor, self._select, question, hits, trace)
+
+    async def aask(self, question: str, trace: Trace = None, chat_id=None) -> Dict:
+        """
+        Как ask(), но не блокирует event loop: эмбеддинг и поиск идут через
+        поток микробатчера (или, если он выключен, в собственном пуле из
+        embed_workers потоков), а генераций одновременно не больше
+        max_concurrent_generations (остальные ждут на семафоре).
+        chat_id — вести историю диалога (нужен conversations).
+        """
+        with self._tracing(trace, "aask", question) as trace:
+            dialog = self._dialog(question, chat_id, trace)
+            fact = self._fact_answer(dialog, trace)
+            if fact is not None:
+                return self._done(dialog, fact)
+            cached = self._cache_exact(dialog.query)
+            if cached is not None:
+                trace.set(cache="exact")
+                return self._done(dialog, cached)
+            client, semaphore = self._loop_bound()
+            q_vec, docs = await self._asearch(dialog.query, trace)
+            cached = self._cache_similar(q_vec, docs)
+            if cached is not None:
+                trace.set(cache="similar")
+                return self._done(dialog, cached)
+
+            with trace.stage("context"):
+                messages, used = self._build_messages(question, docs, dialog.history)
+            with trace.stage("llm_wait"):
+                await semaphore.acquire()
+            try:
+                with trace.stage("llm"):
+                    resp = await self._acreate(client, trace, semaphore, **self._completion_kwargs(messages))
+            finally:
+                semaphore.release()
+            trace.set_usage(getattr(resp, "usage", None))
+
+            answer = resp.choices[0].message.content
+            sources = [cite_source(d) for d in used]
+            result = self._remember(dialog, q_vec, docs, {"answer": answer, "sources": sources})
+            return self._done(dialog, result)
+
+    async def astream(self, question: str, trace: Trace = None, chat_id=None) -> AsyncIterator[Dict]:
+        """
+        Потоковая генерация (stream=True). Отдаёт события
+        {"type": "delta", "text": ...} по мере прихода токенов и в конце
+        {"type": "done", "answer": <полный текст>, "sources": [...]}.
+        Ответ из кеша или FactStore отдаётся одним delta.
+        В трассе llm_ttft — до первого токена, llm — вся генерация без
+        времени, пока потребитель обрабатывал события (правки в Telegram).
+        """
+        with self._tracing(trace, "astream", question) as trace:
+            dialog = self._dialog(question, chat_id, trace)
+            cached = self._fact_answer(dialog, trace)
+            if cached is None:
+                cached = self._cache_exact(dialog.query)
+                if cached is not None:
+                    trace.set(cache="exact")
+            client, semaphore = self._loop_bound()
+            if cached is None:
+                q_vec, docs = await self._asearch(dialog.query, trace)
+                cached = self._cache_similar(q_vec, docs)
+                if cached is not None:
+                    trace.set(cache="similar")
+            if cached is not None:
+                self._done(dialog, cached)
+                yield {"type": "delta", "text": cached["answer"]}
+                yield {"type": "done", **cached}
+                return
+
+            with trace.stage("context"):
+                messages, used = self._build_messages(question, docs, dialog.history)
+            parts = []
+            stream = None
+            with trace.stage("llm_wait"):
+                await semaphore.acquire()
+            try:
+                t0 = time.perf_counter()
+                paused = 0.0
+                stream = await self._acreate(
+                    client, trace, semaphore,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                    **self._completion_kwargs(messages),
+                )
+                async for chunk in stream:
+                    # usage приходит в последнем чанке (с пустым choices)
+                    trace.set_usage(getattr(chunk, "usage", None))
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        if not parts:
+                            trace.add("llm_ttft", time.perf_counter() - t0)
+                        parts.append(delta)
+                        t_yield = time.perf_counter()
+                        yield {"type": "delta", "text": delta}
+                        paused += time.perf_counter() - t_yield
+                trace.add("llm", time.perf_counter() - t0 - paused)
+            finally:
+                # поток закрывается и при отмене до первого чанка: иначе
+                # эндпоинт роутера и HTTP-соединение остаются заняты
+                if stream is not None:
+                    await close_stream(stream)
+                semaphore.release()
+
+            result = {"answer": "".join(parts), "sources": [cite_source(d) for d in used]}
+            self._done(dialog, self._remember(dialog, q_vec, docs, result))
+            yield {"type": "done", **result}
+
+    def close(self):
+        if self._batcher is not None:
+            self._batcher.close()
+        self._embed_executor.shutdown(wait=False)
+        if self._lexical_executor is not None:
+            self._lexical_executor.shutdown(wait=False)
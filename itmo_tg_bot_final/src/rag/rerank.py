@@ -0,0 +1,45 @@
+# src/rag/rerank.py
+import logging
+from typing import List
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# маленький многоязычный кросс-энкодер (MiniLM, 12 слоёв, 384) — укладывается в CPU
+DEFAULT_RERANK_MODEL = "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1"
+
+
+class CrossEncoderReranker:
+    """
+    Переранжирование кандидатов кросс-энкодером: пара (вопрос, чанк) целиком
+    проходит через трансформер, что точнее косинуса биэнкодера, но дороже —
+    поэтому только для десятка-другого кандидатов, пачками по batch_size.
+    Оценки в [0, 1] (sigmoid — активация по умолчанию для модели с одним выходом).
+    model — готовый объект с predict(pairs, batch_size=...) (например, в тестах).
+    """
+
+    def __init__(
+        self,
+        model_name: str = DEFAULT_RERANK_MODEL,
+        batch_size: int = 16,
+        max_length: int = 512,
+        device: str = "cpu",
+        model=None,
+    ):
+        if model is None:
+            from sentence_transformers import CrossEncoder
+
+            model = CrossEncoder(model_name, max_length=max_length, device=device)
+            logger.info("Loaded reranker %s on %s", model_name, device)
+        self.model = model
+        self.model_name = model_name
+        self.batch_size = batch_size
+
+    def score(self, query: str, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros(0, dtype="float32")
+        scores = self.model.predict(
+            [(query, t) for t in texts], batch_size=self.batch_size, show_progress_bar=False
+        )
+        return np.asarray(scores, dtype="float32").reshape(-1)
@@ -0,0 +1,398 @@
+# src/webhook.py
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import time
+import zlib
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from src.rag.metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+# ─── МАРШРУТИЗАЦИЯ ────────────────────────────────────────────────────────────────
+_CHAT_PATHS = (
+    ("message", "chat"), ("edited_message", "chat"), ("channel_post", "chat"),
+    ("edited_channel_post", "chat"), ("my_chat_member", "chat"), ("chat_member", "chat"),
+    ("chat_join_request", "chat"),
+)
+
+
+def chat_key(update: Dict):
+    """chat_id апдейта (для inline/callback без чата — id пользователя)."""
+    for field, sub in _CHAT_PATHS:
+        if isinstance(update.get(field), dict) and sub in update[field]:
+            return update[field][sub]["id"]
+    callback = update.get("callback_query") or {}
+    if isinstance(callback.get("message"), dict):
+        return callback["message"]["chat"]["id"]
+    for value in update.values():
+        if isinstance(value, dict) and isinstance(value.get("from"), dict):
+            return value["from"]["id"]
+    return update.get("update_id")
+
+
+def route(key, workers: int) -> int:
+    """Номер воркера по chat_id: crc32 одинаков во всех процессах и перезапусках."""
+    return zlib.crc32(str(key).encode("utf-8")) % workers
+
+
+# ─── ASGI-ФРОНТ ───────────────────────────────────────────────────────────────────
+class WebhookApp:
+    """
+    ASGI-приложение (uvicorn): POST <path> — апдейт Telegram, кладётся в очередь
+    воркера route(chat_id) и сразу подтверждается 200; полная очередь — 503,
+    Telegram повторит доставку позже. Заголовок X-Telegram-Bot-Api-Secret-Token
+    сверяется с secret. GET /health и GET /metrics — для мониторинга.
+    queues — по очереди на воркера (multiprocessing.Queue или queue.Queue).
+    """
+
+    def __init__(
+        self,
+        queues: List,
+        path: str = "/telegram",
+        secret: str = None,
+        metrics: Metrics = None,
+        on_startup: List[Callable[[], Awaitable]] = (),
+        on_shutdown: List[Callable[[], Awaitable]] = (),
+    ):
+        self.queues = queues
+        self.path = path
+        self.secret = secret
+        self.metrics = metrics or Metrics()
+        self.on_startup = list(on_startup)
+        self.on_shutdown = list(on_shutdown)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "http":
+            status, body = await self._http(scope, receive)
+            await send({
+                "type": "http.response.start",
+                "status": status,
+                "headers": [(b"content-type", b"text/plain; charset=utf-8")],
+            })
+            await send({"type": "http.response.body", "body": body})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            hooks = {"lifespan.startup": self.on_startup, "lifespan.shutdown": self.on_shutdown}.get(message["type"])
+            if hooks is None:
+                continue
+            phase = message["type"].split(".")[1]
+            try:
+                for hook in hooks:
+                    await hook()
+            except Exception as e:
+                logger.exception("Webhook %s failed", phase)
+                await send({"type": f"lifespan.{phase}.failed", "message": str(e)})
+                return
+            await send({"type": f"lifespan.{phase}.complete"})
+            if phase == "shutdown":
+                return
+
+    async def _read_body(self, receive) -> bytes:
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                return body
+
+    async def _http(self, scope, receive):
+        method, path = scope["method"], scope["path"]
+        if method == "GET" and path == "/health":
+            return 200, b"ok\n"
+        if method == "GET" and path == "/metrics":
+            return 200, self.metrics.render().encode("utf-8")
+        if path != self.path:
+            return 404, b"not found\n"
+        if method != "POST":
+            return 405, b"method not allowed\n"
+        headers = dict(scope.get("headers") or [])
+        if self.secret and headers.get(b"x-telegram-bot-api-secret-token", b"").decode() != self.secret:
+            return 403, b"forbidden\n"
+        try:
+            update = json.loads(await self._read_body(receive))
+        except ValueError:
+            return 400, b"bad json\n"
+        worker = route(chat_key(update), len(self.queues))
+        try:
+            self.queues[worker].put_nowait(("update", update))
+        except queue.Full:
+            self.metrics.inc("webhook_rejected_total", worker=worker)
+            return 503, b"busy\n"
+        self.metrics.inc("webhook_updates_total", worker=worker)
+        return 200, b"ok\n"
+
+    async def broadcast(self, message, timeout: float = None) -> List[bool]:
+        return await broadcast(self.queues, message, timeout)
+
+
+async def broadcast(queues, message, timeout: float = None) -> List[bool]:
+    """
+    Сообщение во все очереди воркеров. put блокирует, пока очередь полна,
+    поэтому идёт в пуле потоков, а не в event loop фронта.
+    Возвращает, в какие очереди сообщение попало за timeout.
+    """
+    loop = asyncio.get_running_loop()
+    return list(await asyncio.gather(
+        *(loop.run_in_executor(None, _put, q, message, timeout) for q in queues)
+    ))
+
+
+def _put(q, message, timeout: float = None) -> bool:
+    try:
+        q.put(message, timeout=timeout)
+        return True
+    except queue.Full:
+        return False
+
+
+# ─── ВОРКЕР ───────────────────────────────────────────────────────────────────────
+class ChatLanes:
+    """
+    Апдейты одного чата обрабатываются строго по очереди, разных чатов —
+    параллельно: на каждый чат с необработанными апдейтами своя очередь
+    и задача, которая её разбирает и исчезает, когда очередь опустела.
+    """
+
+    def __init__(self, handle: Callable[[Dict], Awaitable]):
+        self.handle = handle
+        self._lanes: Dict[object, asyncio.Queue] = {}
+        self._tasks = set()
+
+    def __len__(self) -> int:
+        return len(self._lanes)
+
+    def submit(self, key, item):
+        lane = self._lanes.get(key)
+        if lane is None:
+            lane = self._lanes[key] = asyncio.Queue()
+            task = asyncio.create_task(self._drain(key, lane))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        lane.put_nowait(item)
+
+    async def _drain(self, key, lane: asyncio.Queue):
+        while True:
+            try:
+                item = lane.get_nowait()
+            except asyncio.QueueEmpty:
+                del self._lanes[key]          # между get и del нет await — гонки нет
+                return
+            try:
+                await self.handle(item)
+            except Exception:
+                logger.exception("Update handling failed (chat %s)", key)
+
+    async def join(self):
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks))
+
+
+async def pump(get: Callable[[], object], lanes: ChatLanes, on_reload: Callable[[], Awaitable] = None):
+    """Читает ("update", data) | ("reload", None) | ("stop", None) из очереди воркера."""
+    loop = asyncio.get_running_loop()
+    while True:
+        kind, data = await loop.run_in_executor(None, get)
+        if kind == "update":
+            lanes.submit(chat_key(data), data)
+        elif kind == "reload" and on_reload is not None:
+            await on_reload()
+        elif kind == "stop":
+            await lanes.join()
+            return
+
+
+def worker_main(worker_id: int, workers: int, updates, ready=None):
+    """
+    Процесс-воркер: обработчики и конфиг — из src.bot, пайплайн — из
+    опубликованного снапшота индекса (mmap, общие страницы, только чтение).
+    WEB_WORKER_ID задаётся до импорта бота: от него зависят файл истории,
+    доля генераций vLLM на процесс и запрет записи снапшота.
+    ready — событие «пайплайн поднят» для супервизора.
+    """
+    os.environ["WEB_WORKER_ID"] = str(worker_id)
+    os.environ["WEB_WORKERS"] = str(workers)
+    from src import bot
+
+    asyncio.run(_worker(bot, worker_id, updates, ready))
+
+
+async def _worker(bot, worker_id: int, updates, ready=None):
+    from telegram import Update
+    from telegram.ext import ApplicationBuilder
+
+    from src.rag.metrics import start_metrics_server
+
+    loop = asyncio.get_running_loop()
+    t0 = time.perf_counter()
+    bot.pipeline = await loop.run_in_executor(None, bot.build_pipeline)
+    logger.info("Worker %d: pipeline ready in %.1fs", worker_id, time.perf_counter() - t0)
+    if ready is not None:
+        ready.set()
+    if bot.METRICS_PORT:
+        start_metrics_server(bot.METRICS, bot.METRICS_HOST, bot.METRICS_PORT + 1 + worker_id)
+
+    app = ApplicationBuilder().token(bot.TELEGRAM_TOKEN).updater(None).build()
+    bot.add_handlers(app)
+
+    async def reload():
+        # снапшот уже пересобран сборщиком: новый пайплайн поднимается из него
+        # с тем же эмбеддером, старый доживает запросы, которые его держат
+        old = bot.pipeline
+        bot.pipeline = await loop.run_in_executor(None, bot.build_pipeline, old.embedder, old.reranker)
+        loop.call_later(bot.QUEUE_MAX_WAIT + old.request_timeout, old.close)
+        logger.info("Worker %d: pipeline reloaded", worker_id)
+
+    async with app:
+        lanes = ChatLanes(lambda data: app.process_update(Update.de_json(data, app.bot)))
+        await pump(updates.get, lanes, reload)
+        await bot.post_shutdown(app)
+
+
+# ─── СБОРЩИК И СУПЕРВИЗОР ─────────────────────────────────────────────────────────
+def builder_main(scrape: bool = True):
+    """
+    Скрейпинг и пересборка снапшота индекса в отдельном процессе (память — на
+    время сборки). Единственный, кто пишет снапшот и кеш эмбеддингов.
+    """
+    from src import bot
+
+    if not scrape:
+        if bot.PROGRAMS_JSON.exists():
+            bot.build_pipeline().close()
+        return
+
+    async def refresh():
+        scraper = bot.make_scraper()
+        try:
+            await bot.refresh_programs(scraper)
+        finally:
+            await scraper.aclose()
+
+    asyncio.run(refresh())
+    if bot.PROGRAMS_JSON.exists():
+        bot.build_pipeline().close()
+
+
+class Supervisor:
+    """
+    Процессы режима вебхука: N воркеров (spawn) с очередями апдейтов,
+    перезапуск упавших, периодическая пересборка данных процессом-сборщиком
+    с рассылкой reload воркерам. Снапшот собирается до старта воркеров,
+    обновления начинаются, когда все воркеры подняли пайплайн.
+    """
+
+    def __init__(self, workers: int, queue_size: int = 256, refresh_interval: float = 0.0):
+        self.ctx = multiprocessing.get_context("spawn")
+        self.workers = workers
+        self.refresh_interval = refresh_interval
+        self.queues = [self.ctx.Queue(maxsize=queue_size) for _ in range(workers)]
+        self.procs: List[Optional[multiprocessing.Process]] = [None] * workers
+        self.ready = [self.ctx.Event() for _ in range(workers)]
+        # первый скрейпинг — как только воркеры готовы, как в режиме polling
+        self.next_refresh: Optional[float] = time.monotonic()
+
+    def _start(self, i: int):
+        self.ready[i].clear()
+        proc = self.ctx.Process(
+            target=worker_main, args=(i, self.workers, self.queues[i], self.ready[i]), name=f"rag-worker-{i}",
+        )
+        proc.start()
+        self.procs[i] = proc
+        logger.info("Started worker %d (pid %d)", i, proc.pid)
+
+    def start(self):
+        for i in range(self.workers):
+            self._start(i)
+
+    def build_sync(self, scrape: bool = True) -> bool:
+        proc = self.ctx.Process(target=builder_main, args=(scrape,), name="rag-builder")
+        proc.start()
+        proc.join()
+        if proc.exitcode != 0:
+            logger.error("Builder exited with %s", proc.exitcode)
+        return proc.exitcode == 0
+
+    async def run(self):
+        """Фоновая задача фронта: сторож воркеров и обновление данных."""
+        while True:
+            for i, proc in enumerate(self.procs):
+                if proc is not None and not proc.is_alive():
+                    logger.error("Worker %d died (exit %s), restarting", i, proc.exitcode)
+                    self._start(i)
+            due = self.next_refresh is not None and time.monotonic() >= self.next_refresh
+            if due and all(e.is_set() for e in self.ready):
+                if await asyncio.get_running_loop().run_in_executor(None, self.build_sync):
+                    await broadcast(self.queues, ("reload", None))
+                self.next_refresh = (
+                    time.monotonic() + self.refresh_interval if self.refresh_interval > 0 else None
+                )
+            await asyncio.sleep(1.0)
+
+    async def stop(self, timeout: float = 30.0):
+        """stop в очередь каждому воркеру; чья очередь так и не освободилась или кто не вышел за timeout — terminate."""
+        sent = await broadcast(self.queues, ("stop", None), timeout)
+        loop = asyncio.get_running_loop()
+        for i, proc in enumerate(self.procs):
+            if proc is None:
+                continue
+            if sent[i]:
+                await loop.run_in_executor(None, proc.join, timeout)
+            else:
+                logger.warning("Worker %d queue is full, terminating it", i)
+            if proc.is_alive():
+                proc.terminate()
+
+
+def serve(
+    token: str,
+    url: str,
+    secret: str = None,
+    host: str = "127.0.0.1",
+    port: int = 8080,
+    workers: int = 2,
+    queue_size: int = 256,
+    refresh_interval: float = 0.0,
+    data_ready: bool = True,
+):
+    """
+    Запуск режима вебхука: фронт на uvicorn (host:port, за TLS-прокси),
+    webhook в Telegram — url + "/telegram". До старта воркеров снапшот
+    собирается (или проверяется) сборщиком; data_ready=False (нет programs.json) —
+    сначала ещё и скрейпинг.
+    """
+    import uvicorn
+    from telegram import Bot, Update
+
+    supervisor = Supervisor(workers, queue_size, refresh_interval)
+    if not supervisor.build_sync(scrape=not data_ready):
+        logger.error("Initial index build failed, workers will use the last published snapshot")
+    supervisor.start()
+    tasks = []
+
+    async def startup():
+        async with Bot(token) as tg:
+            await tg.set_webhook(
+                url=url.rstrip("/") + "/telegram",
+                secret_token=secret,
+                allowed_updates=Update.ALL_TYPES,
+                max_connections=100,
+            )
+        tasks.append(asyncio.create_task(supervisor.run()))
+        logger.info("Webhook mode: %d workers, %s", workers, url)
+
+    async def shutdown():
+        for task in tasks:
+            task.cancel()
+        await supervisor.stop()
+
+    app = WebhookApp(supervisor.queues, "/telegram", secret, on_startup=[startup], on_shutdown=[shutdown])
+    uvicorn.run(app, host=host, port=port, lifespan="on", log_level="info")
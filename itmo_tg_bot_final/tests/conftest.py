@@ -0,0 +1,46 @@
+import hashlib
+
+import numpy as np
+import pytest
+
+
+class FakeEmbedder:
+    """Детерминированный эмбеддер без скачивания модели: bag-of-words по хешам слов."""
+
+    dim = 32
+
+    def __init__(self, *args, **kwargs):
+        self.calls = []
+
+    def encode(self, texts, **kwargs):
+        self.calls.append(list(texts))
+        out = np.zeros((len(texts), self.dim), dtype="float32")
+        for i, t in enumerate(texts):
+            for w in t.lower().split():
+                h = int(hashlib.md5(w.encode("utf-8")).hexdigest(), 16)
+                out[i, h % self.dim] += 1.0
+            out[i, 0] += 1e-3
+        return out
+
+
+@pytest.fixture
+def fake_embedder(monkeypatch):
+    import src.rag.openai_pipeline as pipeline_mod
+
+    monkeypatch.setattr(pipeline_mod, "load_embedder", FakeEmbedder)
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    monkeypatch.setenv("OPENAI_API_BASE", "http://127.0.0.1:9/v1")
+    return FakeEmbedder
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    js = tmp_path / "p.json"
+    js.write_text(
+        '[{"url":"u1","title":"AI Product","description":"продуктовый менеджмент"},'
+        '{"url":"u2","title":"Искусственный интеллект","description":"машинное обучение"}]',
+        encoding="utf-8",
+    )
+    pd = tmp_path / "pdfs"
+    pd.mkdir()
+    return js, pd
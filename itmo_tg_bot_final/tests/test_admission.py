@@ -0,0 +1,61 @@
+import asyncio
+
+import pytest
+
+from src.admission import AdmissionController, Rejected, TokenBucket
+
+
+def test_token_bucket():
+    b = TokenBucket(rate=1.0, burst=2)
+    now = b.updated
+    assert b.take(now) == 0 and b.take(now) == 0
+    assert b.take(now) == pytest.approx(1.0)
+    assert b.take(now + 1.0) == 0
+
+
+def test_fair_order_across_chats_and_shedding():
+    async def run():
+        adm = AdmissionController(max_concurrent=1, max_queue=3, rate_per_min=600, burst=10)
+        order, positions = [], []
+
+        async def request(chat, prio=0):
+            async def on_queued(pos):
+                positions.append((chat, pos))
+            await adm.acquire(chat, chat, prio, on_queued)
+            order.append(chat)
+            await asyncio.sleep(0.01)
+            adm.release(0.01)
+
+        tasks = [asyncio.create_task(request(c)) for c in ("a1", "a1", "a1")]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(request("b", prio=0)))
+        await asyncio.sleep(0)
+        with pytest.raises(Rejected) as e:
+            await adm.acquire("c", "c")                      # очередь полна
+        assert e.value.reason == "overloaded"
+        await asyncio.gather(*tasks)
+        return order, positions, adm
+
+    order, positions, adm = asyncio.run(run())
+    # «b» пришёл последним, но обгоняет второй и третий вопрос из того же чата
+    assert order == ["a1", "b", "a1", "a1"]
+    assert positions == [("a1", 1), ("a1", 2), ("b", 1)]
+    assert adm.active == 0 and adm.queued == 0
+
+
+def test_rate_limit_and_wait_timeout():
+    async def run():
+        adm = AdmissionController(max_concurrent=1, rate_per_min=60, burst=1, max_wait=0.05)
+        await adm.acquire(1, "u")
+        with pytest.raises(Rejected) as e:
+            await adm.acquire(1, "u")
+        assert e.value.reason == "rate_limited" and e.value.retry_after > 0
+        with pytest.raises(Rejected) as e:
+            await adm.acquire(2, "v")                        # слот занят дольше max_wait
+        assert e.value.reason == "timeout"
+        adm.release()
+        await adm.acquire(3, "w")
+        return adm
+
+    adm = asyncio.run(run())
+    assert adm.active == 1 and adm.queued == 0
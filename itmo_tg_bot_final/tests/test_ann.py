@@ -0,0 +1,61 @@
+import faiss
+import numpy as np
+import pytest
+
+from src.rag.ann import IndexParams, MmapFlatIndex, build_index, configure_search
+
+
+def clustered(n, dim=32, centers=50, seed=0):
+    rng = np.random.default_rng(seed)
+    c = rng.standard_normal((centers, dim))
+    x = c[rng.integers(0, centers, n)] + 0.3 * rng.standard_normal((n, dim))
+    x = x.astype("float32")
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+
+@pytest.mark.parametrize("kind", ["hnsw", "ivf"])
+def test_approximate_index_recall(kind):
+    x, q = clustered(5000), clustered(100, seed=1)
+    _, truth = build_index(x, IndexParams(kind="flat")).search(q, 10)
+    params = IndexParams(kind=kind)
+    index = build_index(x, params)
+    configure_search(index, params, 10)
+    _, found = index.search(q, 10)
+    recall = np.mean([len(set(a) & set(b)) / 10 for a, b in zip(found, truth)])
+    assert recall >= 0.9
+    assert np.allclose(index.reconstruct(7), x[7])
+
+
+def test_mmap_flat_matches_faiss():
+    x, q = clustered(1000), clustered(20, seed=1)
+    d_true, i_true = build_index(x, IndexParams(kind="flat")).search(q, 5)
+    index = MmapFlatIndex(x, block_rows=300)          # поиск блоками — те же результаты
+    d, i = index.search(q, 5)
+    assert index.ntotal == 1000 and (i == i_true).all() and np.allclose(d, d_true, atol=1e-5)
+    d, i = MmapFlatIndex(x[:3]).search(q[:1], 5)
+    assert list(i[0][3:]) == [-1, -1]
+    assert np.allclose(index.reconstruct_n(10, 2), x[10:12])
+
+
+def test_auto_switches_by_size():
+    p = IndexParams()
+    assert p.resolve(100) == "flat" and p.resolve(10_000) == "hnsw"
+    assert IndexParams(kind="ivf").build_key(100) == "ivf/none/nlist2"
+    assert IndexParams(quantization="pq").factory_string(1000, 1024) == "PQ64x8"
+
+
+@pytest.mark.parametrize("kind", ["hnsw", "ivf"])
+def test_pipeline_with_ann_index(corpus, fake_embedder, tmp_path, kind):
+    from src.rag.openai_pipeline import RAGService
+
+    js, pd = corpus
+    make = lambda: RAGService(model_name="m", json_path=js, pdf_dir=pd, top_k_retrieval=1,
+                              min_score=0.0, index_type=kind, cache_dir=tmp_path)
+    make()
+    rag = make()              # снапшот того же типа подхватывается как есть
+    assert isinstance(rag.index, {"hnsw": faiss.IndexHNSWFlat, "ivf": faiss.IndexIVFFlat}[kind])
+    assert rag.embedder.calls == []
+    rag.update_documents([{"source": "x.pdf", "page_content": "экзамен по математике"}])
+    assert rag._retrieve("экзамен по математике")[0]["source"] == "x.pdf"
+    rag.set_search_params(ef_search=128, nprobe=4)
+    assert rag._retrieve("машинное обучение")[0]["source"] == "u2"
@@ -0,0 +1,43 @@
+from types import SimpleNamespace
+
+import numpy as np
+
+from src.rag.answer_cache import AnswerCache, normalize_question
+
+
+class CountingClient:
+    def __init__(self):
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=self)
+
+    def create(self, **kwargs):
+        self.calls += 1
+        msg = SimpleNamespace(content=f"ответ {self.calls}")
+        return SimpleNamespace(choices=[SimpleNamespace(message=msg)])
+
+
+def test_normalize_and_lru():
+    assert normalize_question("  Сколько БЮДЖЕТНЫХ мест?! ") == "сколько бюджетных мест"
+    c = AnswerCache(max_entries=2)
+    v = np.ones(4, dtype="float32") / 2
+    for q in ("a", "b", "c"):
+        c.put(q, v, "k", {"answer": q})
+    assert c.get_exact("a") is None and c.get_exact("c")["answer"] == "c"
+    assert c.get_similar(v, "k") is not None
+    assert c.get_similar(v, "other-chunks") is None
+    assert c.stats() == {"size": 2, "hits": 2, "misses": 1}
+
+
+def test_ask_hits_cache_and_reindex_invalidates(corpus, fake_embedder):
+    from src.rag.openai_pipeline import RAGService
+
+    js, pd = corpus
+    rag = RAGService(model_name="m", json_path=js, pdf_dir=pd, chunk_size=50,
+                     chunk_overlap=0, min_score=0.0, answer_cache_similarity=0.99)
+    rag.client = CountingClient()
+    first = rag.ask("Что такое машинное обучение")
+    assert rag.ask("что такое машинное обучение?") == first
+    assert rag.ask("машинное обучение что такое") == first   # близкий по эмбеддингу
+    assert rag.client.calls == 1
+    rag.update_documents([{"source": "u2", "page_content": "машинное обучение и данные"}])
+    assert rag.ask("Что такое машинное обучение?")["answer"] == "ответ 2"
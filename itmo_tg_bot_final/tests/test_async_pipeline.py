@@ -0,0 +1,48 @@
+import asyncio
+import threading
+
+import pytest
+
+
+class SlowCompletions:
+    def __init__(self):
+        self.active = 0
+        self.peak = 0
+
+    async def create(self, **kwargs):
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        await asyncio.sleep(0.02)
+        self.active -= 1
+
+        class Msg:
+            content = "OK"
+
+        class Choice:
+            message = Msg()
+
+        class Resp:
+            choices = [Choice()]
+        return Resp()
+
+
+def test_aask_bounds_generations(corpus, fake_embedder):
+    from src.rag.openai_pipeline import RAGService
+
+    js, pd = corpus
+    rag = RAGService(model_name="m", json_path=js, pdf_dir=pd, chunk_size=50,
+                     chunk_overlap=0, max_concurrent_generations=2, embed_workers=1)
+    comps = SlowCompletions()
+
+    async def run():
+        client, _ = rag._loop_bound()
+        client.chat.completions = comps
+        threads_before = threading.active_count()
+        outs = await asyncio.gather(*(rag.aask(f"вопрос {i}") for i in range(10)))
+        return outs, threading.active_count() - threads_before
+
+    outs, extra_threads = asyncio.run(run())
+    assert all(o["answer"] == "OK" for o in outs)
+    assert comps.peak == 2
+    assert extra_threads <= 1
+    rag.close()
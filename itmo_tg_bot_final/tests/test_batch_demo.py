@@ -0,0 +1,40 @@
+import asyncio
+import json
+
+from scripts.llm_stub import StubLLM, start_stub_server
+from scripts.run_rag_demo import read_questions, run_batch, summarize
+
+
+def test_batch_run_writes_answers_and_summary(corpus, fake_embedder, tmp_path):
+    from src.rag.openai_pipeline import RAGService
+
+    js, pd = corpus
+    questions = tmp_path / "q.jsonl"
+    questions.write_text(
+        "\n".join(json.dumps({"id": i, "question": q}, ensure_ascii=False)
+                  for i, q in enumerate(["машинное обучение", "продуктовый менеджмент", "бюджетные места"] * 2)),
+        encoding="utf-8",
+    )
+    server, llm, base_url = start_stub_server(llm=StubLLM(decode_ms=1, output_tokens=4))
+    rag = RAGService(model_name="m", json_path=js, pdf_dir=pd, min_score=0.0,
+                     answer_cache_size=0, batch_max_size=1)
+    rag.api_base = base_url
+    out = tmp_path / "out" / "answers.jsonl"
+    records = asyncio.run(run_batch(rag, read_questions(questions), out, concurrency=3))
+    llm.down = True
+    failed = asyncio.run(run_batch(rag, [{"question": "машинное обучение"}], tmp_path / "f.jsonl", 1))
+    server.shutdown()
+    rag.close()
+
+    assert [r["n"] for r in records] == list(range(6)) and [r["id"] for r in records] == list(range(6))
+    lines = [json.loads(l) for l in out.read_text(encoding="utf-8").splitlines()]
+    assert sorted(l["n"] for l in lines) == list(range(6))
+    ok = [r for r in records if r["outcome"] == "ok"]
+    assert len(ok) == 6 and all(r["answer"] == "Ответ стаба." and r["scores"] and "llm" in r["stages"] for r in ok)
+    assert all(r["usage"]["completion_tokens"] == 4 for r in ok)
+    assert failed[0]["outcome"] == "error" and failed[0]["error"] and failed[0]["answer"] is None
+
+    summary = summarize(records + failed, wall=2.0)
+    assert summary["questions"] == 7 and summary["errors"] == 1
+    assert summary["throughput_qps"] == 3.5 and "p95" in summary["latency_s"]
+    assert summary["tokens"]["completion_tokens"] == 4 * 6
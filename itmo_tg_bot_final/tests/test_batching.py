@@ -0,0 +1,30 @@
+import threading
+import time
+
+from src.rag.batching import QueryBatcher
+
+
+def test_concurrent_queries_are_batched():
+    sizes = []
+
+    def batch_fn(qs):
+        sizes.append(len(qs))
+        time.sleep(0.02)
+        return [q.upper() for q in qs]
+
+    b = QueryBatcher(batch_fn, max_batch=8, max_wait_ms=5)
+    assert b.search("a") == "A"
+    futs = [b.submit(str(i)) for i in range(20)]
+    assert [f.result() for f in futs] == [str(i) for i in range(20)]
+    assert max(sizes) == 8 and sum(sizes) == 21
+    b.close()
+
+
+def test_errors_propagate_to_every_caller():
+    def boom(qs):
+        raise ValueError("x")
+
+    b = QueryBatcher(boom, max_batch=4)
+    futs = [b.submit("q") for _ in range(3)]
+    assert all(isinstance(f.exception(), ValueError) for f in futs)
+    b.close()
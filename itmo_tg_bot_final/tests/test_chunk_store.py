@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+from src.rag.chunk_store import ChunkStore
+
+
+def test_roundtrip(tmp_path):
+    chunks = [
+        {"page_content": "Машинное обучение", "source": "ai.pdf", "page": 3, "semester": "1"},
+        {"page_content": "", "source": "https://abit.itmo.ru/program/master/ai"},
+        {"page_content": "Практика", "source": "ai.pdf", "page": 4},
+    ]
+    store = ChunkStore.write(tmp_path / "chunks", chunks)
+    assert len(store) == 3 and list(store) == chunks
+    assert store[-1] == chunks[2] and store[1:] == chunks[1:]
+    assert len(store.columns["source"]) == 2            # значения метаданных хранятся один раз
+    with pytest.raises(IndexError):
+        store[3]
+
+
+@pytest.mark.parametrize("quantization", ["sq8", "pq"])
+def test_quantized_index_rescores_exactly(corpus, fake_embedder, tmp_path, quantization):
+    from src.rag.openai_pipeline import RAGService
+
+    js, pd = corpus
+    rag = RAGService(model_name="m", json_path=js, pdf_dir=pd, top_k_retrieval=2, min_score=0.0,
+                     quantization=quantization, cache_dir=tmp_path)
+    assert isinstance(rag.chunks, ChunkStore) and isinstance(rag._state.vectors, np.memmap)
+    rag.update_documents([{"source": "x.pdf", "page_content": "экзамен по математике"}])
+    vec, hits = rag._search_batch(["экзамен по математике"])[0]
+    assert hits[0][1]["source"] == "x.pdf"
+    # оценки — точный косинус по float-векторам, а не по кодам индекса
+    assert hits[0][0] == pytest.approx(float(rag._state.vectors[len(rag.chunks) - 1] @ vec), abs=1e-5)
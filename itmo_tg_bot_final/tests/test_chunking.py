@@ -0,0 +1,49 @@
+from src.parsers.pdf_parser import normalize_text
+from src.rag.chunking import StructuredChunker
+from src.rag.context import TokenCounter
+
+PLAN = """1 семестр
+Обязательные дисциплины
+Машинное обучение 6 216
+Глубокое обучение 3 108
+
+Пул выборных дисциплин
+Компьютерное зрение 3 108
+2 семестр
+Практика
+Научно-исследовательская работа 6 216"""
+
+
+def test_splits_on_semesters_and_blocks():
+    chunks = StructuredChunker(TokenCounter(), max_tokens=256).chunk(
+        {"page_content": PLAN, "source": "ai.pdf", "program": "ai"}
+    )
+    assert [(c["semester"], c["block"]) for c in chunks] == [
+        ("1", "Обязательные дисциплины"), ("1", "Пул выборных дисциплин"), ("2", "Практика"),
+    ]
+    assert all(c["program"] == "ai" for c in chunks)
+    # строки таблицы целиком попадают в один чанк
+    assert "Машинное обучение 6 216\nГлубокое обучение 3 108" in chunks[0]["page_content"]
+
+
+def test_long_section_gets_breadcrumb_and_fits_budget():
+    text = "1 семестр\nОбязательные дисциплины\n" + "\n".join(f"Дисциплина номер {i} 3 108" for i in range(40))
+    counter = TokenCounter()
+    chunks = StructuredChunker(counter, max_tokens=40).chunk({"page_content": text, "source": "x"})
+    assert len(chunks) > 1
+    assert all(counter.count(c["page_content"]) <= 40 + 10 for c in chunks)
+    assert chunks[1]["page_content"].startswith("[Семестр 1 / Обязательные дисциплины]")
+
+
+def test_normalize_pdf_artifacts():
+    assert normalize_text("Машинное\n \nобучение\n \n\n \nграфы") == "Машинное обучение\n\nграфы"
+    assert normalize_text("Научно\n-\nисследовательская") == "Научно-исследовательская"
+
+
+def test_pages_are_kept_for_citations():
+    from src.rag.openai_pipeline import cite_source
+
+    doc = {"source": "ai.pdf", "page_content": "", "pages": ["1 семестр\nПрактика\nНИР 3 108", "Стажировка 6 216"]}
+    chunks = StructuredChunker(TokenCounter(), max_tokens=256).chunk(doc)
+    assert len(chunks) == 1 and chunks[0]["semester"] == "1"
+    assert cite_source(chunks[0]) == "ai.pdf, стр. 1–2"
@@ -0,0 +1,36 @@
+from src.rag.context import TokenCounter, pack_context, render_context
+from src.rag.openai_pipeline import chunk_text_with_offsets
+
+
+def _chunks(text, source, size=10, overlap=4):
+    return [{"page_content": c, "source": source, "start": s}
+            for s, c in chunk_text_with_offsets(text, size, overlap)]
+
+
+def test_adjacent_chunks_are_merged_without_overlap():
+    text = "0123456789abcdefghijKLMNOP"
+    a = _chunks(text, "ai.pdf")
+    blocks, used = pack_context([a[1], a[0], a[3]], TokenCounter(), budget=100)
+    assert len(used) == 3
+    assert [b["text"] for b in blocks] == [text[:16], a[3]["page_content"]]
+    assert "[Источник: ai.pdf]" in render_context(blocks)
+
+
+def test_budget_and_duplicates():
+    counter = TokenCounter()
+    docs = [{"page_content": "x" * 30, "source": "a"},
+            {"page_content": "x" * 30, "source": "b"},
+            {"page_content": "y" * 300, "source": "c"},
+            {"page_content": "z" * 30, "source": "d"}]
+    blocks, used = pack_context(docs, counter, budget=25)
+    assert [d["source"] for d in used] == ["a", "d"]
+
+
+def test_missing_tokenizer_is_reported(corpus, fake_embedder, caplog):
+    from src.rag.openai_pipeline import RAGService
+
+    js, pd = corpus
+    # имя для API, а не HF id: токенизатор не грузится, бюджет — оценка по символам
+    rag = RAGService(model_name="m", json_path=js, pdf_dir=pd, tokenizer_name="/nonexistent/tokenizer")
+    assert rag.token_counter.tokenizer is None
+    assert "estimated" in caplog.text
@@ -0,0 +1,79 @@
+from src.rag.conversation import ConversationStore, is_followup
+
+
+class WordCounter:
+    def count(self, text):
+        return len(text.split())
+
+
+def test_followup_rewritten_with_thread_topic():
+    store = ConversationStore()
+    store.append(1, "Расскажи про программу AI Product", "Это программа ...")
+    query, topic = store.get(1).rewrite("а какие там элективы?")
+    assert query == "Расскажи про программу AI Product а какие там элективы?"
+    store.append(1, "а какие там элективы?", "Элективы: ...", topic)
+    # цепочка уточнений не растёт: тема остаётся исходным вопросом
+    assert store.get(1).rewrite("а сколько их?")[0] == "Расскажи про программу AI Product а сколько их?"
+    assert store.get(1).rewrite("Какие экзамены на программу ИИ?")[0] == "Какие экзамены на программу ИИ?"
+    assert store.get(2).rewrite("а там?") == ("а там?", "а там?")
+    assert not is_followup("Какой проходной балл на программу Искусственный интеллект в 2024 году?")
+
+
+def test_store_is_bounded_and_persists(tmp_path):
+    store = ConversationStore(max_chats=2, max_turns=2, max_answer_chars=10, path=tmp_path / "c.json")
+    for i in range(3):
+        store.append("a", f"вопрос {i}", "ответ " * 20)
+    store.append("b", "q", "a")
+    store.append("c", "q", "a")
+    assert len(store) == 2 and not store.get("a").turns          # вытеснен из LRU
+    store.save()
+
+    loaded = ConversationStore(max_chats=2, max_turns=2, path=tmp_path / "c.json")
+    assert [t.question for t in loaded.get("b").turns] == ["q"]
+
+    store.append("c", "вопрос 2", "ответ")
+    store.append("c", "вопрос 3", "ответ")
+    conv = store.get("c")
+    assert conv.summary == "q" and len(conv.turns) == 2
+    assert all(len(t.answer) <= 10 for t in store.get("c").turns)
+    counter = WordCounter()
+    full = conv.messages(counter, budget=1000)
+    assert [m["role"] for m in full] == ["system", "user", "assistant", "user", "assistant"]
+    tight = conv.messages(counter, budget=36)
+    assert [m["role"] for m in tight] == ["system", "user", "assistant"]
+    assert tight[0]["content"].endswith("q; вопрос 2")
+
+
+def test_pipeline_uses_history(corpus, fake_embedder):
+    from src.rag.openai_pipeline import RAGService
+
+    js, pd = corpus
+    rag = RAGService(model_name="m", json_path=js, pdf_dir=pd, min_score=0.0,
+                     conversations=ConversationStore())
+    rag.conversations.append(7, "Что такое AI Product?", "Программа про продуктовый менеджмент.")
+    trace = rag.metrics.trace("test")
+    dialog = rag._dialog("а какие там экзамены?", 7, trace)
+    assert trace.info["query"] == dialog.query == "Что такое AI Product? а какие там экзамены?"
+    messages, _ = rag._build_messages(dialog.question, rag._retrieve(dialog.query), dialog.history)
+    assert [m["role"] for m in messages] == ["system", "user", "assistant", "system", "user"]
+    assert messages[-1]["content"] == "а какие там экзамены?"
+    assert rag._dialog("а какие там экзамены?", None, trace).history == []
+
+
+def test_answer_with_history_is_not_cached(corpus, fake_embedder):
+    from src.rag.openai_pipeline import RAGService
+
+    js, pd = corpus
+    rag = RAGService(model_name="m", json_path=js, pdf_dir=pd, min_score=0.0,
+                     conversations=ConversationStore())
+    rag.conversations.append(7, "Что такое AI Product?", "Программа про продуктовый менеджмент.")
+    trace = rag.metrics.trace("test")
+    result = {"answer": "Экзамены по истории чата 7", "sources": []}
+    dialog = rag._dialog("а какие там экзамены?", 7, trace)
+    q_vec, docs = rag._search_batch([dialog.query])[0]
+    rag._remember(dialog, q_vec, [d for _, d in docs], result)
+    # другой чат с тем же самостоятельным запросом, но без истории — не получает чужой ответ
+    assert rag._cache_exact(dialog.query) is None
+    fresh = rag._dialog(dialog.query, None, trace)
+    rag._remember(fresh, q_vec, [d for _, d in docs], result)
+    assert rag._cache_exact(dialog.query) == result
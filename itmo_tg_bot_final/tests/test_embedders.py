@@ -0,0 +1,45 @@
+import os
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from src.rag.embedders import available_cores, load_embedder
+
+ROOT = Path(__file__).resolve().parents[1]
+
+
+def test_bot_import_skips_heavy_modules():
+    code = (
+        "import sys, src.bot; "
+        "print(','.join(m for m in ('torch', 'sentence_transformers', 'selenium', 'PyPDF2') if m in sys.modules))"
+    )
+    env = {**os.environ, "TELEGRAM_TOKEN": "test"}
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    assert out.stdout.strip() == ""
+
+
+def test_warm_page_cache_does_not_need_pdf_parser(tmp_path, monkeypatch):
+    from src.rag.openai_pipeline import load_pdf_docs
+
+    pd = tmp_path / "pdfs"
+    pd.mkdir()
+    shutil.copy(ROOT / "data" / "pdfs" / "ai.pdf", pd / "ai.pdf")
+    cold = load_pdf_docs(pd, cache_dir=tmp_path / "cache", max_workers=1)
+    # None в sys.modules — любой import модуля падает с ImportError
+    monkeypatch.setitem(sys.modules, "src.parsers.pdf_parser", None)
+    assert load_pdf_docs(pd, cache_dir=tmp_path / "cache") == cold
+
+
+def test_backend_validation():
+    assert available_cores() >= 1
+    with pytest.raises(ValueError):
+        load_embedder("m", backend="tensorrt")
+
+
+def test_onnx_backend_points_to_optional_requirements(tmp_path, monkeypatch):
+    monkeypatch.setitem(sys.modules, "onnxruntime", None)
+    with pytest.raises(ImportError, match="requirements_onnx.txt"):
+        load_embedder("m", backend="onnx-int8", export_dir=tmp_path)
@@ -0,0 +1,103 @@
+import numpy as np
+import pytest
+
+from src.rag.ann import MmapFlatIndex
+from src.rag.embedding_cache import SNAPSHOT_KEEP, EmbeddingCache, load_index_snapshot, save_index_snapshot
+from src.rag.lexical import MmapBM25Index
+
+
+def test_cache_encodes_only_missing(tmp_path):
+    calls = []
+
+    def enc(texts):
+        calls.append(list(texts))
+        return np.ones((len(texts), 4), dtype="float32") * len(calls)
+
+    c = EmbeddingCache(tmp_path, "m")
+    a = c.encode(["x", "y"], enc)
+    b = EmbeddingCache(tmp_path, "m").encode(["y", "z", "x"], enc)
+    assert calls == [["x", "y"], ["z"]]
+    assert np.allclose(b[0], a[1]) and np.allclose(b[2], a[0])
+    assert len(EmbeddingCache(tmp_path, "other")) == 0
+
+
+def test_rag_restart_uses_snapshot(corpus, tmp_path, fake_embedder):
+    from src.rag.openai_pipeline import RAGService
+
+    js, pd = corpus
+    kw = dict(model_name="m", json_path=js, pdf_dir=pd, chunk_size=10, chunk_overlap=0,
+              cache_dir=tmp_path / "cache")
+    first = RAGService(**kw)
+    assert first.embedder.calls
+    second = RAGService(**kw)
+    assert second.embedder.calls == []
+    assert {"embedding", "index"} <= set(first.startup_timings)
+    assert "load_snapshot" in second.startup_timings and "embedding" not in second.startup_timings
+    assert second.index.ntotal == first.index.ntotal == len(second.chunks)
+    # flat-индекс снапшота — поиск прямо по отображённым векторам (общие страницы у процессов)
+    assert isinstance(second.index, MmapFlatIndex)
+    assert load_index_snapshot(tmp_path / "cache" / "index", "bogus") is None
+
+
+def test_concurrent_caches_merge_on_save(tmp_path):
+    enc = lambda texts: np.ones((len(texts), 4), dtype="float32")
+    a, b = EmbeddingCache(tmp_path, "m"), EmbeddingCache(tmp_path, "m")
+    a.encode(["x"], enc)
+    b.encode(["y"], enc)
+    # вторая запись не затирает строки первой
+    assert len(EmbeddingCache(tmp_path, "m")) == 2
+    assert not list(tmp_path.rglob("*.tmp*"))
+
+
+def test_cache_appends_segments_and_prunes(tmp_path):
+    enc = lambda texts: np.arange(len(texts) * 4, dtype="float32").reshape(-1, 4)
+    c = EmbeddingCache(tmp_path, "m")
+    c.encode(["a", "b", "c"], enc)
+    c.encode(["a", "d"], enc)
+    # промах дописывает сегмент только с новой строкой, первый не переписан
+    sizes = sorted(np.load(p).shape[0] for p in c.dir.glob("seg.*.npy"))
+    assert sizes == [1, 3]
+    assert c.prune(["a", "b", "c", "d"]) == 0 and len(list(c.dir.glob("seg.*.npy"))) == 2
+    # половина строк уже не в корпусе — сливаем в один сегмент без них
+    assert c.prune(["a", "d"]) == 2
+    assert len(list(c.dir.glob("seg.*.npy"))) == 1
+    reopened = EmbeddingCache(tmp_path, "m")
+    assert len(reopened) == 2
+    assert np.allclose(reopened.encode(["d"], enc), c.encode(["d"], enc))
+
+
+def test_snapshot_versions_published_atomically(corpus, tmp_path, fake_embedder):
+    from src.rag.openai_pipeline import RAGService
+
+    js, pd = corpus
+    rag = RAGService(model_name="m", json_path=js, pdf_dir=pd, chunk_size=10, chunk_overlap=0)
+    snap = tmp_path / "index"
+    versions = [save_index_snapshot(snap, rag.index, rag.chunks, f"fp{i}") for i in range(SNAPSHOT_KEEP + 2)]
+    assert (snap / "CURRENT").read_text().strip() == versions[-1]
+    assert load_index_snapshot(snap, "fp0") is None
+    # предыдущая версия жива, пока её могут читать воркеры со старым указателем
+    assert load_index_snapshot(snap, version=versions[-2]) is not None
+    assert len(list(snap.glob("v.*"))) == SNAPSHOT_KEEP
+
+
+def test_readonly_worker_loads_published_snapshot(corpus, tmp_path, fake_embedder):
+    from src.rag.openai_pipeline import RAGService
+
+    js, pd = corpus
+    kw = dict(model_name="m", json_path=js, pdf_dir=pd, chunk_size=10, chunk_overlap=0,
+              cache_dir=tmp_path / "cache", hybrid=True)
+    with pytest.raises(RuntimeError):
+        RAGService(snapshot_readonly=True, **kw)
+    writer = RAGService(**kw)
+    published = sorted((tmp_path / "cache" / "index").glob("v.*"))
+    # другой chunk_size — другой fingerprint: воркер берёт опубликованный снапшот, а не пересобирает
+    worker = RAGService(snapshot_readonly=True, **dict(kw, chunk_size=20))
+    assert worker.embedder.calls == [] and worker.embed_cache is None
+    assert worker.index.ntotal == writer.index.ntotal
+    # документы не читаются и не чанкуются, BM25 — из снапшота через mmap
+    assert "load_docs" not in worker.startup_timings and "chunking" not in worker.startup_timings
+    assert isinstance(worker._state.lexical, MmapBM25Index) and isinstance(writer._state.lexical, MmapBM25Index)
+    assert worker.doc_sources == writer.doc_sources
+    assert worker._retrieve("машинное обучение") == writer._retrieve("машинное обучение")
+    worker.update_documents([{"source": "x", "page_content": "новое"}])
+    assert sorted((tmp_path / "cache" / "index").glob("v.*")) == published
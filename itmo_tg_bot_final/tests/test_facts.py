@@ -0,0 +1,96 @@
+import json
+
+from src.rag.facts import FactStore, IntentMatcher, parse_courses
+
+PLAN = {
+    "source": "ai.pdf",
+    "program": "ai",
+    "pages": [
+        "1 семестр\nОбязательные дисциплины\nМашинное обучение 6 216 Python для анализа данных 3 108\n"
+        "Пул выборных дисциплин\nГенеративные модели 3 108",
+        "2 семестр\nОбязательные дисциплины Глубокое обучение 6 216\nЭкзамен 2 90",
+    ],
+}
+PROGRAMS = [
+    {"slug": "ai", "title": "Искусственный интеллект", "url": "u2",
+     "manager_email": "ai@itmo.ru", "manager_phone": "+7 (812) 000-00-01"},
+    {"slug": "ai_product", "title": "Управление ИИ-продуктами/AI Product", "url": "u1",
+     "manager_email": "product@itmo.ru"},
+]
+
+
+def make_store(tmp_path):
+    js = tmp_path / "programs.json"
+    js.write_text(json.dumps(PROGRAMS, ensure_ascii=False), encoding="utf-8")
+    store = FactStore()
+    store.load_programs(js)
+    store.update([PLAN, {"source": "p.pdf", "program": "ai_product",
+                         "pages": ["1 семестр\nМашинное обучение 6 216\nПродуктовая аналитика 4 144"]}])
+    return store, js
+
+
+def test_parse_plan_rows():
+    courses = parse_courses(PLAN)
+    assert [c.name for c in courses] == [
+        "Машинное обучение", "Python для анализа данных", "Генеративные модели", "Глубокое обучение",
+    ]
+    gen, deep = courses[2], courses[3]
+    assert gen.elective and gen.semesters == ("1",) and (gen.credits, gen.hours) == (3, 108)
+    assert not deep.elective and deep.semesters == ("2",) and deep.page == 2
+
+
+def test_intents(tmp_path):
+    store, _ = make_store(tmp_path)
+    m = IntentMatcher(store)
+
+    r = m.match("Сколько кредитов у курса машинное обучение в ИИ?")
+    assert "6 з.е." in r["answer"] and r["sources"] == ["ai.pdf, стр. 1"]
+    # «AI Product» — это не ещё и «AI»
+    r = m.match("Какой email у менеджера AI Product?")
+    assert "product@itmo.ru" in r["answer"] and "ai@itmo.ru" not in r["answer"]
+    r = m.match("Чем отличаются ИИ и AI Product?")
+    assert "Общие дисциплины: Машинное обучение" in r["answer"]
+    assert "Продуктовая аналитика" in r["answer"] and sorted(r["sources"]) == ["ai.pdf", "p.pdf"]
+
+    assert m.match("Что изучают на программе Искусственный интеллект?") is None
+    # не вопросы о контактах, хоть и похожи по словам
+    for q in ("Почти все занятия онлайн?",
+              "Можно ли стать продакт-менеджером после AI Product?",
+              "Можно ли связать учебу с работой?",
+              "Кем работают выпускники: менеджер проектов или аналитик?"):
+        assert m.match(q) is None, q
+    # программа не названа — не перечисляем все
+    assert m.match("Какой телефон у менеджера?") is None
+    assert m.match("Чем отличаются программы?") is None
+    assert m.match("В каком семестре квантовая химия?") is None
+    # «когда»/«час» без слов о з.е. и семестрах — не справка о дисциплине
+    for q in ("Когда начинаются занятия по машинному обучению?",
+              "Во сколько начинается час машинного обучения?",
+              "Когда начинается приём документов?"):
+        assert m.match(q) is None, q
+    assert "216 ч" in m.match("Сколько часов у дисциплины глубокое обучение?")["answer"]
+
+    store.update([], remove_sources=["ai.pdf"])
+    assert m.match("В каком семестре глубокое обучение?") is None
+
+
+def test_dump_restore_round_trip(tmp_path):
+    store, _ = make_store(tmp_path)
+    restored = FactStore()
+    restored.restore(json.loads(json.dumps(store.dump())))
+    assert len(restored) == len(store)
+    assert restored.find_courses("глубокое обучение") == store.find_courses("глубокое обучение")
+
+
+def test_pipeline_answers_without_llm(tmp_path, fake_embedder):
+    from src.rag.openai_pipeline import RAGService
+
+    _, js = make_store(tmp_path)
+    pd = tmp_path / "pdfs"
+    pd.mkdir()
+    rag = RAGService(model_name="m", json_path=js, pdf_dir=pd, min_score=0.0)
+    trace = rag.metrics.trace("test")
+    # LLM недоступен (порт 9): ответ обязан прийти из FactStore
+    result = rag.ask("Как связаться с менеджером программы Искусственный интеллект?", trace=trace)
+    assert "ai@itmo.ru" in result["answer"] and result["sources"] == ["u2"]
+    assert trace.info["route"] == "facts" and "facts" in trace.stages
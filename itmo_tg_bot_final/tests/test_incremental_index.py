@@ -0,0 +1,31 @@
+import pytest
+
+
+@pytest.fixture
+def rag(corpus, fake_embedder):
+    from src.rag.openai_pipeline import RAGService
+
+    js, pd = corpus
+    return RAGService(model_name="m", json_path=js, pdf_dir=pd, chunk_size=50,
+                      chunk_overlap=0, top_k_retrieval=1, min_score=0.0)
+
+
+def test_update_only_embeds_changed(rag):
+    rag.embedder.calls.clear()
+    stats = rag.update_documents([
+        {"source": "u1", "page_content": "AI Product\n\nпродуктовый менеджмент\n\n"},
+        {"source": "new.pdf", "page_content": "экзамен по математике"},
+    ])
+    assert stats == {"added": ["new.pdf"], "replaced": [], "removed": []}
+    assert rag.embedder.calls == [["экзамен по математике"]]
+    assert rag.index.ntotal == len(rag.chunks) == 3
+    assert rag._retrieve("экзамен по математике")[0]["source"] == "new.pdf"
+
+
+def test_replace_and_remove(rag):
+    rag.update_documents([{"source": "u2", "page_content": "робототехника"}])
+    assert [c["page_content"] for c in rag.chunks if c["source"] == "u2"] == ["робототехника"]
+    stats = rag.remove_documents(["u1"])
+    assert stats["removed"] == ["u1"]
+    assert {c["source"] for c in rag.chunks} == {"u2"}
+    assert rag.index.ntotal == 1
@@ -0,0 +1,66 @@
+import numpy as np
+
+from src.rag.lexical import BM25Index, MmapBM25Index, rrf_fuse, stem_ru, tokenize_ru
+
+
+def test_stemming_and_tokenization():
+    assert stem_ru("алгоритмы") == stem_ru("алгоритмов") == "алгоритм"
+    assert stem_ru("программой") == stem_ru("программы")
+    assert tokenize_ru("Направление 02.04.03, Ёмкость") == ["направлен", "02.04.03", "емкост"]
+
+
+def test_bm25_finds_exact_terms_and_rrf():
+    idx = BM25Index(["курс по базам данных SQL", "нейронные сети и трансформеры", "алгоритмы Краскала"])
+    assert idx.search("алгоритм Краскала", 2)[0][1] == 2
+    assert idx.search("нейронная сеть", 1)[0][1] == 1
+    assert [i for _, i in rrf_fuse([[0, 1], [1, 2]], [1.0, 1.0])] == [1, 0, 2]
+
+
+def test_mmap_bm25_matches_in_memory(tmp_path):
+    texts = ["курс по базам данных SQL", "нейронные сети и трансформеры", "алгоритмы Краскала", "нейронные алгоритмы"]
+    idx = BM25Index(texts)
+    mm = MmapBM25Index.write(tmp_path / "bm25", idx)
+    for q in ("алгоритм Краскала", "нейронная сеть", "нет такого"):
+        assert mm.search(q, 3) == idx.search(q, 3)
+    assert mm.n_docs == 4 and isinstance(mm.doc_ids, np.memmap)
+
+
+def test_hybrid_retrieval_in_pipeline(corpus, fake_embedder):
+    from src.rag.openai_pipeline import RAGService
+
+    js, pd = corpus
+    rag = RAGService(model_name="m", json_path=js, pdf_dir=pd, chunk_size=50, chunk_overlap=0,
+                     top_k_retrieval=1, min_score=0.0, hybrid=True)
+    # словоформа не совпадает с текстом — помогает только стемминг BM25
+    assert rag._retrieve("машинного обучения")[0]["source"] == "u2"
+    rag.update_documents([{"source": "x.pdf", "page_content": "Краскал"}])
+    assert rag._state.lexical.n_docs == len(rag.chunks)
+
+
+def test_lexical_only_hit_reconstructs_single_row(corpus, fake_embedder):
+    from src.rag.openai_pipeline import RAGService
+
+    js, pd = corpus
+    rag = RAGService(model_name="m", json_path=js, pdf_dir=pd, chunk_size=50, chunk_overlap=0, hybrid=True)
+    rag.update_documents([{"source": f"f{i}", "page_content": f"прочее {i}"} for i in range(8)])
+
+    class Guard:
+        # без cache_dir векторов в памяти нет: косинус кандидата из BM25 — по строке индекса
+        def __init__(self, index):
+            self.index = index
+            self.rows = 0
+
+        def reconstruct(self, i):
+            self.rows += 1
+            return self.index.reconstruct(i)
+
+        def __getattr__(self, name):
+            if name == "reconstruct_n":
+                raise AssertionError("full index copy per query")
+            return getattr(self.index, name)
+
+    state = rag._state
+    assert state.vectors is None
+    guard = Guard(state.index)
+    vec = rag._vectors(state._replace(index=guard), [1])
+    assert guard.rows == 1 and np.allclose(vec[0], state.index.reconstruct(1))
@@ -0,0 +1,186 @@
+import asyncio
+import time
+
+import pytest
+
+from scripts.llm_stub import StubLLM, start_stub_server
+from src.rag.llm_router import Endpoint, LLMRouter, NoHealthyEndpoint
+from src.rag.metrics import Trace
+
+MSG = dict(model="m", messages=[{"role": "user", "content": "вопрос"}], max_tokens=4)
+
+
+@pytest.fixture
+def stubs():
+    servers = []
+
+    def make(**kw):
+        server, llm, url = start_stub_server(llm=StubLLM(prefix_cache=False, **kw))
+        servers.append(server)
+        return llm, Endpoint(url, name=f"ep{len(servers)}")
+
+    yield make
+    for s in servers:
+        s.shutdown()
+
+
+def test_least_loaded_spreads_requests(stubs):
+    (a, ep_a), (b, ep_b) = stubs(decode_ms=20), stubs(decode_ms=20)
+    router = LLMRouter([ep_a, ep_b], hedge_quantile=None)
+
+    async def run():
+        return await asyncio.gather(*(router.create(**MSG) for _ in range(8)))
+
+    outs = asyncio.run(run())
+    assert all(o.choices[0].message.content == "Ответ стаба." for o in outs)
+    assert a.requests == b.requests == 4
+    assert ep_a.outstanding == ep_b.outstanding == 0 and ep_a.ewma > 0
+
+
+def test_failover_and_circuit_breaker(stubs):
+    (a, ep_a), (b, ep_b) = stubs(), stubs()
+    a.down = True
+    router = LLMRouter([ep_a, ep_b], hedge_quantile=None, failure_threshold=2, cooldown=60)
+    trace = Trace("test")
+    for _ in range(5):
+        assert router.create_sync(trace=trace, **MSG).choices[0].message.content
+    assert a.requests == 2 and b.requests == 5               # после 2 сбоев a больше не пробуем
+    assert trace.info["llm_endpoint"] == "ep2"
+    assert router.metrics.counter("llm_circuit_open_total", endpoint="ep1") == 1
+
+    ep_a.open_until = time.monotonic()                       # пауза прошла: один пробный запрос
+    a.down = False
+    asyncio.run(router.create(**MSG))
+    assert a.requests == 3 and ep_a.open_until is None
+
+    b.down = a.down = True
+    for _ in range(2):
+        with pytest.raises(Exception):
+            router.create_sync(**MSG)
+    with pytest.raises(NoHealthyEndpoint):
+        router.create_sync(**MSG)                            # обе цепи разомкнуты — сразу отказ
+
+
+def test_fallback_tier_only_when_primaries_fail(stubs):
+    (a, ep_a), (f, ep_f) = stubs(), stubs()
+    ep_f.tier, ep_f.model, ep_f.vllm_params = 1, "external", False
+    router = LLMRouter([ep_f, ep_a], hedge_quantile=None)
+    router.create_sync(**MSG, extra_body={"top_k": 20})
+    assert (a.requests, f.requests) == (1, 0)
+    a.down = True
+    resp = router.create_sync(**MSG, extra_body={"top_k": 20})
+    assert f.requests == 1 and resp.model == "external"
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_hedge_to_faster_endpoint(stubs, stream):
+    (slow, ep_slow), (fast, ep_fast) = stubs(decode_ms=300), stubs(decode_ms=1)
+    router = LLMRouter([ep_slow, ep_fast], hedge_delay=0.1)
+    trace = Trace("test")
+
+    async def run():
+        t0 = time.perf_counter()
+        resp = await router.create(trace=trace, stream=stream, **MSG)
+        if stream:
+            text = "".join([c.choices[0].delta.content or "" async for c in resp if c.choices])
+        else:
+            text = resp.choices[0].message.content
+        return text, time.perf_counter() - t0
+
+    text, elapsed = asyncio.run(run())
+    assert text == "Ответ стаба." and elapsed < 0.6               # без дубля ждали бы 1.2 с
+    assert trace.info["llm_endpoint"] == "ep2" and trace.info["llm_hedged"]
+    assert (slow.requests, fast.requests) == (1, 1)
+    assert router.metrics.counter("llm_requests_total", endpoint="ep1", outcome="cancelled") == 1
+    assert ep_slow.outstanding == ep_fast.outstanding == 0
+
+
+def test_cancelled_half_open_probe_is_released(stubs):
+    (slow, ep_slow), (fast, ep_fast) = stubs(decode_ms=300), stubs(decode_ms=1)
+    ep_slow.failures, ep_slow.open_until = 3, time.monotonic()     # half-open
+    router = LLMRouter([ep_slow, ep_fast], hedge_delay=0.1)
+
+    asyncio.run(router.create(**MSG))
+    assert slow.requests == 1 and fast.requests == 1              # проба проиграла дублю и отменена
+    assert ep_slow.probing is None and ep_slow.available(time.monotonic())
+
+
+def test_unread_stream_releases_endpoint(stubs):
+    a, ep_a = stubs()
+    router = LLMRouter([ep_a], hedge_quantile=None)
+
+    async def run():
+        stream = await router.create(stream=True, **MSG)
+        assert ep_a.outstanding == 1
+        await stream.aclose()                                     # не читали ни одного чанка
+        await stream.aclose()                                     # повторное закрытие — без второго release
+        assert ep_a.outstanding == 0
+        dropped = await router.create(stream=True, **MSG)
+        del dropped                                               # брошенный поток
+
+    asyncio.run(run())
+    assert ep_a.outstanding == 0
+
+
+def test_cancelled_astream_closes_routed_stream(stubs, corpus, fake_embedder):
+    from src.rag.openai_pipeline import RAGService
+
+    a, ep_a = stubs(decode_ms=50)
+    js, pd = corpus
+    rag = RAGService(model_name="m", json_path=js, pdf_dir=pd, chunk_size=50, chunk_overlap=0,
+                     min_score=0.0, answer_cache_size=0, fact_answers=False,
+                     llm_router=LLMRouter([ep_a], hedge_quantile=None))
+
+    async def run():
+        gen = rag.astream("что такое машинное обучение")
+        assert (await gen.__anext__())["type"] == "delta"
+        await gen.aclose()                                        # потребитель ушёл посреди потока
+
+    asyncio.run(run())
+    assert ep_a.outstanding == 0
+
+
+def test_hedge_needs_free_generation_slot(stubs):
+    (slow, ep_slow), (fast, ep_fast) = stubs(decode_ms=100), stubs(decode_ms=1)
+    router = LLMRouter([ep_slow, ep_fast], hedge_delay=0.05)
+
+    async def run():
+        slots = asyncio.Semaphore(1)
+        async with slots:                                         # единственный слот занят основной попыткой
+            await router.create(slots=slots, **MSG)
+        assert not slots.locked()
+
+    asyncio.run(run())
+    assert (slow.requests, fast.requests) == (1, 0)
+
+
+def test_hedge_delay_from_p95():
+    ep = Endpoint("http://x/v1")
+    router = LLMRouter([ep])
+    for i in range(19):
+        ep.success(0.01 * (i + 1), "complete")
+    assert router.hedge_after(ep, "complete") is None            # мало замеров
+    ep.success(0.2, "complete")
+    assert router.hedge_after(ep, "complete") == pytest.approx(0.2)
+    assert router.hedge_after(ep, "stream") is None
+
+
+def test_pipeline_streams_through_router(stubs, corpus, fake_embedder):
+    from src.rag.openai_pipeline import RAGService
+
+    (a, ep_a), (b, ep_b) = stubs(), stubs()
+    a.down = True
+    js, pd = corpus
+    rag = RAGService(model_name="m", json_path=js, pdf_dir=pd, chunk_size=50, chunk_overlap=0,
+                     min_score=0.0, answer_cache_size=0, fact_answers=False,
+                     llm_router=LLMRouter([ep_a, ep_b], hedge_quantile=None))
+    trace = Trace("test")
+
+    async def run():
+        return [e async for e in rag.astream("что такое машинное обучение", trace=trace)]
+
+    events = asyncio.run(run())
+    assert events[-1]["answer"] == "Ответ стаба."
+    assert trace.info["llm_endpoint"] == "ep2" and trace.info["prompt_tokens"] > 0
+    assert asyncio.run(rag.aask("машинное обучение"))["answer"] == "Ответ стаба."
+    rag.close()
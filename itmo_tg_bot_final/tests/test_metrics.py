@@ -0,0 +1,63 @@
+import asyncio
+import logging
+import urllib.request
+
+from scripts.llm_stub import StubLLM, start_stub_server
+from src.rag.metrics import Metrics, start_metrics_server
+
+
+def test_finish_renders_prometheus_and_logs_slow(caplog):
+    m = Metrics(slow_threshold=0.0)
+    t = m.trace("ask", "вопрос")
+    t.add("embed", 0.003)
+    t.add("llm", 1.2)
+    t.set(prompt_tokens=100, cached_tokens=64, scores=[0.41, 0.7])
+    with caplog.at_level(logging.WARNING, logger="rag.slow"):
+        m.finish(t)
+    assert "Slow request" in caplog.text and '"llm": 1.2' in caplog.text
+
+    text = m.render()
+    assert 'rag_requests_total{kind="ask",outcome="ok"} 1' in text
+    assert 'rag_tokens_total{type="cached"} 64' in text
+    assert 'rag_stage_seconds_bucket{stage="embed",le="0.005"} 1' in text
+    assert 'rag_stage_seconds_bucket{stage="llm",le="1"} 0' in text
+    assert 'rag_stage_seconds_count{stage="llm"} 1' in text
+    assert 'rag_top_score_bucket{le="0.7"} 1' in text
+
+
+def test_aask_trace_against_stub(corpus, fake_embedder):
+    from src.rag.openai_pipeline import RAGService
+
+    server, llm, base_url = start_stub_server(llm=StubLLM(decode_ms=1.0))
+    js, pd = corpus
+    rag = RAGService(model_name="m", json_path=js, pdf_dir=pd, min_score=0.0)
+    rag.api_base = base_url
+
+    async def run():
+        trace = rag.metrics.trace("test", "машинное обучение")
+        await rag.aask("машинное обучение", trace=trace)
+        rag.metrics.finish(trace)                           # чужую трассу закрывает вызывающий
+        events = [e async for e in rag.astream("продуктовый менеджмент")]
+        await rag.aask("машинное обучение")                 # из кеша ответов
+        return trace, events
+
+    trace, events = asyncio.run(run())
+    server.shutdown()
+    assert {"retrieve", "embed", "search", "context", "llm_wait", "llm"} <= set(trace.stages)
+    assert trace.info["prompt_tokens"] > 0 and trace.info["completion_tokens"] == 16
+    assert trace.info["retrieved"] and trace.info["scores"]
+    assert events[-1]["type"] == "done"
+
+    m = rag.metrics
+    assert m.counter("rag_requests_total", kind="test", outcome="ok") == 1
+    assert m.counter("rag_requests_total", kind="astream", outcome="ok") == 1
+    assert m.counter("rag_cache_hits_total", kind="exact") == 1
+    assert m.histogram("rag_stage_seconds", stage="llm_ttft").count == 1
+    assert m.counter("rag_tokens_total", type="prompt") == llm.stats()["prompt_tokens"] > 0
+
+    metrics_server = start_metrics_server(m, port=0)
+    url = f"http://127.0.0.1:{metrics_server.server_address[1]}/metrics"
+    body = urllib.request.urlopen(url, timeout=5).read().decode("utf-8")
+    metrics_server.shutdown()
+    assert "# TYPE rag_stage_seconds histogram" in body
+    rag.close()
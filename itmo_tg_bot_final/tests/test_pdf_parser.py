@@ -17,3 +17,16 @@ def test_parse_and_extract(tmp_path):
     assert isinstance(text,str)
     struct=p.parse_structured(text)
     assert "raw" in struct and "sections" in struct
+
+def test_extract_pdfs_parallel_and_cached(tmp_path, monkeypatch):
+    import src.parsers.pdf_parser as pdf_parser
+    from src.parsers.page_store import PageStore
+    src = Path(__file__).resolve().parents[1] / "data" / "pdfs" / "ai.pdf"
+    fp = tmp_path / "ai.pdf"
+    fp.write_bytes(src.read_bytes())
+    store = PageStore(tmp_path / "pages")
+    pages = pdf_parser.extract_pdfs([fp], store=store, max_workers=2, pages_per_task=1)[fp]
+    assert pages == PDFParser().extract_pages(fp)
+    # второй раз — только из кеша страниц, PDF не парсится
+    monkeypatch.setattr(pdf_parser, "_extract_range", lambda *a: 1 / 0)
+    assert pdf_parser.extract_pdfs([fp], store=store)[fp] == pages
@@ -0,0 +1,28 @@
+from openai import OpenAI
+
+from scripts.llm_stub import StubLLM, start_stub_server
+
+
+def test_prefix_identical_across_questions(corpus, fake_embedder):
+    from src.rag.openai_pipeline import RAGService
+
+    js, pd = corpus
+    rag = RAGService(model_name="m", json_path=js, pdf_dir=pd, chunk_size=50,
+                     chunk_overlap=0, min_score=0.0, include_overview=True)
+    m1, _ = rag._build_messages("бюджетные места", rag._retrieve("бюджетные места"))
+    m2, _ = rag._build_messages("машинное обучение", rag._retrieve("машинное обучение"))
+    assert m1[0] == m2[0]
+    assert "Справка по программам" in m1[0]["content"] and "(u1)" in m1[0]["content"]
+    assert m1[-1] == {"role": "user", "content": "бюджетные места"}
+
+
+def test_stub_reports_prefix_cache_hits():
+    server, llm, base_url = start_stub_server(llm=StubLLM(decode_ms=0, block_size=4))
+    client = OpenAI(api_key="stub", base_url=base_url)
+    prefix = {"role": "system", "content": "длинный общий префикс " * 20}
+    first = client.chat.completions.create(model="s", messages=[prefix, {"role": "user", "content": "а"}])
+    second = client.chat.completions.create(model="s", messages=[prefix, {"role": "user", "content": "б"}])
+    server.shutdown()
+    assert first.usage.prompt_tokens_details.cached_tokens == 0
+    assert second.usage.prompt_tokens_details.cached_tokens > 100
+    assert first.choices[0].message.content == "Ответ стаба."
@@ -0,0 +1,37 @@
+from src.rag.rerank import CrossEncoderReranker
+
+
+class KeywordModel:
+    """Вместо кросс-энкодера: релевантен чанк, где есть слово «обучение»."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def predict(self, pairs, batch_size=16, show_progress_bar=False):
+        self.calls += 1
+        return [0.9 if "обучение" in text else 0.01 for _, text in pairs]
+
+
+def make_rag(corpus, model, **kw):
+    from src.rag.openai_pipeline import RAGService
+
+    js, pd = corpus
+    return RAGService(model_name="m", json_path=js, pdf_dir=pd, min_score=0.0, top_k_retrieval=2,
+                      reranker=CrossEncoderReranker(model=model), **kw)
+
+
+def test_rerank_keeps_only_relevant(corpus, fake_embedder):
+    model = KeywordModel()
+    rag = make_rag(corpus, model, rerank_dominance=1.0)
+    docs = rag._retrieve("продуктовый менеджмент")
+    assert model.calls == 1
+    assert [d["source"] for d in docs] == ["u2"]          # второй кандидат отсечён порогом
+
+
+def test_rerank_skipped_when_top_hit_dominates(corpus, fake_embedder):
+    model = KeywordModel()
+    rag = make_rag(corpus, model, rerank_dominance=0.0)
+    trace = rag.metrics.trace("test")
+    _, docs = rag._search("продуктовый менеджмент", trace)
+    assert model.calls == 0 and trace.info["rerank"] == "skipped"
+    assert len(docs) == 2
@@ -0,0 +1,68 @@
+import asyncio
+
+import httpx
+
+from src.parsers.scraper import AsyncScraper
+
+PAGE = """
+<html><body>
+  <h1>AI</h1>
+  <h2 id="about">О программе</h2><p>Desc</p>
+  <h2 id="study-plan">Учебный план</h2><a href="/files/ai.pdf">Скачать учебный план</a>
+  <a href="mailto:ai@itmo.ru">ai@itmo.ru</a>
+</body></html>
+"""
+
+
+def make_handler(calls):
+    def handler(request: httpx.Request):
+        calls.append((request.url.path, request.headers.get("if-none-match")))
+        if request.url.path == "/program/master/ai" and len(calls) == 1:
+            return httpx.Response(503)                       # первый раз — сбой, ждём повтор
+        etag = '"v1"'
+        if request.headers.get("if-none-match") == etag:
+            return httpx.Response(304)
+        body = PAGE if request.url.path.startswith("/program") else b"%PDF-1.4 fake"
+        return httpx.Response(200, headers={"ETag": etag}, content=body)
+    return handler
+
+
+def test_scrape_retries_and_conditional_requests(tmp_path):
+    calls = []
+    state = tmp_path / "http_state.json"
+
+    async def run():
+        async with AsyncScraper("https://abit.itmo.ru", pdf_dir=tmp_path / "pdfs", state_path=state,
+                                backoff=0.0, transport=httpx.MockTransport(make_handler(calls))) as s:
+            return await s.scrape(["https://abit.itmo.ru/program/master/ai"]), s.stats
+
+    (prog,), stats = asyncio.run(run())
+    assert prog["title"] == "AI" and prog["manager_email"] == "ai@itmo.ru"
+    assert prog["pdf_url"] == "https://abit.itmo.ru/files/ai.pdf"
+    assert (tmp_path / "pdfs" / "ai.pdf").read_bytes() == b"%PDF-1.4 fake"
+    assert stats == {"fetched": 2, "not_modified": 0, "retries": 1}
+
+    # второй обход (новый процесс): ничего не изменилось — только 304
+    (prog2,), stats = asyncio.run(run())
+    assert prog2 == prog
+    assert stats == {"fetched": 0, "not_modified": 2, "retries": 0}
+    assert all(etag == '"v1"' for _, etag in calls[-2:])
+
+
+def test_discover_catalog_pages():
+    def handler(request: httpx.Request):
+        page = int(request.url.params.get("page", 1))
+        links = {1: ["ai", "ai_product"], 2: ["robotics"]}.get(page, ["ai"])
+        body = "".join(f'<a href="/program/master/{s}">x</a>' for s in links)
+        return httpx.Response(200, text=body + '<script>{"href":"/program/master/ai"}</script>')
+
+    async def run():
+        async with AsyncScraper("https://abit.itmo.ru", per_host=2,
+                                transport=httpx.MockTransport(handler)) as s:
+            return await s.discover("https://abit.itmo.ru/programs/master")
+
+    assert asyncio.run(run()) == [
+        "https://abit.itmo.ru/program/master/ai",
+        "https://abit.itmo.ru/program/master/ai_product",
+        "https://abit.itmo.ru/program/master/robotics",
+    ]
@@ -0,0 +1,46 @@
+import asyncio
+import importlib
+from types import SimpleNamespace
+
+
+class FakeStream:
+    def __init__(self, pieces):
+        self.pieces = pieces
+
+    def __aiter__(self):
+        return self._gen()
+
+    async def _gen(self):
+        for p in self.pieces:
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=p))])
+
+
+class FakeCompletions:
+    async def create(self, stream=False, **kwargs):
+        assert stream
+        return FakeStream(["**Бюджет", "ных** мест", " 30"])
+
+
+def test_astream_yields_deltas_then_done(corpus, fake_embedder):
+    from src.rag.openai_pipeline import RAGService
+
+    js, pd = corpus
+    rag = RAGService(model_name="m", json_path=js, pdf_dir=pd, chunk_size=50, chunk_overlap=0)
+
+    async def run():
+        client, _ = rag._loop_bound()
+        client.chat.completions = FakeCompletions()
+        return [e async for e in rag.astream("сколько мест")]
+
+    events = asyncio.run(run())
+    assert [e["text"] for e in events[:-1]] == ["**Бюджет", "ных** мест", " 30"]
+    assert events[-1]["answer"] == "**Бюджетных** мест 30"
+    assert events[-1]["sources"]
+
+
+def test_md_to_html_safe_on_partial_text(monkeypatch):
+    monkeypatch.setenv("TELEGRAM_TOKEN", "x")
+    bot = importlib.import_module("src.bot")
+    assert bot.md_to_html("**a** <b") == "<b>a</b> &lt;b"
+    assert bot.md_to_html("**незакрыт") == "**незакрыт"
+    assert bot.split_text("a\n" * 5, limit=4) == ["a\na", "a\na", "a\n"]
@@ -0,0 +1,99 @@
+import asyncio
+import json
+import queue
+import zlib
+
+from src.webhook import ChatLanes, Supervisor, WebhookApp, broadcast, chat_key, pump, route
+
+
+def test_chat_key_and_route():
+    assert chat_key({"update_id": 1, "message": {"chat": {"id": 42}, "from": {"id": 7}}}) == 42
+    assert chat_key({"update_id": 2, "callback_query": {"from": {"id": 7}, "message": {"chat": {"id": -5}}}}) == -5
+    assert chat_key({"update_id": 3, "inline_query": {"from": {"id": 7}}}) == 7
+    assert chat_key({"update_id": 4}) == 4
+    # crc32, а не hash(): одинаково в любом процессе
+    assert route(42, 4) == zlib.crc32(b"42") % 4
+    assert {route(c, 3) for c in range(100)} == {0, 1, 2}
+
+
+def call(app, method, path, body=b"", headers=()):
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": method, "path": path, "headers": list(headers)}
+    asyncio.run(app(scope, receive, send))
+    return sent[0]["status"]
+
+
+def test_webhook_app_routes_and_sheds():
+    queues = [queue.Queue(maxsize=1), queue.Queue(maxsize=1)]
+    app = WebhookApp(queues, secret="s3cret")
+    ok = [(b"x-telegram-bot-api-secret-token", b"s3cret")]
+    update = json.dumps({"update_id": 1, "message": {"chat": {"id": 42}}}).encode()
+
+    assert call(app, "POST", "/telegram", update) == 403
+    assert call(app, "POST", "/telegram", b"{", ok) == 400
+    assert call(app, "POST", "/telegram", update, ok) == 200
+    assert queues[route(42, 2)].get_nowait() == ("update", json.loads(update))
+    assert call(app, "POST", "/telegram", update, ok) == 200
+    assert call(app, "POST", "/telegram", update, ok) == 503           # очередь воркера полна
+    assert call(app, "GET", "/health") == 200 and call(app, "GET", "/nope") == 404
+    assert app.metrics.counter("webhook_rejected_total", worker=route(42, 2)) == 1
+    assert "webhook_updates_total" in app.metrics.render()
+
+
+def test_broadcast_to_full_queue_does_not_block_loop():
+    queues = [queue.Queue(maxsize=1), queue.Queue(maxsize=1)]
+    queues[1].put(("update", {}))
+    ticks = []
+
+    async def run():
+        async def tick():
+            while True:
+                ticks.append(1)
+                await asyncio.sleep(0.01)
+
+        ticker = asyncio.create_task(tick())
+        sent = await broadcast(queues, ("stop", None), timeout=0.2)
+        ticker.cancel()
+        return sent
+
+    assert asyncio.run(run()) == [True, False]
+    assert len(ticks) > 5                                              # event loop жил, пока ждали очередь
+
+
+def test_supervisor_stop_with_full_queue():
+    sup = Supervisor(workers=1, queue_size=1)
+    sup.queues[0].put(("update", {}))
+    asyncio.run(asyncio.wait_for(sup.stop(timeout=0.2), 5))
+
+
+def test_chat_lanes_order_and_parallelism():
+    async def run():
+        log, running, peak = [], set(), []
+
+        async def handle(data):
+            chat = data["message"]["chat"]["id"]
+            running.add(chat)
+            peak.append(len(running))
+            await asyncio.sleep(0.01)
+            running.discard(chat)
+            log.append((chat, data["n"]))
+
+        lanes = ChatLanes(handle)
+        q = queue.Queue()
+        for n in range(3):
+            for chat in (1, 2):
+                q.put(("update", {"message": {"chat": {"id": chat}}, "n": n}))
+        q.put(("stop", None))
+        await pump(q.get, lanes)
+        return log, max(peak), len(lanes)
+
+    log, peak, left = asyncio.run(run())
+    assert [n for chat, n in log if chat == 1] == [0, 1, 2]      # внутри чата — по порядку
+    assert peak == 2 and left == 0                                # чаты — параллельно